@@ -1,16 +1,19 @@
 from flask import Flask, session
+from flask.logging import default_handler
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+import atexit
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+
+from app.sharding import ShardRoutingSession
 
 
 # Initialize extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': ShardRoutingSession})
 login_manager = LoginManager()
 csrf = CSRFProtect()
 limiter = Limiter(
@@ -31,48 +34,94 @@ def load_user(user_id):
     if user_type == 'admin':
         return Admin.query.get(user_id)
     else:
+        # The participant's own pages read and write their shard
+        from app.sharding import use_shard, shard_for_state_id
+        use_shard(shard_for_state_id(user_id))
         return User.query.get(user_id)
 
 
 def configure_logging(app):
-    """Configure application logging"""
+    """
+    Configure application logging.
+
+    Records are written as JSON lines by a background thread (see
+    app/structured_logging.py), so requests never wait on file I/O.
+    """
+    from app.structured_logging import (
+        JsonFormatter,
+        LockingRotatingFileHandler,
+        RequestContextFilter,
+        SamplingFilter,
+        init_request_logging,
+        start_queue_logging
+    )
+
     # Create logs directory if it doesn't exist
     if not os.path.exists(app.config['LOG_DIR']):
         os.makedirs(app.config['LOG_DIR'])
 
-    # Set up file handler with rotation
-    file_handler = RotatingFileHandler(
+    # Set up file handler with rotation shared safely between workers
+    file_handler = LockingRotatingFileHandler(
         app.config['LOG_FILE'],
         maxBytes=app.config['LOG_MAX_BYTES'],
         backupCount=app.config['LOG_BACKUP_COUNT']
     )
-
-    # Set logging format
-    formatter = logging.Formatter(
-        '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
-    )
-    file_handler.setFormatter(formatter)
+    file_handler.setFormatter(JsonFormatter())
 
     # Set logging level from config
     log_level = getattr(logging, app.config['LOG_LEVEL'].upper())
     file_handler.setLevel(log_level)
 
-    # Add handler to app logger
-    app.logger.addHandler(file_handler)
+    # Add queue handler to app logger; the listener thread does the writing
+    listener = start_queue_logging(app.logger, file_handler, filters=(
+        RequestContextFilter(),
+        SamplingFilter(app.config['LOG_SAMPLING'], burst=app.config['LOG_SAMPLE_BURST'])
+    ))
+    app.extensions['log_listener'] = listener
+    atexit.register(listener.stop)
     app.logger.setLevel(log_level)
 
+    # Flask's stderr handler writes synchronously on the request thread
+    if not app.config['LOG_TO_STDERR']:
+        app.logger.removeHandler(default_handler)
+
+    init_request_logging(app)
+
     # Log application startup
     app.logger.info('CBT Assessment application startup')
 
 
-def create_app():
+def create_app(config_name=None):
+    """
+    Application factory.
+
+    The configuration is chosen by `config_name`, then the FLASK_CONFIG or
+    FLASK_ENV environment variables, falling back to development.
+    """
+    from app.profiling import StartupTimer
+    timer = StartupTimer()
+
     app = Flask(__name__)
 
     # Configuration
-    app.config.from_object('config.DevelopmentConfig')
+    from config import config
+    config_name = config_name or os.environ.get('FLASK_CONFIG') or os.environ.get('FLASK_ENV') or 'default'
+    if config_name not in config:
+        # Falling back to development settings in production would be worse than not starting
+        raise ValueError(f"Unknown configuration '{config_name}' (from FLASK_CONFIG/FLASK_ENV); "
+                         f"expected one of: {', '.join(sorted(config))}")
+    app.config.from_object(config[config_name]())
+    timer.mark('config')
 
     # Configure logging
     configure_logging(app)
+    timer.mark('logging')
+
+    # Shard binds and pool settings have to be configured before the engines are created
+    from app.sharding import init_sharding
+    from app.serving import init_serving
+    init_sharding(app)
+    init_serving(app)
 
     # Initialize extensions with app
     db.init_app(app)
@@ -81,8 +130,40 @@ def create_app():
     csrf.init_app(app)
     limiter.init_app(app)
 
+    from app.profiling import init_server_timing
+    from app.sessions import init_sessions
+    from app.index_advisor import init_query_capture
+    from app.audit import init_audit
+    from app.dwell import init_dwell
+    init_server_timing(app)
+    init_sessions(app)
+    init_query_capture(app)
+    init_audit(app)
+    init_dwell(app)
+    timer.mark('extensions')
+
     # Register blueprints
     from app.routes import register_blueprints
     register_blueprints(app)
+    timer.mark('blueprints')
+
+    # Register CLI commands
+    from app.commands import register_commands
+    register_commands(app)
+    timer.mark('commands')
+
+    # Load templates from the bytecode cache before the first request
+    from app.templating import configure_template_cache, precompile_templates
+    configure_template_cache(app)
+    if app.config['TEMPLATE_PRELOAD']:
+        precompile_templates(app)
+    timer.mark('templates')
+
+    # Serve fingerprinted static files if `flask assets build` has been run
+    from app.assets import init_assets
+    init_assets(app)
+    timer.mark('assets')
+
+    app.extensions['startup_timer'] = timer
 
     return app
@@ -0,0 +1,142 @@
+"""
+Fingerprinted, precompressed static assets for the CBT Application
+
+`flask assets build` copies every file under app/static to a content-hashed
+name (css/style.css -> css/style.1a2b3c4d5e6f.css) together with gzip and
+brotli variants, and writes a manifest. At runtime url_for('static', ...)
+emits the hashed names, and those files are served with far-future
+immutable cache headers and the best encoding the client accepts.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+from flask import current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:  # brotli is optional; gzip is always produced
+        brotli = None
+
+MANIFEST_NAME = 'manifest.json'
+
+# Binary formats (images, fonts) are already compressed
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map'}
+
+# Preferred first when the client accepts several
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def build_assets(static_folder, build_dir):
+    """
+    Write fingerprinted copies and compressed variants of every static file.
+
+    Hashed files from earlier builds are left in place so pages cached by
+    clients that still reference them keep working. Returns the manifest.
+    """
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            filename = os.path.relpath(source, static_folder).replace(os.sep, '/')
+
+            with open(source, 'rb') as f:
+                data = f.read()
+
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            stem, ext = os.path.splitext(filename)
+            hashed = f'{stem}.{digest}{ext}'
+
+            target = os.path.join(build_dir, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+
+            encodings = []
+            if ext in COMPRESSIBLE_EXTENSIONS:
+                for encoding, suffix in ENCODINGS:
+                    if encoding == 'br' and brotli is None:
+                        continue
+                    compressed = _compress(data, encoding)
+                    if len(compressed) < len(data):
+                        with open(target + suffix, 'wb') as f:
+                            f.write(compressed)
+                        encodings.append(encoding)
+
+            manifest[filename] = {'path': hashed, 'size': len(data), 'encodings': encodings}
+
+    with open(os.path.join(build_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def load_manifest(build_dir):
+    """Read the asset manifest, or return an empty one if assets aren't built"""
+    try:
+        with open(os.path.join(build_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def send_static_asset(filename):
+    """
+    View for the 'static' endpoint.
+
+    Fingerprinted files are served from the build directory, immutable and
+    precompressed; anything else falls back to Flask's normal static view.
+    """
+    asset = current_app.extensions['static_assets'].get(filename)
+    if asset is None:
+        return current_app.send_static_file(filename)
+
+    build_dir = current_app.config['STATIC_BUILD_DIR']
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    served_name, content_encoding = filename, None
+    for encoding, suffix in ENCODINGS:
+        if encoding in asset['encodings'] and request.accept_encodings[encoding]:
+            served_name, content_encoding = filename + suffix, encoding
+            break
+
+    response = send_from_directory(build_dir, served_name, mimetype=mimetype,
+                                   max_age=IMMUTABLE_MAX_AGE, conditional=True)
+    response.cache_control.immutable = True
+    response.cache_control.public = True
+    response.vary.add('Accept-Encoding')
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    return response
+
+
+def init_assets(app):
+    """Serve fingerprinted assets and rewrite url_for('static') to use them"""
+    manifest = load_manifest(app.config['STATIC_BUILD_DIR'])
+
+    # Keyed by the fingerprinted name, which is what requests arrive with
+    app.extensions['static_assets'] = {asset['path']: asset for asset in manifest.values()}
+    app.extensions['asset_manifest'] = manifest
+
+    if not manifest:
+        return
+
+    @app.url_defaults
+    def fingerprint_static_url(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]['path']
+
+    app.view_functions['static'] = send_static_asset
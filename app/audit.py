@@ -0,0 +1,153 @@
+"""
+Audit trail for the CBT Application
+
+Security-relevant events (logins, reviews, user and admin changes) are
+written to the append-only audit_events table, alongside the text log.
+record() only appends to an in-process buffer (see app/batching.py).
+The buffer is written with one multi-row INSERT when it reaches
+AUDIT_BUFFER_SIZE events, every AUDIT_FLUSH_SECONDS from a background
+thread, and at the end of any request that recorded a critical event (account changes, reviews), so
+those are stored before the response is sent. It is written on its own
+connection to the main database, never as part of the request's
+transaction, so a rolled back request can't lose its audit events.
+
+UPDATE and DELETE on audit_events are refused by database triggers (see
+register_audit_ddl()).
+"""
+import atexit
+from datetime import datetime, timezone
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import DDL, event
+
+# Every action recorded, for the supervisor audit page's filter
+AUDIT_ACTIONS = (
+    'login', 'login_failed', 'logout', 'review_submitted',
+    'user_created', 'user_updated', 'user_deactivated', 'user_reactivated', 'users_bulk_updated',
+    'admin_created', 'admin_updated', 'admin_deactivated', 'admin_reactivated',
+    'caseloads_rebalanced'
+)
+
+
+def _actor():
+    from flask_login import current_user
+    from app.models import Admin
+
+    if not current_user or not current_user.is_authenticated:
+        return 'anonymous', None
+    return ('admin' if isinstance(current_user, Admin) else 'participant'), current_user.get_id()
+
+
+def record(action, target_type=None, target_id=None, details=None, actor_type=None, actor_id=None, critical=False):
+    """
+    Record an audit event.
+
+    The actor defaults to the logged in user; pass it for events such as a
+    login, where the user isn't logged in yet. critical events are written
+    before the request's response is sent.
+    """
+    buffer = current_app.extensions.get('audit')
+    if buffer is None:
+        return
+
+    if actor_type is None:
+        actor_type, actor_id = _actor()
+
+    buffer.append({
+        'occurred_at': datetime.now(timezone.utc),
+        'actor_type': actor_type,
+        'actor_id': actor_id,
+        'action': action,
+        'target_type': target_type,
+        'target_id': None if target_id is None else str(target_id),
+        'details': details,
+        'ip_address': request.remote_addr if has_request_context() else None,
+        'request_id': g.get('request_id') if has_request_context() else None
+    })
+
+    if critical and has_request_context():
+        g.audit_flush = True
+
+
+def flush():
+    """Write this process's buffered events now"""
+    buffer = current_app.extensions.get('audit')
+    return buffer.flush() if buffer is not None else 0
+
+
+def query_events(actor_id=None, target_type=None, target_id=None, action=None,
+                 start=None, end=None, before=None, limit=50):
+    """
+    Audit events matching the filters, newest first; returns (events, next_before).
+
+    Pages are keyset-paginated: pass next_before back as `before` for the
+    next page (None when there is no next page).
+    """
+    from app import db
+    from app.models import AuditEvent
+
+    query = AuditEvent.query
+    if actor_id:
+        query = query.filter(AuditEvent.actor_id == actor_id)
+    if target_type:
+        query = query.filter(AuditEvent.target_type == target_type)
+    if target_id:
+        query = query.filter(AuditEvent.target_id == target_id)
+    if action:
+        query = query.filter(AuditEvent.action == action)
+    if start:
+        query = query.filter(AuditEvent.occurred_at >= start)
+    if end:
+        query = query.filter(AuditEvent.occurred_at < end)
+
+    if before:
+        cursor = db.session.get(AuditEvent, before)
+        if cursor is not None:
+            query = query.filter(db.or_(
+                AuditEvent.occurred_at < cursor.occurred_at,
+                db.and_(AuditEvent.occurred_at == cursor.occurred_at, AuditEvent.event_id < cursor.event_id)
+            ))
+
+    events = query.order_by(AuditEvent.occurred_at.desc(), AuditEvent.event_id.desc()).limit(limit + 1).all()
+    if len(events) > limit:
+        return events[:limit], events[limit - 1].event_id
+    return events, None
+
+
+def register_audit_ddl(audit_table):
+    """Create the triggers that keep audit_events append-only along with the table"""
+    for operation in ('UPDATE', 'DELETE'):
+        event.listen(audit_table, 'after_create', DDL(
+            f"CREATE TRIGGER audit_events_no_{operation.lower()} BEFORE {operation} ON audit_events "
+            f"BEGIN SELECT RAISE(ABORT, 'audit_events is append-only'); END"
+        ).execute_if(dialect='sqlite'))
+
+    event.listen(audit_table, 'after_create', DDL(
+        "CREATE OR REPLACE FUNCTION audit_events_append_only() RETURNS trigger AS $$ "
+        "BEGIN RAISE EXCEPTION 'audit_events is append-only'; END $$ LANGUAGE plpgsql"
+    ).execute_if(dialect='postgresql'))
+    event.listen(audit_table, 'after_create', DDL(
+        "CREATE TRIGGER audit_events_append_only BEFORE UPDATE OR DELETE ON audit_events "
+        "FOR EACH STATEMENT EXECUTE FUNCTION audit_events_append_only()"
+    ).execute_if(dialect='postgresql'))
+
+
+def init_audit(app):
+    """Buffer audit events, flushing critical ones when their request ends"""
+    from app.batching import InsertBuffer
+    from app.models import AuditEvent
+
+    if 'audit' in app.extensions:
+        return
+
+    buffer = InsertBuffer(app, AuditEvent.__table__, app.config['AUDIT_BUFFER_SIZE'],
+                          app.config['AUDIT_FLUSH_SECONDS'], 'audit')
+    app.extensions['audit'] = buffer
+
+    @app.after_request
+    def flush_critical(response):
+        if g.pop('audit_flush', False):
+            buffer.flush()
+        return response
+
+    atexit.register(buffer.flush)
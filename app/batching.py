@@ -0,0 +1,87 @@
+"""
+Batched inserts for the CBT Application
+
+An InsertBuffer collects rows for one table in memory and writes them
+with a single multi-row INSERT: when `size` rows are waiting, every
+`interval` seconds from a background thread, on flush(), and at exit.
+Each batch is written on its own connection to the main database, never
+as part of a request's transaction. The audit trail (app/audit.py) and
+question timing events (app/dwell.py) are written this way.
+"""
+import threading
+
+from sqlalchemy.exc import SQLAlchemyError
+
+# Batches kept while the database is unreachable, before the oldest rows are dropped
+MAX_BACKLOG_BATCHES = 20
+
+
+class InsertBuffer:
+    """Per-process buffer of rows for one table, flushed in batches"""
+
+    def __init__(self, app, table, size, interval, name):
+        self.app = app
+        self.table = table
+        self.size = size
+        self.interval = interval
+        self.name = name
+        self.rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+
+    def append(self, row):
+        with self._lock:
+            self.rows.append(row)
+            full = len(self.rows) >= self.size
+        self._start_timer()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of rows written"""
+        from app import db
+
+        # One writer at a time keeps batches in order
+        with self._flush_lock:
+            with self._lock:
+                rows, self.rows = self.rows, []
+            if not rows:
+                return 0
+
+            try:
+                with self.app.app_context():
+                    with db.engine.begin() as conn:
+                        conn.execute(self.table.insert(), rows)
+            except SQLAlchemyError as e:
+                with self._lock:
+                    # Keep them for the next flush, but don't grow without bound
+                    self.rows[:0] = rows
+                    dropped = len(self.rows) - self.size * MAX_BACKLOG_BATCHES
+                    if dropped > 0:
+                        del self.rows[:dropped]
+                self.app.logger.error(f'{self.name} flush failed: rows={len(rows)}, '
+                                      f'dropped={max(dropped, 0)}, error={str(e)}')
+                return 0
+            return len(rows)
+
+    def _start_timer(self):
+        if self._timer is not None and self._timer.is_alive():
+            return
+        with self._lock:
+            if self._timer is not None and self._timer.is_alive():
+                return
+            self._stop = threading.Event()
+            self._timer = threading.Thread(target=self._run, name=f'{self.name}-flush', daemon=True)
+            self._timer.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def reset(self):
+        """Forget the buffer and timer thread inherited from a forked parent"""
+        self.rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
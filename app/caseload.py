@@ -0,0 +1,75 @@
+"""
+Clinician caseload for the CBT Application
+
+Every participant assigned to a clinician with their current step, latest
+attempt status, unreviewed submissions and how long the oldest of those
+has been waiting - computed in a single grouped statement, so the page
+costs the same whether a clinician carries ten participants or several
+hundred.
+"""
+from datetime import datetime, timezone
+
+
+def clinician_caseload(admin_id):
+    """
+    One row per active participant assigned to `admin_id`.
+
+    Rows carry state_id, first_name, last_name, current_step, unreviewed
+    (submitted attempts not yet reviewed), waiting_since (the oldest of
+    those), latest_attempt_id and latest_status. Participants with the
+    longest wait come first. With sharding, each shard is queried in
+    parallel and the rows merged in the same order.
+    """
+    from app.sharding import gather_all
+
+    return sorted(gather_all(_shard_caseload, admin_id), key=lambda row: (
+        row.waiting_since is None,
+        row.waiting_since or datetime.min,
+        row.last_name,
+        row.first_name
+    ))
+
+
+def _shard_caseload(admin_id):
+    from sqlalchemy import case, func
+    from app import db
+    from app.models import User, AssessmentAttempt
+
+    submitted = AssessmentAttempt.status == 'submitted'
+    grouped = db.session.query(
+        User.state_id,
+        User.first_name,
+        User.last_name,
+        User.current_step,
+        func.count(case((submitted, 1))).label('unreviewed'),
+        func.min(case((submitted, AssessmentAttempt.submitted_at))).label('waiting_since'),
+        func.max(AssessmentAttempt.attempt_id).label('latest_attempt_id')
+    ).outerjoin(
+        AssessmentAttempt, AssessmentAttempt.state_id == User.state_id
+    ).filter(
+        User.assigned_admin_id == admin_id,
+        User.is_active.is_(True)
+    ).group_by(
+        User.state_id, User.first_name, User.last_name, User.current_step
+    ).subquery()
+
+    latest_attempt = db.aliased(AssessmentAttempt)
+    return db.session.query(
+        grouped,
+        latest_attempt.status.label('latest_status')
+    ).outerjoin(
+        latest_attempt, latest_attempt.attempt_id == grouped.c.latest_attempt_id
+    ).order_by(
+        grouped.c.waiting_since.is_(None),
+        grouped.c.waiting_since,
+        grouped.c.last_name,
+        grouped.c.first_name
+    ).all()
+
+
+def days_waiting(waiting_since, now=None):
+    """Whole days since a submission (None when nothing is waiting)"""
+    if waiting_since is None:
+        return None
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    return (now - waiting_since.replace(tzinfo=None)).days
@@ -0,0 +1,603 @@
+"""
+Flask CLI commands for the CBT Application
+
+Run with: flask --app run <command>
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+import click
+from flask import Flask, current_app
+from flask.cli import AppGroup
+
+from app.assets import build_assets
+from app.profiling import parse_import_times
+from app.templating import precompile_templates, measure_template_load
+
+templates_cli = AppGroup('templates', help='Template cache commands.')
+profile_cli = AppGroup('profile', help='Performance profiling commands.')
+assets_cli = AppGroup('assets', help='Static asset commands.')
+snapshots_cli = AppGroup('snapshots', help='Approved attempt snapshot commands.')
+sessions_cli = AppGroup('sessions', help='Server-side session commands.')
+indexes_cli = AppGroup('indexes', help='Query capture and index advisor commands.')
+feed_cli = AppGroup('feed', help='Review queue change feed commands.')
+jobs_cli = AppGroup('jobs', help='Background job commands.')
+search_cli = AppGroup('search', help='Response search index commands.')
+similarity_cli = AppGroup('similarity', help='Near-duplicate response detection commands.')
+shards_cli = AppGroup('shards', help='State-code database shard commands.')
+caseload_cli = AppGroup('caseload', help='Clinician caseload commands.')
+admins_cli = AppGroup('admins', help='Admin account commands.')
+dwell_cli = AppGroup('dwell', help='Question timing commands.')
+
+# Boots the app in a fresh interpreter and prints its startup phases as JSON
+STARTUP_SCRIPT = '''
+import json, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+timer = app.extensions['startup_timer']
+print(json.dumps({'import': imported - start, 'phases': timer.phases, 'total': timer.total}))
+'''
+
+
+@templates_cli.command('compile')
+def compile_templates():
+    """Precompile all templates into the bytecode cache"""
+    if current_app.jinja_env.bytecode_cache is None:
+        raise click.ClickException('TEMPLATE_CACHE_DIR is not configured.')
+
+    # Start from an empty cache so every template is rebuilt from source
+    current_app.jinja_env.bytecode_cache.clear()
+    current_app.jinja_env.cache.clear()
+
+    timings = precompile_templates(current_app)
+    for name, seconds in timings:
+        click.echo(f'{name:<35} {seconds * 1000:8.2f} ms')
+    click.echo(f'Compiled {len(timings)} templates into {current_app.config["TEMPLATE_CACHE_DIR"]}')
+
+
+@templates_cli.command('measure')
+def measure_templates():
+    """Measure first-request latency with and without the bytecode cache"""
+    jinja_env = current_app.jinja_env
+    bytecode_cache = jinja_env.bytecode_cache
+    if bytecode_cache is None:
+        raise click.ClickException('TEMPLATE_CACHE_DIR is not configured.')
+
+    precompile_templates(current_app)
+    compile_seconds, cached_seconds = measure_template_load(current_app)
+    click.echo(f'All templates, compiled from source: {compile_seconds * 1000:8.2f} ms')
+    click.echo(f'All templates, loaded from bytecode: {cached_seconds * 1000:8.2f} ms')
+
+    # First request to the login page as a freshly booted worker would see it
+    client = current_app.test_client()
+    results = []
+    for label, cache in (('before (no cache)', None), ('after (bytecode)', bytecode_cache)):
+        jinja_env.cache.clear()
+        jinja_env.bytecode_cache = cache
+        start = time.perf_counter()
+        client.get('/login')
+        results.append((label, time.perf_counter() - start))
+    jinja_env.bytecode_cache = bytecode_cache
+
+    for label, seconds in results:
+        click.echo(f'First GET /login {label:<18} {seconds * 1000:8.2f} ms')
+
+
+@assets_cli.command('build')
+def build_static_assets():
+    """Fingerprint and precompress everything under app/static"""
+    build_dir = current_app.config['STATIC_BUILD_DIR']
+    manifest = build_assets(current_app.static_folder, build_dir)
+
+    for filename, asset in sorted(manifest.items()):
+        encodings = ', '.join(asset['encodings']) or 'uncompressed'
+        click.echo(f'{filename} -> {asset["path"]} ({asset["size"]} bytes; {encodings})')
+    click.echo(f'Built {len(manifest)} assets into {build_dir}')
+
+
+@snapshots_cli.command('build')
+@click.option('--print/--no-print', 'include_print', default=True, show_default=True,
+              help='Also render the print-friendly variant.')
+def build_snapshots(include_print):
+    """Pre-render snapshots for every approved attempt"""
+    from app import db
+    from app.conditional import attempt_validator
+    from app.models import AssessmentAttempt
+    from app.routes.admin import render_attempt_body, render_attempt_print
+
+    attempt_ids = [row.attempt_id for row in db.session.query(AssessmentAttempt.attempt_id).filter_by(
+        status='approved'
+    ).order_by(AssessmentAttempt.attempt_id)]
+
+    start = time.perf_counter()
+    for attempt_id in attempt_ids:
+        with current_app.test_request_context():
+            validator = attempt_validator(attempt_id)
+            render_attempt_body(attempt_id, validator)
+            if include_print:
+                render_attempt_print(attempt_id, validator)
+
+        # Keep the identity map from growing across the whole archive
+        db.session.remove()
+
+    click.echo(f'Snapshotted {len(attempt_ids)} approved attempts in {time.perf_counter() - start:.1f}s')
+
+
+@sessions_cli.command('sweep')
+def sweep_sessions():
+    """Delete expired server-side sessions"""
+    store = getattr(current_app.session_interface, 'store', None)
+    if store is None:
+        raise click.ClickException('SESSION_BACKEND is not a server-side store.')
+
+    click.echo(f'Removed {store.sweep()} expired sessions')
+
+
+@jobs_cli.command('worker')
+@click.option('--processes', default=os.cpu_count() or 2, show_default='CPU count',
+              help='Jobs run in parallel, each in its own process.')
+@click.option('--poll', 'poll_interval', default=1.0, show_default=True, help='Seconds between queue polls.')
+def jobs_worker(processes, poll_interval):
+    """Run queued background jobs until stopped"""
+    from app.jobs import run_worker
+
+    run_worker(processes, poll_interval, log=click.echo)
+
+
+@jobs_cli.command('enqueue')
+@click.argument('name')
+@click.option('--payload', default='{}', help='Job arguments as a JSON object.')
+@click.option('--dedup-key', default=None, help='Skip if a pending job has this key.')
+def jobs_enqueue(name, payload, dedup_key):
+    """Queue a job by name"""
+    from app import db
+    from app.jobs import enqueue
+
+    try:
+        job = enqueue(name, json.loads(payload), dedup_key=dedup_key)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    db.session.commit()
+    click.echo(f'Job {job.job_id} ({job.name}): {job.status}')
+
+
+@jobs_cli.command('status')
+def jobs_status():
+    """Show job counts per status"""
+    from app.jobs import job_counts
+
+    for status, count in sorted(job_counts().items()):
+        click.echo(f'{status:<10} {count}')
+
+
+@search_cli.command('rebuild')
+def search_rebuild():
+    """Create the response search index and refill it from the responses table, in every shard"""
+    from app import db
+    from app.search import ensure_search_index, rebuild_search_index
+    from app.sharding import shard_keys
+
+    for key in shard_keys():
+        with db.engines[key].begin() as connection:
+            ensure_search_index(connection)
+            indexed = rebuild_search_index(connection)
+
+        if indexed is None:
+            click.echo(f'{key or "main"}: PostgreSQL maintains the search index itself - nothing to rebuild')
+        else:
+            click.echo(f'{key or "main"}: indexed {indexed} responses')
+
+
+@similarity_cli.command('index')
+@click.option('--batch-size', default=500, show_default=True, help='Responses per batch (bounds memory).')
+def similarity_index(batch_size):
+    """Index every written response, in every shard, for near-duplicate detection"""
+    from app.sharding import shard_keys, use_shard
+    from app.similarity import index_all
+
+    started = time.perf_counter()
+    indexed = 0
+    for key in shard_keys():
+        use_shard(key)
+        indexed += index_all(batch_size, log=lambda line: click.echo(f'{key or "main"}: {line}'))
+    click.echo(f'Indexed {indexed} responses in {time.perf_counter() - started:.1f}s')
+
+
+@shards_cli.command('init')
+def shards_init():
+    """Create every shard's tables and id ranges and copy the shared tables in"""
+    from app.sharding import init_shard, is_sharded, shard_keys
+
+    if not is_sharded():
+        raise click.ClickException('SHARDS is not configured')
+    for key in shard_keys()[1:]:
+        click.echo(f'{key}: ready, {init_shard(key)} shared rows copied')
+
+
+@shards_cli.command('sync')
+def shards_sync():
+    """Copy admins and the curriculum from the main database into every shard"""
+    from app.sharding import sync_shared_tables
+
+    for key, copied in sync_shared_tables().items():
+        click.echo(f'{key}: {copied} shared rows copied')
+
+
+@shards_cli.command('migrate')
+@click.option('--dry-run', is_flag=True, help='List the participants that would move without moving them.')
+def shards_migrate(dry_run):
+    """Move participants stored outside their state's shard, with all their data, into it"""
+    from app import audit
+    from app.sharding import is_sharded, misplaced_participants, move_participant
+    from app.snapshots import invalidate_snapshots
+
+    if not is_sharded():
+        raise click.ClickException('SHARDS is not configured')
+
+    misplaced = misplaced_participants()
+    for state_id, source, target in misplaced:
+        if dry_run:
+            click.echo(f'{state_id}: {source or "main"} -> {target or "main"}')
+            continue
+        attempt_ids = move_participant(state_id, source, target)
+        # Snapshots are stored by attempt id; the new ids render afresh
+        for attempt_id in attempt_ids:
+            invalidate_snapshots(attempt_id)
+        audit.record('participant_moved', 'participant', state_id, {
+            'from': source or 'main', 'to': target or 'main',
+            'attempt_ids': {str(old): new for old, new in attempt_ids.items()}
+        }, actor_type='cli', actor_id=None)
+        click.echo(f'{state_id}: moved {source or "main"} -> {target or "main"}, {len(attempt_ids)} attempts')
+    audit.flush()
+
+    if dry_run:
+        click.echo(f'{len(misplaced)} participants would move (dry run; nothing was moved).')
+    else:
+        click.echo(f'Moved {len(misplaced)} participants.')
+
+
+@shards_cli.command('status')
+def shards_status():
+    """Show each shard's states and participant count"""
+    from app.sharding import shard_counts, shard_map
+
+    shards = shard_map()
+    for key, count in shard_counts():
+        states = sorted(state for state, shard in shards.by_state.items() if shard == key) if shards else []
+        click.echo(f'{key or "main":<20} {count:>8} participants  {" ".join(states) or "(unlisted states)"}')
+
+
+@feed_cli.command('prune')
+@click.option('--days', default=7, show_default=True, help='Keep events newer than this.')
+def prune_feed(days):
+    """Delete old review queue events"""
+    from app.review_feed import prune_events
+
+    click.echo(f'Removed {prune_events(days)} review queue events older than {days} days')
+
+
+@indexes_cli.command('advise')
+@click.argument('captures', nargs=-1, type=click.Path(exists=True))
+@click.option('--url', 'urls', multiple=True,
+              help='Database to EXPLAIN against (repeatable); defaults to the app database.')
+@click.option('--top', default=None, type=int, help='Only the N most frequent shapes.')
+@click.option('--plans/--no-plans', 'show_plans', default=False, help='Print every query plan.')
+@click.option('--write', 'script', type=click.Path(dir_okay=False),
+              help='Write the recommendations as a migration script.')
+def advise_indexes(captures, urls, top, show_plans, script):
+    """Recommend indexes from captured query shapes (QUERY_CAPTURE_DIR)"""
+    from app import db
+    from app.index_advisor import (load_captures, advise, combine_recommendations, explain_engines, index_ddl,
+                                   missing_declared_indexes, render_migration)
+
+    captures = captures or [current_app.config.get('QUERY_CAPTURE_DIR') or '']
+    shapes = load_captures([path for path in captures if path])
+    click.echo(f'{len(shapes)} query shapes, {sum(e["count"] for e in shapes.values())} calls')
+    if not shapes:
+        click.echo('No captured queries (run the app with QUERY_CAPTURE_DIR set); checking declared indexes only.')
+
+    tables = set(db.metadata.tables)
+    recommendations = None
+    for engine in explain_engines(db.engine, urls):
+        plans, found = advise(shapes, engine, tables, top=top)
+        found = combine_recommendations(missing_declared_indexes(engine, db.metadata), found)
+        click.echo(f'\n== {engine.dialect.name}: {engine.url.render_as_string(hide_password=True)}')
+
+        if show_plans:
+            for shape, count, lines in plans:
+                click.echo(f'\n{count:>8}x {shape}')
+                for line in lines:
+                    click.echo(f'           {line}')
+
+        if not found:
+            click.echo('No missing indexes found.')
+        for r in found:
+            click.echo(f'{r["calls"]:>8} calls  {index_ddl(r, engine.dialect.name)}')
+            for shape in r['shapes'][:3]:
+                click.echo(f'           {shape[:150]}')
+
+        # Merge what every database found; a missing index on either is worth adding
+        recommendations = found if recommendations is None else combine_recommendations(recommendations, found)
+
+    if script and recommendations:
+        with open(script, 'w') as f:
+            f.write(render_migration(recommendations, shapes, script))
+        click.echo(f'\nWrote {len(recommendations)} indexes to {script}')
+
+
+@profile_cli.command('seed')
+@click.argument('count', type=int)
+@click.option('--password', required=True, prompt=True, hide_input=True, confirmation_prompt=True)
+def profile_seed(count, password):
+    """Create COUNT load-test participants (LT000001, LT000002, ...) sharing one password"""
+    from app.loadtest import seed_participants, seeded_state_ids
+
+    created = seed_participants(count, password)
+    state_ids = seeded_state_ids(count)
+    click.echo(f'Created {created} participants; {state_ids[0]} to {state_ids[-1]} are ready.')
+
+
+@profile_cli.command('load')
+@click.argument('base_url')
+@click.option('--seeded', type=int, default=None,
+              help='Log in as this many accounts from `flask profile seed`, one per simulated user.')
+@click.option('--state-id', default=None, help='Single account every simulated user logs in as instead.')
+@click.option('--password', required=True, prompt=True, hide_input=True)
+@click.option('--users', default='25,50,100,200,400', show_default=True,
+              help='Comma-separated participant counts, one stage each.')
+@click.option('--duration', default=30, show_default=True, help='Seconds per stage.')
+@click.option('--think', default=1.0, show_default=True, help='Seconds each participant waits between requests.')
+@click.option('--path', 'paths', multiple=True, default=['/dashboard'], show_default=True,
+              help='Pages requested in turn after login (repeatable).')
+@click.option('--target-p95', default=1.0, show_default=True, help='Latency target in seconds.')
+def profile_load(base_url, seeded, state_id, password, users, duration, think, paths, target_p95):
+    """Find how many concurrent participants a running instance sustains"""
+    from app.loadtest import run_stage, seeded_state_ids, sustained
+
+    if bool(seeded) == bool(state_id):
+        raise click.UsageError('Pass either --seeded N or --state-id.')
+    state_ids = seeded_state_ids(seeded) if seeded else [state_id]
+
+    best = None
+    click.echo(f'{"users":>6} {"requests":>9} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"login p95":>10} {"errors":>7}')
+    for count in [int(n) for n in users.split(',')]:
+        stage = run_stage(base_url, count, duration, state_ids, password, list(paths), think=think)
+        p50 = f'{stage["p50"] * 1000:8.0f}' if stage['p50'] is not None else f'{"-":>8}'
+        p95 = f'{stage["p95"] * 1000:8.0f}' if stage['p95'] is not None else f'{"-":>8}'
+        login = f'{stage["login_p95"] * 1000:10.0f}' if stage['login_p95'] is not None else f'{"-":>10}'
+        click.echo(f'{count:>6} {stage["requests"]:>9} {stage["rps"]:>8.1f} {p50} {p95} {login} {stage["errors"]:>7}')
+        if not sustained(stage, target_p95):
+            break
+        best = count
+
+    click.echo(f'\nSustained: {best or 0} concurrent participants (p95 <= {target_p95 * 1000:.0f} ms, <1% errors)')
+
+
+@profile_cli.command('workers')
+@click.argument('master_pid', type=int)
+def profile_workers(master_pid):
+    """Show the memory of a gunicorn master's workers (RSS, PSS and private)"""
+    from app.warmup import child_pids, process_memory
+
+    totals = {'rss': 0, 'pss': 0, 'private': 0}
+    click.echo(f'{"pid":>8} {"rss KiB":>10} {"pss KiB":>10} {"private KiB":>12}')
+    for pid in [master_pid] + child_pids(master_pid):
+        memory = process_memory(pid)
+        if memory is None:
+            continue
+        click.echo(f'{pid:>8} {memory["rss"]:>10} {memory["pss"]:>10} {memory["private"]:>12}'
+                   + ('  (master)' if pid == master_pid else ''))
+        for key in totals:
+            totals[key] += memory[key]
+    click.echo(f'{"total":>8} {totals["rss"]:>10} {totals["pss"]:>10} {totals["private"]:>12}')
+    click.echo('PSS total is the real footprint; RSS counts shared pages once per process.')
+
+
+@profile_cli.command('lists')
+@click.option('--repeat', default=3, show_default=True, help='Runs per measurement; the smallest is reported.')
+def profile_lists(repeat):
+    """Compare list page rows as ORM instances and as projections (tracemalloc)"""
+    from app.projections import measure_lists
+
+    click.echo(f'{"page":<16} {"rows":>6} {"loaded as":<11} {"retained KiB":>13} {"peak KiB":>9} '
+               f'{"bytes/row":>10} {"ms":>8}')
+    for page, kinds in measure_lists(repeat).items():
+        for kind, (rows, retained, peak, seconds) in kinds.items():
+            per_row = f'{retained / rows:10.0f}' if rows else f'{"-":>10}'
+            click.echo(f'{page:<16} {rows:>6} {kind:<11} {retained / 1024:>13.1f} {peak / 1024:>9.1f} '
+                       f'{per_row} {seconds * 1000:>8.1f}')
+    click.echo('Retained is what the loaded rows keep allocated (including the session identity map); '
+               'peak includes the query itself.')
+
+
+@profile_cli.command('startup')
+@click.option('--top', default=15, show_default=True, help='Number of packages to list.')
+def profile_startup(top):
+    """Report import-time and create_app startup breakdown"""
+    # A fresh interpreter is needed - this process has already imported everything
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+        cwd=os.path.dirname(current_app.root_path),
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise click.ClickException(f'App failed to start:\n{result.stderr[-2000:]}')
+
+    startup = json.loads(result.stdout.strip().splitlines()[-1])
+
+    click.echo(f'Import of app package: {startup["import"] * 1000:8.2f} ms')
+    for package, seconds in parse_import_times(result.stderr, top=top):
+        click.echo(f'  {package:<30} {seconds * 1000:8.2f} ms')
+
+    click.echo(f'create_app(): {startup["total"] * 1000:8.2f} ms')
+    for phase, seconds in startup['phases']:
+        click.echo(f'  {phase:<30} {seconds * 1000:8.2f} ms')
+
+
+@caseload_cli.command('rebalance')
+@click.option('--max-moves', type=int, default=None,
+              help='Most participants to move for balance (default: REBALANCE_MAX_MOVES).')
+@click.option('--apply', 'apply_', is_flag=True, help='Write the plan; without it this is a dry run.')
+def caseload_rebalance(max_moves, apply_):
+    """Even out clinician caseloads; prints the planned moves, then applies them with --apply"""
+    from app.rebalance import plan_rebalance, apply_plan
+
+    plan = plan_rebalance(max_moves)
+    if not plan.clinicians:
+        raise click.ClickException('There are no active clinicians.')
+
+    click.echo(f'{"clinician":<30} {"now":>6} {"after":>6}')
+    for admin_id, name in plan.clinicians.items():
+        before, after = plan.before[admin_id], plan.after[admin_id]
+        change = f' ({after - before:+d})' if after != before else ''
+        click.echo(f'{name[:30]:<30} {before:>6} {after:>6}{change}')
+    click.echo(f'Spread: {plan.spread(plan.before)} -> {plan.spread(plan.after)}')
+
+    if not plan.moves:
+        click.echo('\nCaseloads are balanced; no moves needed.')
+        return
+
+    click.echo(f'\n{len(plan.moves)} move(s):')
+    for move in plan.moves:
+        click.echo(f'  {move.state_id:<12} {move.name[:30]:<30} {move.from_admin_id or "unassigned":>10} -> '
+                   f'{move.to_admin_id:<10} load={move.load}')
+
+    if not apply_:
+        click.echo('\nDry run; re-run with --apply to reassign.')
+        return
+
+    try:
+        moved = apply_plan(plan)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'\nReassigned {moved} participant(s).')
+
+
+@admins_cli.command('import')
+@click.argument('csv_file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--dry-run', is_flag=True, help='Validate every row without creating anything.')
+@click.option('--skip-deliverability', is_flag=True, help='Check email syntax only, whatever the config says.')
+def admins_import(csv_file, dry_run, skip_deliverability):
+    """
+    Create admins from a CSV with columns admin_id, first_name, last_name,
+    email, role and password. Nothing is created unless every row is valid.
+    """
+    import csv
+    from werkzeug.security import generate_password_hash
+    from app import audit, db
+    from app.email_validation import validate_emails
+    from app.models import Admin
+    from app.validators import ValidationError, validate_admin_id, validate_name, validate_password
+
+    rows = list(csv.DictReader(csv_file))
+    if not rows:
+        raise click.ClickException('The file has no rows.')
+    if skip_deliverability:
+        current_app.config['EMAIL_CHECK_DELIVERABILITY'] = False
+
+    # Every address at once: each domain is looked up a single time, and
+    # Admin's own email check then finds it cached
+    started = time.perf_counter()
+    emails, email_errors = validate_emails([(row.get('email') or '').strip().lower() for row in rows])
+    click.echo(f'Checked {len(rows)} emails in {time.perf_counter() - started:.2f}s')
+
+    existing_ids = {admin_id for (admin_id,) in db.session.query(Admin.admin_id)}
+    existing_emails = {email for (email,) in db.session.query(Admin.email)}
+    admins, errors = [], []
+    for line, row in enumerate(rows, start=2):  # Line 1 is the header
+        try:
+            admin_id = validate_admin_id(row.get('admin_id'))
+            if admin_id in existing_ids:
+                raise ValidationError(f"Admin ID '{admin_id}' already exists.")
+            email = (row.get('email') or '').strip().lower()
+            if email in email_errors:
+                raise ValidationError(email_errors[email])
+            if emails[email] in existing_emails:
+                raise ValidationError(f"Email '{email}' already exists")
+            role = (row.get('role') or 'clinician').strip()
+            if role not in ['supervisor', 'clinician']:
+                raise ValidationError("Invalid role selected.")
+
+            admins.append(Admin(
+                admin_id=admin_id,
+                first_name=validate_name(row.get('first_name'), 'First name'),
+                last_name=validate_name(row.get('last_name'), 'Last name'),
+                email=emails[email],
+                password_hash=generate_password_hash(validate_password(row.get('password'))),
+                role=role
+            ))
+            existing_ids.add(admin_id)
+            existing_emails.add(emails[email])
+        except ValidationError as e:
+            errors.append(f'  line {line}: {e}')
+
+    if errors:
+        click.echo('\n'.join(errors))
+        raise click.ClickException(f'{len(errors)} of {len(rows)} rows are invalid; nothing was imported.')
+
+    if dry_run:
+        click.echo(f'All {len(admins)} rows are valid (dry run; nothing was imported).')
+        return
+
+    db.session.add_all(admins)
+    db.session.commit()
+    for admin in admins:
+        audit.record('admin_created', 'admin', admin.admin_id, {'role': admin.role, 'import': True},
+                     actor_type='cli', actor_id=None)
+    audit.flush()
+    click.echo(f'Imported {len(admins)} admins.')
+
+
+@dwell_cli.command('rollup')
+@click.option('--days', type=int, default=None, help='Events to include (default QUESTION_TIME_WINDOW_DAYS).')
+@click.option('--prune/--no-prune', default=True, show_default=True,
+              help='Delete events older than QUESTION_EVENT_RETENTION_DAYS.')
+def dwell_rollup(days, prune):
+    """Rebuild per-question time statistics from recent timing events"""
+    from app.dwell import prune_events, rollup_question_times
+
+    started = time.perf_counter()
+    questions = rollup_question_times(days)
+    click.echo(f'Updated statistics for {questions} questions in {time.perf_counter() - started:.2f}s')
+    if prune:
+        click.echo(f'Removed {prune_events()} old timing events')
+
+
+@dwell_cli.command('show')
+@click.option('--limit', default=10, show_default=True, help='Questions to list.')
+def dwell_show(limit):
+    """List the questions participants spend longest on"""
+    from app.dwell import question_time_rows
+
+    rows = question_time_rows()[:limit]
+    if not rows:
+        click.echo('No statistics yet; run `flask dwell rollup`.')
+        return
+    click.echo(f'{"question":<12} {"attempts":>8} {"answered":>8} {"median":>8} {"p90":>8}')
+    for stat, step_number, question_order, _ in rows:
+        click.echo(f'{f"{step_number}.{question_order}":<12} {stat.attempts:>8} {stat.answered:>8} '
+                   f'{stat.median_ms / 1000:>7.1f}s {stat.p90_ms / 1000:>7.1f}s')
+
+
+def register_commands(app: Flask):
+    """Register all CLI command groups with the Flask app"""
+    app.cli.add_command(templates_cli)
+    app.cli.add_command(profile_cli)
+    app.cli.add_command(assets_cli)
+    app.cli.add_command(snapshots_cli)
+    app.cli.add_command(sessions_cli)
+    app.cli.add_command(indexes_cli)
+    app.cli.add_command(feed_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(similarity_cli)
+    app.cli.add_command(shards_cli)
+    app.cli.add_command(caseload_cli)
+    app.cli.add_command(admins_cli)
+    app.cli.add_command(dwell_cli)
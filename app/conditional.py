@@ -0,0 +1,150 @@
+"""
+Conditional GET helpers for the CBT Application
+
+Views build a validator from a narrow query over the columns the page
+displays, turn it into an ETag, and return 304 Not Modified before doing
+the full load and render when the client's copy is still current.
+"""
+from datetime import datetime
+from hashlib import sha1
+
+from flask import current_app, make_response, request, session
+
+
+def make_etag(*parts):
+    """Stable ETag from the values a page is rendered from"""
+    return sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def latest(*values):
+    """Most recent of several optional datetimes (None when all are None)"""
+    timestamps = [value for value in values if isinstance(value, datetime)]
+    return max(timestamps) if timestamps else None
+
+
+def _set_validators(response, etag, last_modified):
+    # Private pages: the browser may keep a copy but must revalidate it
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag, last_modified=None):
+    """
+    Return a 304 response if the client's cached copy matches, else None.
+
+    Pending flash messages are rendered into the next page, so a request
+    with flashes waiting always gets a full response.
+    """
+    if session.get('_flashes'):
+        return None
+
+    if request.if_none_match:
+        matched = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified is not None:
+        matched = last_modified.replace(microsecond=0, tzinfo=None) <= \
+            request.if_modified_since.replace(tzinfo=None)
+    else:
+        matched = False
+
+    if not matched:
+        return None
+
+    return _set_validators(current_app.response_class(status=304), etag, last_modified)
+
+
+def with_validators(rv, etag, last_modified=None):
+    """Attach ETag/Last-Modified to a full response so it can be revalidated"""
+    return _set_validators(make_response(rv), etag, last_modified)
+
+
+def attempt_validator(attempt_id):
+    """
+    Everything view_attempt displays that can change, in one query.
+
+    Returns None when the attempt doesn't exist. Question text and step
+    titles are curriculum content and are not expected to change.
+    """
+    from sqlalchemy import func, select
+    from app import db
+    from app.models import User, Admin, AssessmentAttempt, Response
+
+    sibling = db.aliased(AssessmentAttempt)
+    same_assessment = (
+        sibling.state_id == AssessmentAttempt.state_id,
+        sibling.assessment_id == AssessmentAttempt.assessment_id
+    )
+
+    return db.session.query(
+        AssessmentAttempt.status,
+        AssessmentAttempt.submitted_at,
+        AssessmentAttempt.reviewed_at,
+        AssessmentAttempt.reviewed_by,
+        User.first_name,
+        User.last_name,
+        Admin.first_name.label('reviewer_first_name'),
+        Admin.last_name.label('reviewer_last_name'),
+        select(func.max(Response.timestamp))
+        .where(Response.attempt_id == AssessmentAttempt.attempt_id).scalar_subquery().label('last_response_at'),
+        select(func.count(Response.response_id))
+        .where(Response.attempt_id == AssessmentAttempt.attempt_id).scalar_subquery(),
+        select(func.count(sibling.attempt_id)).where(*same_assessment).scalar_subquery(),
+        select(func.max(sibling.reviewed_at)).where(*same_assessment).scalar_subquery(),
+        select(func.count(sibling.attempt_id))
+        .where(*same_assessment, sibling.status == 'needs_revision').scalar_subquery()
+    ).join(
+        User, User.state_id == AssessmentAttempt.state_id
+    ).outerjoin(
+        Admin, Admin.admin_id == AssessmentAttempt.reviewed_by
+    ).filter(
+        AssessmentAttempt.attempt_id == attempt_id
+    ).first()
+
+
+def participant_validator(state_id):
+    """
+    The participant's own fields plus a compact row per attempt.
+
+    Covers the participant dashboard and the supervisor's profile page:
+    attempt status, submission/review times and reviewer/assigned admin
+    names. Returns None when the participant doesn't exist.
+    """
+    from app import db
+    from app.models import User, Admin, AssessmentAttempt
+
+    user = db.session.query(
+        User.first_name,
+        User.last_name,
+        User.current_step,
+        User.date_enrolled,
+        Admin.first_name.label('admin_first_name'),
+        Admin.last_name.label('admin_last_name')
+    ).outerjoin(
+        Admin, Admin.admin_id == User.assigned_admin_id
+    ).filter(
+        User.state_id == state_id
+    ).first()
+
+    if user is None:
+        return None
+
+    reviewer = db.aliased(Admin)
+    attempts = db.session.query(
+        AssessmentAttempt.attempt_id,
+        AssessmentAttempt.status,
+        AssessmentAttempt.started_at,
+        AssessmentAttempt.submitted_at,
+        AssessmentAttempt.reviewed_at,
+        AssessmentAttempt.approval_viewed,
+        reviewer.first_name.label('reviewer_first_name'),
+        reviewer.last_name.label('reviewer_last_name')
+    ).outerjoin(
+        reviewer, reviewer.admin_id == AssessmentAttempt.reviewed_by
+    ).filter(
+        AssessmentAttempt.state_id == state_id
+    ).order_by(AssessmentAttempt.attempt_id).all()
+
+    return user, attempts
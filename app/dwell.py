@@ -0,0 +1,144 @@
+"""
+Question timing for the CBT Application
+
+The question page reports how long it was visible before the participant
+saved an answer ('answer') or left without saving ('view'), in a beacon
+sent as the page is left. record_event() only appends the event to an
+in-process buffer (see app/batching.py), so beacons never open a
+transaction of their own; the buffer is written to question_events in
+batches of DWELL_BUFFER_SIZE, or every DWELL_FLUSH_SECONDS.
+
+rollup_question_times(), run by `flask dwell rollup` or the
+rollup_question_times job, rebuilds question_time_stats from the last
+QUESTION_TIME_WINDOW_DAYS of events: per question, how many attempts
+opened and answered it and the spread of the total time each attempt
+spent on it.
+"""
+import atexit
+import math
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+
+from flask import current_app
+
+EVENT_KINDS = ('view', 'answer')
+
+
+def record_event(attempt_id, question_id, kind, dwell_ms):
+    """Buffer one page visit; returns False if it was ignored as invalid"""
+    buffer = current_app.extensions.get('dwell')
+    if buffer is None:
+        return False
+    if kind not in EVENT_KINDS or not 0 <= dwell_ms <= current_app.config['DWELL_MAX_SECONDS'] * 1000:
+        return False
+
+    buffer.append({
+        'attempt_id': attempt_id,
+        'question_id': question_id,
+        'kind': kind,
+        'dwell_ms': dwell_ms,
+        'created_at': datetime.now(timezone.utc)
+    })
+    return True
+
+
+def flush():
+    """Write this process's buffered events now"""
+    buffer = current_app.extensions.get('dwell')
+    return buffer.flush() if buffer is not None else 0
+
+
+def _percentile(values, fraction):
+    """Nearest-rank percentile of sorted `values`"""
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def rollup_question_times(window_days=None):
+    """Rebuild question_time_stats from recent events; returns the number of questions"""
+    from app import db
+    from app.models import Question, QuestionEvent, QuestionTimeStat
+
+    window_days = window_days or current_app.config['QUESTION_TIME_WINDOW_DAYS']
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=window_days)
+
+    # One row per attempt and question; the database does the summing
+    per_attempt = db.session.query(
+        QuestionEvent.question_id,
+        db.func.sum(QuestionEvent.dwell_ms).label('dwell_ms'),
+        db.func.count().label('visits'),
+        db.func.max(db.case((QuestionEvent.kind == 'answer', 1), else_=0)).label('answered')
+    ).join(
+        Question, Question.question_id == QuestionEvent.question_id
+    ).filter(
+        QuestionEvent.created_at >= cutoff
+    ).group_by(
+        QuestionEvent.question_id, QuestionEvent.attempt_id
+    ).order_by(QuestionEvent.question_id)
+
+    stats = []
+    for question_id, rows in groupby(per_attempt, key=lambda row: row.question_id):
+        rows = list(rows)
+        times = sorted(row.dwell_ms for row in rows)
+        stats.append({
+            'question_id': question_id,
+            'attempts': len(rows),
+            'answered': sum(row.answered for row in rows),
+            'visits': sum(row.visits for row in rows),
+            'mean_ms': round(sum(times) / len(times)),
+            'median_ms': _percentile(times, 0.5),
+            'p90_ms': _percentile(times, 0.9),
+            'max_ms': times[-1],
+            'updated_at': now
+        })
+
+    QuestionTimeStat.query.delete(synchronize_session=False)
+    if stats:
+        db.session.execute(QuestionTimeStat.__table__.insert(), stats)
+    db.session.commit()
+    return len(stats)
+
+
+def prune_events(days=None):
+    """Delete events older than `days`; returns how many were removed"""
+    from app import db
+    from app.models import QuestionEvent
+
+    days = days or current_app.config['QUESTION_EVENT_RETENTION_DAYS']
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    removed = QuestionEvent.query.filter(QuestionEvent.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+
+def question_time_rows():
+    """Every question's statistics with its step and position, slowest (by median) first"""
+    from app import db
+    from app.models import Assessment, Question, QuestionTimeStat, Step
+
+    return db.session.query(
+        QuestionTimeStat,
+        Step.step_number,
+        Question.question_order,
+        Question.question_text
+    ).join(
+        Question, Question.question_id == QuestionTimeStat.question_id
+    ).join(
+        Assessment, Assessment.assessment_id == Question.assessment_id
+    ).outerjoin(
+        Step, Step.step_id == Assessment.step_id
+    ).order_by(QuestionTimeStat.median_ms.desc()).all()
+
+
+def init_dwell(app):
+    """Buffer question timing events, writing what is left at exit"""
+    from app.batching import InsertBuffer
+    from app.models import QuestionEvent
+
+    if 'dwell' in app.extensions:
+        return
+
+    buffer = InsertBuffer(app, QuestionEvent.__table__, app.config['DWELL_BUFFER_SIZE'],
+                          app.config['DWELL_FLUSH_SECONDS'], 'dwell')
+    app.extensions['dwell'] = buffer
+    atexit.register(buffer.flush)
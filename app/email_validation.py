@@ -0,0 +1,178 @@
+"""
+Email address validation for the CBT Application
+
+Syntax is always checked locally. Deliverability (does the domain accept
+mail, per DNS) is checked only when EMAIL_CHECK_DELIVERABILITY is on. Set
+it off on sites without outside DNS. Each domain's answer is cached per
+worker for EMAIL_DOMAIN_CACHE_SECONDS, and every lookup gives up after
+EMAIL_DNS_TIMEOUT. Only an answer from DNS (the domain doesn't exist or
+takes no mail) rejects an address. A timeout, unreachable nameserver or
+any other resolver failure lets it through, and that answer is only
+cached for a minute.
+
+validate_emails() validates many addresses at once (e.g. an admin import):
+each distinct domain is looked up once, a few at a time.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from app.validators import ValidationError
+
+# Domains remembered per worker
+DOMAIN_CACHE_SIZE = 1024
+
+# How long an inconclusive lookup (timeout, no nameservers) is trusted
+UNKNOWN_TTL_SECONDS = 60
+
+# Concurrent DNS lookups in batch mode
+BATCH_LOOKUPS = 8
+
+
+class DomainCache:
+    """Per-domain deliverability answers with an expiry: None (deliverable) or an error message"""
+
+    def __init__(self, size=DOMAIN_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, domain):
+        """(found, error)"""
+        with self._lock:
+            entry = self._entries.get(domain)
+            if entry is None or entry[0] < time.monotonic():
+                return False, None
+            self._entries.move_to_end(domain)
+            return True, entry[1]
+
+    def put(self, domain, error, ttl):
+        with self._lock:
+            self._entries[domain] = (time.monotonic() + ttl, error)
+            self._entries.move_to_end(domain)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _domain_cache():
+    return current_app.extensions.setdefault('email_domains', DomainCache())
+
+
+def _check_syntax(email):
+    """The address's ValidatedEmail, without any network access"""
+    from email_validator import validate_email, EmailNotValidError
+
+    try:
+        return validate_email(email or '', check_deliverability=False)
+    except EmailNotValidError as e:
+        raise ValidationError(str(e))
+
+
+def _answered_by_dns(error):
+    """
+    True if an EmailUndeliverableError is DNS's answer about the domain
+    (NXDOMAIN, a null MX or no mail records at all). email_validator
+    raises the same error, "There was an error while checking...", for any
+    other resolver failure, which says nothing about the domain.
+    """
+    from dns.resolver import NXDOMAIN, NoAnswer
+
+    return error.__context__ is None or isinstance(error.__context__, (NXDOMAIN, NoAnswer))
+
+
+def _lookup(ascii_domain, domain):
+    """Ask DNS whether a domain accepts mail: (error or None, seconds to cache the answer)"""
+    from email_validator import EmailUndeliverableError
+    from email_validator.deliverability import validate_email_deliverability
+
+    config = current_app.config
+    try:
+        result = validate_email_deliverability(ascii_domain, domain, timeout=config['EMAIL_DNS_TIMEOUT'])
+    except EmailUndeliverableError as e:
+        if _answered_by_dns(e):
+            return str(e), config['EMAIL_DOMAIN_CACHE_SECONDS']
+        result = {'unknown-deliverability': str(e.__context__)}
+    except Exception as e:
+        # No resolver at all (e.g. no /etc/resolv.conf) fails before the lookup starts
+        result = {'unknown-deliverability': repr(e)}
+
+    if 'unknown-deliverability' in result:
+        current_app.logger.warning(f'Email domain check inconclusive: domain={ascii_domain}, '
+                                   f'reason={result["unknown-deliverability"]}')
+        return None, UNKNOWN_TTL_SECONDS
+    return None, config['EMAIL_DOMAIN_CACHE_SECONDS']
+
+
+def check_domain(ascii_domain, domain=None):
+    """Error message if the domain doesn't accept mail, else None; cached per domain"""
+    cache = _domain_cache()
+    found, error = cache.get(ascii_domain)
+    if found:
+        return error
+
+    error, ttl = _lookup(ascii_domain, domain or ascii_domain)
+    cache.put(ascii_domain, error, ttl)
+    return error
+
+
+def normalize_email(email, check_deliverability=None):
+    """
+    The normalized form of an email address; raises ValidationError if it
+    is invalid (or, when checking deliverability, its domain takes no mail).
+    """
+    if check_deliverability is None:
+        check_deliverability = current_app.config['EMAIL_CHECK_DELIVERABILITY']
+
+    result = _check_syntax(email)
+    if check_deliverability:
+        error = check_domain(result.ascii_domain, result.domain)
+        if error:
+            raise ValidationError(error)
+    return result.normalized
+
+
+def validate_emails(emails, check_deliverability=None):
+    """
+    Validate many addresses, looking up each distinct domain once.
+
+    Returns (normalized, errors): {email: normalized address} for the valid
+    ones and {email: message} for the rest.
+    """
+    if check_deliverability is None:
+        check_deliverability = current_app.config['EMAIL_CHECK_DELIVERABILITY']
+
+    normalized, errors, parsed = {}, {}, {}
+    for email in emails:
+        try:
+            parsed[email] = _check_syntax(email)
+        except ValidationError as e:
+            errors[email] = str(e)
+
+    if check_deliverability and parsed:
+        domains = {result.ascii_domain: result.domain for result in parsed.values()}
+        app = current_app._get_current_object()
+
+        def check(item):
+            with app.app_context():
+                return item[0], check_domain(*item)
+
+        with ThreadPoolExecutor(max_workers=min(BATCH_LOOKUPS, len(domains))) as executor:
+            domain_errors = dict(executor.map(check, domains.items()))
+    else:
+        domain_errors = {}
+
+    for email, result in parsed.items():
+        error = domain_errors.get(result.ascii_domain)
+        if error:
+            errors[email] = error
+        else:
+            normalized[email] = result.normalized
+
+    return normalized, errors
@@ -0,0 +1,548 @@
+"""
+Query shape capture and index advisor for the CBT Application
+
+With QUERY_CAPTURE_DIR set, every SQL statement the app runs is reduced to
+a normalized shape (literals and bind parameters replaced by ?, IN lists
+collapsed) and counted. Each process writes its counts to
+QUERY_CAPTURE_DIR/queries-<pid>.json, so a running server, a scripted
+workload or the smoke tests can all feed the same directory. INSERTs are
+not recorded, and bound values are never written out: only a same-typed
+stand-in for EXPLAIN and, to tell constant parameters from varying ones,
+a hash. The exception is short lowercase tokens such as status and role
+names, which partial indexes are built on.
+
+`flask indexes advise` merges those files, runs EXPLAIN for every shape on
+SQLite and/or PostgreSQL, and recommends composite or partial indexes for
+tables that are scanned or filtered without a matching index, along with
+any index declared on the models that the database is missing. It can
+write the recommendations out as a migration script.
+"""
+import atexit
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import datetime
+
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import Engine
+
+# Flush the in-memory counts to disk every this many statements
+FLUSH_EVERY = 1000
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|(?<!:):\w+|\?')
+_IN_LIST = re.compile(r'IN \((?:\?, )+\?\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+# Bound values kept verbatim: enum-like tokens ('submitted', 'clinician')
+_ENUM_TOKEN = re.compile(r'^[a-z][a-z_]{0,30}$')
+
+# Marks a value that is not kept verbatim (a hash, or one that varies)
+_OPAQUE = '\0'
+
+# alias.column followed by a comparison; the operand tells equality from range
+_PREDICATE = re.compile(
+    r'\b(\w+)\.(\w+)\s*(=|!=|<>|<=|>=|<|>|\bIN\b|\bIS\b|\bLIKE\b|\bBETWEEN\b)\s*'
+    r"(%\(\w+\)s|%s|:\w+|\?|'(?:[^']|'')*'|-?\d+(?:\.\d+)?|\w+\.\w+|NULL|NOT NULL|\()?",
+    re.IGNORECASE
+)
+# Lazy loads put the parameter first: ? = questions.assessment_id
+_REVERSED_PREDICATE = re.compile(r"(%\(\w+\)s|%s|:\w+|\?|'(?:[^']|'')*')\s*=\s*(\w+)\.(\w+)\b")
+_TABLE_REF = re.compile(r'\b(?:FROM|JOIN|UPDATE)\s+(\w+)(?:\s+AS\s+(\w+))?', re.IGNORECASE)
+_ORDER_BY = re.compile(r'\bORDER BY\s+(\w+)\.(\w+)', re.IGNORECASE)
+
+_SQLITE_SCAN = re.compile(r'^SCAN (\w+)(?: AS (\w+))?(?: USING (?:COVERING )?INDEX \w+)?$')
+_SQLITE_SEARCH = re.compile(r'^SEARCH (\w+)(?: AS (\w+))? USING .*?\((.*)\)$')
+
+
+def normalize_statement(statement):
+    """Reduce a SQL statement to its shape: literals and parameters become ?"""
+    shape = _STRING_LITERAL.sub('?', statement)
+    shape = _PLACEHOLDER.sub('?', shape)
+    shape = _NUMBER_LITERAL.sub('?', shape)
+    shape = _WHITESPACE.sub(' ', shape).strip()
+    return _IN_LIST.sub('IN (?)', shape)
+
+
+def _is_token(value):
+    return isinstance(value, str) and _ENUM_TOKEN.match(value) is not None
+
+
+def _example(value):
+    """A stand-in of the same type for EXPLAIN, never the value itself (except tokens)"""
+    if value is None or isinstance(value, bool) or _is_token(value):
+        return value
+    if isinstance(value, int):
+        return 0
+    if isinstance(value, float):
+        return 0.0
+    if isinstance(value, datetime):
+        return '2000-01-01 00:00:00'
+    if isinstance(value, str):
+        return ''
+    return None
+
+
+def _fingerprint(value):
+    """Compared across calls to tell constant parameters from varying ones"""
+    if value is None or isinstance(value, bool) or _is_token(value):
+        return value
+    return _OPAQUE + hashlib.sha256(repr(value).encode('utf-8')).hexdigest()[:16]
+
+
+class QueryRecorder:
+    """Per-process shape counts, with one example statement and stand-ins for its parameters"""
+
+    def __init__(self, capture_dir):
+        self.capture_dir = capture_dir
+        self.shapes = {}
+        self.statements = 0
+        self._normalized = {}
+        self._lock = threading.Lock()
+
+    def record(self, statement, parameters, dialect):
+        # Nothing to index, and their values are the app's data (passwords, answers)
+        if statement.lstrip()[:6].upper() == 'INSERT':
+            return
+
+        shape = self._normalized.get(statement)
+        if shape is None:
+            shape = normalize_statement(statement)
+            if len(self._normalized) < 10000:
+                self._normalized[statement] = shape
+
+        if isinstance(parameters, dict):
+            fingerprints = {key: _fingerprint(value) for key, value in parameters.items()}
+        else:
+            fingerprints = [_fingerprint(value) for value in parameters or ()]
+
+        with self._lock:
+            entry = self.shapes.get(shape)
+            if entry is None:
+                if isinstance(parameters, dict):
+                    params = {key: _example(value) for key, value in parameters.items()}
+                else:
+                    params = [_example(value) for value in parameters or ()]
+                entry = self.shapes[shape] = {
+                    'count': 0, 'dialect': dialect, 'statement': statement,
+                    'params': params, 'constant': fingerprints
+                }
+            entry['count'] += 1
+
+            # Parameters that never change across calls are partial index candidates
+            constant = entry['constant']
+            if constant is not None and statement == entry['statement'] and fingerprints != constant:
+                if isinstance(fingerprints, dict):
+                    entry['constant'] = {k: v for k, v in constant.items() if fingerprints.get(k) == v}
+                else:
+                    entry['constant'] = [a if a == b else _OPAQUE + 'varies' for a, b in zip(constant, fingerprints)]
+
+            self.statements += 1
+            flush = self.statements % FLUSH_EVERY == 0
+
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Write this process's counts to the capture directory"""
+        with self._lock:
+            data = json.dumps(self.shapes)
+        os.makedirs(self.capture_dir, exist_ok=True)
+        path = os.path.join(self.capture_dir, f'queries-{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+
+def init_query_capture(app):
+    """Record query shapes when QUERY_CAPTURE_DIR is configured"""
+    capture_dir = app.config.get('QUERY_CAPTURE_DIR')
+    if not capture_dir or 'query_recorder' in app.extensions:
+        return
+
+    recorder = QueryRecorder(capture_dir)
+    app.extensions['query_recorder'] = recorder
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        recorder.record(statement, parameters, conn.dialect.name)
+
+    event.listen(Engine, 'before_cursor_execute', _capture)
+    atexit.register(recorder.flush)
+
+
+def load_captures(paths):
+    """Merge capture files (or directories of them) into one shape table"""
+    files = []
+    for path in paths:
+        files.extend(sorted(glob.glob(os.path.join(path, 'queries-*.json'))) if os.path.isdir(path) else [path])
+
+    shapes = {}
+    for path in files:
+        with open(path) as f:
+            for shape, entry in json.load(f).items():
+                if shape in shapes:
+                    shapes[shape]['count'] += entry['count']
+                else:
+                    shapes[shape] = entry
+    return shapes
+
+
+def _convert_placeholders(statement, params, source, target):
+    """Re-target an example statement's paramstyle between sqlite3 and psycopg2"""
+    if not isinstance(params, dict):
+        params = tuple(params)
+    if source == target:
+        return statement, params
+
+    def outside_strings(pattern, replacement, text):
+        parts = re.split(r"('(?:[^']|'')*')", text)
+        return ''.join(part if i % 2 else re.sub(pattern, replacement, part) for i, part in enumerate(parts))
+
+    if target == 'postgresql':
+        statement = outside_strings(r'%', '%%', statement)
+        if isinstance(params, dict):
+            return outside_strings(r'(?<!:):(\w+)', r'%(\1)s', statement), params
+        return outside_strings(r'\?', '%s', statement), params
+
+    if isinstance(params, dict):
+        return outside_strings(r'%\((\w+)\)s', r':\1', statement), params
+    return outside_strings(r'%s', '?', statement), params
+
+
+def _plan_sqlite(conn, statement, params):
+    """Table aliases scanned in full, and the columns each index search used"""
+    rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, params).fetchall()
+    scanned, searched, lines = set(), {}, []
+    for row in rows:
+        detail = row[-1]
+        lines.append(detail)
+        scan = _SQLITE_SCAN.match(detail)
+        search = _SQLITE_SEARCH.match(detail)
+        if scan:
+            scanned.add(scan.group(2) or scan.group(1))
+        elif search:
+            columns = re.findall(r'(\w+)\s*[=<>]', search.group(3))
+            searched[search.group(2) or search.group(1)] = columns
+    return scanned, searched, lines
+
+
+def _plan_postgresql(conn, statement, params):
+    """Same as _plan_sqlite, from PostgreSQL's JSON plan"""
+    plan = conn.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    scanned, searched, lines = set(), {}, []
+    stack = [plan[0]['Plan']]
+    while stack:
+        node = stack.pop()
+        stack.extend(node.get('Plans', ()))
+        alias = node.get('Alias') or node.get('Relation Name')
+        if 'Relation Name' not in node:
+            continue
+        lines.append(f"{node['Node Type']} on {node['Relation Name']} {node.get('Filter', '')}".strip())
+        if node['Node Type'] == 'Seq Scan' or 'Filter' in node:
+            scanned.add(alias)
+        else:
+            condition = node.get('Index Cond') or node.get('Recheck Cond') or ''
+            searched[alias] = re.findall(r'\(?(\w+)\s*[=<>]', condition)
+    return scanned, searched, lines
+
+
+def _predicates(statement, params, constant, tables):
+    """
+    Columns each table is filtered, joined or sorted on.
+
+    Returns {table: {'equality': [...], 'range': [...], 'order': [...],
+    'constant': {column: value}}} keyed by alias.
+    """
+    aliases = {}
+    for table, alias in _TABLE_REF.findall(statement):
+        if table in tables:
+            aliases[alias or table] = table
+
+    matches = [(m.start(4), *m.groups()) for m in _PREDICATE.finditer(statement)]
+    matches += [(m.start(1), m.group(2), m.group(3), '=', m.group(1)) for m in _REVERSED_PREDICATE.finditer(statement)]
+
+    by_alias = {}
+    for operand_start, alias, column, operator, operand in matches:
+        operator = operator.upper()
+        # Positional parameters line up with the ? placeholders before this one
+        placeholder_index = statement.count('?', 0, operand_start) if operand == '?' else None
+
+        if alias not in aliases:
+            continue
+        entry = by_alias.setdefault(alias, {'table': aliases[alias], 'equality': [], 'range': [],
+                                            'order': [], 'constant': {}})
+        kind = 'equality' if operator in ('=', 'IN', 'IS') else 'range'
+        if operator in ('!=', '<>'):
+            continue
+        if column not in entry[kind]:
+            entry[kind].append(column)
+
+        # An equality on a value that never varied across calls
+        if operator == '=' and constant is not None:
+            value = None
+            if operand and operand.startswith("'"):
+                value = operand
+            elif placeholder_index is not None and isinstance(constant, list) and placeholder_index < len(constant):
+                if _is_token(constant[placeholder_index]):
+                    value = "'" + constant[placeholder_index].replace("'", "''") + "'"
+            elif operand and operand.startswith(('%(', ':')) and isinstance(constant, dict):
+                key = operand[2:-2] if operand.startswith('%(') else operand[1:]
+                if _is_token(constant.get(key)) and isinstance(params, dict):
+                    value = "'" + constant[key].replace("'", "''") + "'"
+            if value is not None:
+                entry['constant'][column] = value
+
+    for alias, column in _ORDER_BY.findall(statement):
+        if alias in by_alias and column not in by_alias[alias]['order']:
+            by_alias[alias]['order'].append(column)
+
+    return by_alias
+
+
+def _existing_indexes(engine, tables):
+    """Leading column lists of every index, primary key and unique constraint"""
+    inspector = inspect(engine)
+    existing = {}
+    for table in tables:
+        if not inspector.has_table(table):
+            continue
+        indexes = [index['column_names'] for index in inspector.get_indexes(table)]
+        indexes.append(inspector.get_pk_constraint(table)['constrained_columns'])
+        indexes.extend(unique['column_names'] for unique in inspector.get_unique_constraints(table))
+        existing[table] = [columns for columns in indexes if columns]
+    return existing
+
+
+def _covered(columns, existing):
+    """True when an existing index already starts with these columns"""
+    return any(index_columns[:len(columns)] == columns for index_columns in existing)
+
+
+def advise(shapes, engine, tables, top=None):
+    """
+    EXPLAIN every captured shape on `engine` and recommend indexes.
+
+    Returns (plans, recommendations). Each plan is (shape, count, plan lines
+    or an error). Each recommendation is a dict with table, columns, an
+    optional partial `where`, the total calls it would serve and the shapes
+    it came from, most-called first.
+    """
+    existing = _existing_indexes(engine, tables)
+    dialect = engine.dialect.name
+    explain = _plan_postgresql if dialect == 'postgresql' else _plan_sqlite
+
+    ranked = sorted(shapes.items(), key=lambda item: item[1]['count'], reverse=True)
+    ranked = [(shape, entry) for shape, entry in ranked
+              if shape.split(' ', 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE')]
+    if top:
+        ranked = ranked[:top]
+
+    plans, recommendations = [], {}
+    with engine.connect() as conn:
+        for shape, entry in ranked:
+            statement, params = _convert_placeholders(entry['statement'], entry['params'],
+                                                      entry['dialect'], dialect)
+            try:
+                scanned, searched, lines = explain(conn, statement, params)
+            except Exception as e:  # Dialect-specific SQL or stale capture; report and move on
+                conn.rollback()
+                plans.append((shape, entry['count'], [f'EXPLAIN failed: {str(e).splitlines()[0]}']))
+                continue
+            plans.append((shape, entry['count'], lines))
+
+            # A value seen only once says nothing about whether it varies
+            constant = entry['constant'] if entry['count'] > 1 else None
+            for alias, predicates in _predicates(entry['statement'], entry['params'], constant, tables).items():
+                table = predicates['table']
+                used = searched.get(alias)
+                equality = predicates['equality']
+                if alias not in scanned and (used is None or set(equality) <= set(used)):
+                    continue
+
+                # Equality columns first, then one range or sort column
+                trailing = [c for c in predicates['range'] + predicates['order'] if c not in equality]
+                where = None
+                constant = [c for c in equality if c in predicates['constant']]
+                if len(constant) == 1 and len(equality) + len(trailing) > 1:
+                    where = f'{constant[0]} = {predicates["constant"][constant[0]]}'
+                    equality = [c for c in equality if c != constant[0]]
+                columns = (equality + trailing[:1])[:3]
+                if not columns:
+                    continue
+
+                full_columns = columns + ([where.split(' = ')[0]] if where else [])
+                if _covered(columns, existing.get(table, [])) and where is None:
+                    continue
+                if _covered(full_columns, existing.get(table, [])):
+                    continue
+
+                key = (table, tuple(columns), where)
+                recommendation = recommendations.setdefault(key, {
+                    'table': table, 'columns': columns, 'where': where, 'calls': 0, 'shapes': []
+                })
+                recommendation['calls'] += entry['count']
+                recommendation['shapes'].append(shape)
+
+    return plans, sorted(recommendations.values(), key=lambda r: r['calls'], reverse=True)
+
+
+def missing_declared_indexes(engine, metadata):
+    """Indexes declared on the models that the database doesn't have yet"""
+    inspector = inspect(engine)
+    missing = []
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        present = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in present:
+                continue
+            where = index.dialect_options['postgresql'].get('where')
+            missing.append({
+                'name': index.name, 'table': table.name, 'columns': [column.name for column in index.columns],
+                'where': str(where) if where is not None else None, 'calls': 0, 'shapes': ['declared in app/models.py']
+            })
+    return missing
+
+
+def combine_recommendations(recommendations, more):
+    """
+    `recommendations` plus those of `more` on other columns. The same index
+    recommended twice (declared on the models and found by EXPLAIN, or by
+    two databases) is listed once, with the captured calls that need it.
+    """
+    combined = list(recommendations)
+    by_key = {(r['table'], tuple(r['columns']), r['where']): r for r in combined}
+    for r in more:
+        key = (r['table'], tuple(r['columns']), r['where'])
+        if key not in by_key:
+            by_key[key] = r
+            combined.append(r)
+            continue
+        existing = by_key[key]
+        if r['calls'] > existing['calls']:
+            existing['calls'] = r['calls']
+            existing['shapes'] = existing['shapes'] + [s for s in r['shapes'] if s not in existing['shapes']]
+    return combined
+
+
+def index_name(recommendation):
+    """Conventional ix_<table>_<columns> name, trimmed to PostgreSQL's 63 characters"""
+    if recommendation.get('name'):
+        return recommendation['name']
+    name = f"ix_{recommendation['table']}_{'_'.join(recommendation['columns'])}"
+    if recommendation['where']:
+        name += '_' + re.sub(r'\W+', '_', recommendation['where'].split(' = ')[1]).strip('_')
+    return name[:63]
+
+
+def index_ddl(recommendation, dialect):
+    """
+    CREATE INDEX statement for one recommendation.
+
+    SQLite cannot prove a partial index applies to `status = ?` with a bound
+    parameter, so there the constant column is appended to the key instead.
+    """
+    table, columns, where = recommendation['table'], recommendation['columns'], recommendation['where']
+    name = index_name(recommendation)
+    if dialect == 'postgresql':
+        sql = f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({", ".join(columns)})'
+        return sql + (f' WHERE {where}' if where else '')
+
+    if where:
+        columns = columns + [where.split(' = ')[0]]
+    return f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})'
+
+
+MIGRATION_TEMPLATE = '''"""
+Database Migration Script: Add Recommended Indexes
+
+Generated by `flask indexes advise --write` ({calls} captured calls
+across {shape_count} query shapes, plus indexes declared on the models).
+
+{summary}
+
+Usage:
+    python {script}
+
+For production (AWS RDS), run these SQL commands via psql. CONCURRENTLY
+builds without blocking writes and cannot run inside a transaction:
+
+{postgresql_sql}
+"""
+
+import os
+import sys
+from sqlalchemy import create_engine, text
+
+# Get database URL from environment or use local SQLite
+DATABASE_URL = os.environ.get('DATABASE_URL') or os.environ.get('DATABASE_URI') or \\
+               'sqlite:///instance/cbt_assessment.db'
+
+POSTGRESQL = [
+{postgresql}
+]
+
+SQLITE = [
+{sqlite}
+]
+
+
+def main():
+    """Run the migration"""
+    try:
+        engine = create_engine(DATABASE_URL)
+        statements = POSTGRESQL if engine.dialect.name == 'postgresql' else SQLITE
+
+        # Autocommit - CREATE INDEX CONCURRENTLY refuses to run in a transaction
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            for statement in statements:
+                print(f"  {{statement}}")
+                conn.execute(text(statement))
+
+        print("\\n✅ Migration completed successfully!")
+        return 0
+
+    except Exception as e:
+        print(f"\\n❌ Migration failed: {{e}}")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+'''
+
+
+def render_migration(recommendations, shapes, script):
+    """Migration script creating every recommended index on SQLite or PostgreSQL"""
+    def describe(r):
+        where = f" WHERE {r['where']}" if r['where'] else ''
+        declared = r.get('name') is not None
+        calls = f"{r['calls']} calls" if r['calls'] else None
+        source = ', '.join(s for s in ('declared on the models' if declared else None, calls) if s)
+        return f"- {index_name(r)}: {r['table']} ({', '.join(r['columns'])}){where} - {source}"
+
+    def statements(dialect):
+        return '\n'.join(f'    {index_ddl(r, dialect)!r},' for r in recommendations)
+
+    return MIGRATION_TEMPLATE.format(
+        calls=sum(entry['count'] for entry in shapes.values()),
+        shape_count=len(shapes),
+        summary='\n'.join(describe(r) for r in recommendations),
+        script=os.path.basename(script),
+        postgresql_sql='\n'.join(f"    {index_ddl(r, 'postgresql')};" for r in recommendations),
+        postgresql=statements('postgresql'),
+        sqlite=statements('sqlite')
+    )
+
+
+def explain_engines(app_engine, urls):
+    """The engines to EXPLAIN against: the app's own, or each --url given"""
+    return [create_engine(url) for url in urls] if urls else [app_engine]
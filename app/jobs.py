@@ -0,0 +1,333 @@
+"""
+Database-backed background jobs for the CBT Application
+
+Request handlers call enqueue() inside their own transaction, so a job
+exists only if the change that needed it was committed, and return
+straight away. Jobs following up participant data, which may be in a
+shard (see app/sharding.py), use enqueue_after_commit() instead. `flask jobs worker` claims due jobs and runs them in a
+pool of worker processes:
+
+- PostgreSQL: SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers
+  never wait on or double-claim the same row.
+- SQLite: a conditional UPDATE ... WHERE status = 'queued' per job; the
+  first worker to flip the row wins and the others skip it.
+
+Failed jobs are retried with exponential backoff up to max_attempts.
+Jobs with a dedup_key are not queued twice while one is still pending:
+a unique partial index on pending jobs' keys settles concurrent enqueues.
+Job functions are registered with @task in app/tasks.py.
+"""
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy.dialects import postgresql, sqlite
+
+TASKS = {}
+
+# Longest delay between retries
+MAX_BACKOFF_SECONDS = 3600
+
+# The Flask app inside each pool process
+_process_app = None
+
+
+def task(name):
+    """Register a function as a job that enqueue() can refer to by name"""
+    def decorator(f):
+        TASKS[name] = f
+        return f
+    return decorator
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def enqueue(name, payload=None, dedup_key=None, delay=0, max_attempts=None):
+    """
+    Add a job to the current transaction; the caller commits it.
+
+    With a dedup_key, an already queued or running job with the same key
+    is returned instead of adding another.
+    """
+    from app import db
+    from app.models import Job
+    import app.tasks  # noqa: F401 - registers the tasks
+
+    if name not in TASKS:
+        raise ValueError(f'Unknown job: {name}')
+
+    values = {
+        'name': name,
+        'payload': payload or {},
+        'dedup_key': dedup_key,
+        'run_at': _now() + timedelta(seconds=delay),
+        'max_attempts': max_attempts or current_app.config['JOB_MAX_ATTEMPTS']
+    }
+    if not dedup_key:
+        job = Job(**values)
+        db.session.add(job)
+        return job
+
+    def pending():
+        return Job.query.filter(Job.dedup_key == dedup_key, Job.status.in_(['queued', 'running'])).first()
+
+    existing = pending()
+    if existing:
+        return existing
+
+    # Another request may be queueing the same key right now: the unique
+    # index lets only one insert through, the other inserts nothing
+    dialect = postgresql if db.session.get_bind(Job.__mapper__).dialect.name == 'postgresql' else sqlite
+    insert = dialect.insert(Job).values(**values).on_conflict_do_nothing(
+        index_elements=[Job.dedup_key],
+        index_where=Job.status.in_(['queued', 'running'])
+    ).returning(Job.job_id)
+    job_id = db.session.execute(insert).scalar()
+    return db.session.get(Job, job_id) if job_id is not None else pending()
+
+
+def enqueue_after_commit(name, payload=None, **kwargs):
+    """
+    enqueue() and commit, after the change the job follows up was committed.
+
+    The jobs table is in the main database and a participant's rows may be
+    in a shard, so the two can't share a transaction. If queueing fails the
+    change stays committed; the error is logged and None returned, and the
+    job's catch-up command (e.g. `flask similarity index`) covers it.
+    """
+    from sqlalchemy.exc import SQLAlchemyError
+    from app import db
+
+    try:
+        job = enqueue(name, payload, **kwargs)
+        db.session.commit()
+        return job
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.error(f'Could not queue job after commit: name={name}, payload={payload}, error={str(e)}')
+        return None
+
+
+def claim_jobs(worker_id, limit):
+    """Mark up to `limit` due jobs as running by this worker and return them"""
+    from app import db
+    from app.models import Job
+
+    now = _now()
+    due = db.session.query(Job.job_id).filter(
+        Job.status == 'queued',
+        Job.run_at <= now
+    ).order_by(Job.run_at, Job.job_id).limit(limit)
+
+    if db.engine.dialect.name == 'postgresql':
+        job_ids = [row.job_id for row in due.with_for_update(skip_locked=True)]
+        if job_ids:
+            Job.query.filter(Job.job_id.in_(job_ids)).update(
+                {'status': 'running', 'locked_by': worker_id, 'locked_at': now,
+                 'attempts': Job.attempts + 1},
+                synchronize_session=False
+            )
+    else:
+        candidates = [row.job_id for row in due]
+        db.session.rollback()
+
+        # Compare-and-set: a job another worker got to first updates no rows
+        job_ids = []
+        for job_id in candidates:
+            claimed = Job.query.filter_by(job_id=job_id, status='queued').update(
+                {'status': 'running', 'locked_by': worker_id, 'locked_at': now,
+                 'attempts': Job.attempts + 1},
+                synchronize_session=False
+            )
+            db.session.commit()
+            if claimed:
+                job_ids.append(job_id)
+
+    db.session.commit()
+    if not job_ids:
+        return []
+    return db.session.query(Job.job_id, Job.name, Job.payload).filter(Job.job_id.in_(job_ids)).all()
+
+
+def requeue_stale_jobs(timeout):
+    """
+    Put back jobs whose worker died mid-run (running for longer than
+    `timeout` seconds). The run counts as an attempt, so a job that keeps
+    killing its worker fails once its attempts run out.
+    """
+    from app import db
+    from app.models import Job
+
+    now = _now()
+    stale = db.and_(Job.status == 'running', Job.locked_at < now - timedelta(seconds=timeout))
+
+    Job.query.filter(stale, Job.attempts >= Job.max_attempts).update(
+        {'status': 'failed', 'locked_by': None, 'locked_at': None, 'finished_at': now, 'dedup_key': None,
+         'last_error': f'Worker stopped responding (no result after {timeout}s)'},
+        synchronize_session=False
+    )
+    requeued = Job.query.filter(stale).update(
+        {'status': 'queued', 'locked_by': None, 'locked_at': None,
+         'last_error': f'Worker stopped responding (no result after {timeout}s)'},
+        synchronize_session=False
+    )
+    db.session.commit()
+    return requeued
+
+
+def release_jobs(job_ids):
+    """Give back jobs this worker claimed but never started; the claim doesn't count as an attempt"""
+    from app import db
+    from app.models import Job
+
+    if not job_ids:
+        return
+    Job.query.filter(Job.job_id.in_(job_ids), Job.status == 'running').update(
+        {'status': 'queued', 'locked_by': None, 'locked_at': None, 'attempts': Job.attempts - 1},
+        synchronize_session=False
+    )
+    db.session.commit()
+
+
+def finish_job(job_id, error=None):
+    """Record a job's outcome; failures are rescheduled with backoff until attempts run out"""
+    from app import db
+    from app.models import Job
+
+    job = db.session.get(Job, job_id)
+    job.locked_by = None
+    job.locked_at = None
+
+    if error is None:
+        job.status = 'succeeded'
+        job.last_error = None
+    elif job.attempts < job.max_attempts:
+        base = current_app.config['JOB_RETRY_BASE_SECONDS']
+        backoff = min(base * 2 ** (job.attempts - 1), MAX_BACKOFF_SECONDS)
+        job.status = 'queued'
+        job.run_at = _now() + timedelta(seconds=backoff * random.uniform(1, 1.1))
+        job.last_error = error
+    else:
+        job.status = 'failed'
+        job.last_error = error
+
+    if job.status != 'queued':
+        job.finished_at = _now()
+        job.dedup_key = None  # Free the key for the next job like this one
+
+    db.session.commit()
+    return job.status
+
+
+def _init_process():
+    # Fresh interpreter (spawn): build the app once per pool process
+    global _process_app
+    from app import create_app
+    import app.tasks  # noqa: F401 - registers the tasks
+    _process_app = create_app()
+
+
+def _execute(name, payload):
+    """Run one job inside the pool process's app context"""
+    from app import db
+
+    with _process_app.app_context():
+        try:
+            TASKS[name](**(payload or {}))
+        finally:
+            db.session.remove()
+
+
+def run_worker(processes, poll_interval, log=print):
+    """
+    Claim and run jobs until SIGTERM/SIGINT, then finish what is running.
+
+    Runs in the CLI process's app context; job functions run in a pool of
+    `processes` separate interpreters.
+    """
+    from app import db
+
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    lock_timeout = current_app.config['JOB_LOCK_TIMEOUT']
+    stopping = []
+
+    def stop(signum, frame):
+        if not stopping:
+            log('Stopping - waiting for running jobs to finish')
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    def new_pool():
+        return ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_process)
+
+    executor = new_pool()
+    running = {}
+    next_stale_check = 0
+    log(f'Worker {worker_id} started with {processes} processes')
+
+    try:
+        while running or not stopping:
+            if not stopping and len(running) < processes:
+                if time.monotonic() >= next_stale_check:
+                    next_stale_check = time.monotonic() + lock_timeout / 2
+                    requeued = requeue_stale_jobs(lock_timeout)
+                    if requeued:
+                        log(f'Requeued {requeued} stale jobs')
+
+                jobs = claim_jobs(worker_id, processes - len(running))
+                for index, job in enumerate(jobs):
+                    try:
+                        future = executor.submit(_execute, job.name, job.payload)
+                    except BrokenProcessPool:
+                        # A pool process died (e.g. killed by a job); jobs already
+                        # submitted fail and retry, the rest go back to the queue
+                        release_jobs([j.job_id for j in jobs[index:]])
+                        log(f'Process pool broke; restarting it and requeued {len(jobs) - index} jobs')
+                        current_app.logger.error(f'Job process pool broke: worker={worker_id}, requeued={len(jobs) - index}')
+                        executor.shutdown(wait=False)
+                        executor = new_pool()
+                        break
+                    running[future] = (job.job_id, job.name)
+
+            if not running:
+                db.session.remove()
+                time.sleep(poll_interval)
+                continue
+
+            done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                job_id, name = running.pop(future)
+                try:
+                    future.result()
+                    error = None
+                except Exception:
+                    error = traceback.format_exc(limit=5)
+
+                status = finish_job(job_id, error)
+                log(f'Job {job_id} ({name}): {status}')
+                if error:
+                    current_app.logger.error(f'Job failed: job_id={job_id}, name={name}, status={status}, error={error.splitlines()[-1]}')
+    finally:
+        executor.shutdown(wait=True)
+
+
+def job_counts():
+    """Number of jobs per status"""
+    from sqlalchemy import func
+    from app import db
+    from app.models import Job
+
+    return dict(db.session.query(Job.status, func.count(Job.job_id)).group_by(Job.status).all())
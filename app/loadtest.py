@@ -0,0 +1,158 @@
+"""
+Concurrent-participant load test for the CBT Application
+
+Simulates participants against a running instance: each one logs in
+(a password hash on the server) and then cycles through pages with a
+think time between requests. Each simulated participant should have an
+account of its own: seed_participants() (`flask profile seed`) creates
+them, since one shared account concentrates every request on one row
+and one session. Stages with more and more participants are
+run back to back. The result is the largest stage the instance sustained:
+95th percentile page latency within the target and under 1% errors
+(failed logins count as errors). Login latency is reported separately,
+since a stage starts with every participant logging in at once. Run it
+once against each serving mode (see DEPLOYMENT.md) to compare them.
+"""
+import http.cookiejar
+import re
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+_CSRF = re.compile(r'name="csrf_token" value="([^"]+)"')
+
+# Tolerated share of failed requests for a stage to count as sustained
+MAX_ERROR_RATE = 0.01
+
+# State code of the accounts seed_participants() creates
+SEED_PREFIX = 'LT'
+
+
+def seeded_state_ids(count, prefix=SEED_PREFIX):
+    """State IDs of the first `count` seeded load-test participants"""
+    return [f'{prefix}{n:06d}' for n in range(1, count + 1)]
+
+
+def seed_participants(count, password, prefix=SEED_PREFIX):
+    """Create the load-test participants that don't exist yet; returns how many were created"""
+    from werkzeug.security import generate_password_hash
+    from app import db
+    from app.models import User
+    from app.sharding import shard_for_state_id, use_shard
+
+    # One hash for every account: hashing 400 times would take minutes
+    password_hash = generate_password_hash(password)
+    by_shard = {}
+    for state_id in seeded_state_ids(count, prefix):
+        by_shard.setdefault(shard_for_state_id(state_id), []).append(state_id)
+
+    created = 0
+    for key, state_ids in by_shard.items():
+        use_shard(key)
+        existing = {row.state_id for row in db.session.query(User.state_id).filter(User.state_id.in_(state_ids))}
+        new = [User(state_id=state_id, first_name='Load', last_name=f'Test {state_id}',
+                    password_hash=password_hash, current_step=1)
+               for state_id in state_ids if state_id not in existing]
+        db.session.add_all(new)
+        db.session.commit()
+        created += len(new)
+    return created
+
+
+class Participant(threading.Thread):
+    """One simulated participant: log in, then request `paths` in turn until stopped"""
+
+    def __init__(self, base_url, state_id, password, paths, think, timeout, stop, results):
+        super().__init__(daemon=True)
+        self.base_url = base_url.rstrip('/')
+        self.state_id = state_id
+        self.password = password
+        self.paths = paths
+        self.think = think
+        self.timeout = timeout
+        self.stop = stop
+        self.results = results
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def _request(self, path, data=None, kind='page'):
+        started = time.perf_counter()
+        try:
+            body = urllib.parse.urlencode(data).encode() if data else None
+            with self.opener.open(self.base_url + path, data=body, timeout=self.timeout) as response:
+                text = response.read().decode('utf-8', 'replace')
+                url = response.geturl()
+            ok = True
+        except (urllib.error.URLError, OSError):
+            text, url, ok = '', None, False
+        # A rejected login renders the login page again instead of redirecting
+        if kind == 'login' and ok:
+            ok = urllib.parse.urlsplit(url).path != '/login'
+        self.results.append((time.perf_counter() - started, ok, kind))
+        return text
+
+    def run(self):
+        login_page = self._request('/login', kind='login_page')
+        token = _CSRF.search(login_page)
+        self._request('/login', {
+            'csrf_token': token.group(1) if token else '',
+            'state_id': self.state_id,
+            'password': self.password
+        }, kind='login')
+
+        i = 0
+        while not self.stop.is_set():
+            self._request(self.paths[i % len(self.paths)])
+            i += 1
+            self.stop.wait(self.think)
+
+
+def run_stage(base_url, users, duration, state_ids, password, paths, think=1.0, timeout=30):
+    """
+    Run `users` participants for `duration` seconds and summarize the
+    requests they made. Participant n logs in as state_ids[n], wrapping
+    around if there are fewer accounts than participants.
+    """
+    stop = threading.Event()
+    results = []
+    participants = [Participant(base_url, state_ids[n % len(state_ids)], password, paths, think, timeout, stop, results)
+                    for n in range(users)]
+
+    started = time.perf_counter()
+    for participant in participants:
+        participant.start()
+    time.sleep(duration)
+    stop.set()
+    for participant in participants:
+        participant.join(timeout)
+    elapsed = time.perf_counter() - started
+
+    # Logins are reported apart: every participant of a stage hashes a password at once
+    latencies = sorted(seconds for seconds, _, kind in results if kind == 'page')
+    logins = sorted(seconds for seconds, _, kind in results if kind == 'login')
+    errors = sum(1 for _, ok, _ in results if not ok)
+    if not latencies:
+        return {'users': users, 'requests': len(results), 'rps': 0, 'p50': None, 'p95': None,
+                'login_p95': _p95(logins), 'errors': errors}
+
+    return {
+        'users': users,
+        'requests': len(results),
+        'rps': len(results) / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': _p95(latencies),
+        'login_p95': _p95(logins),
+        'errors': errors
+    }
+
+
+def _p95(latencies):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None
+
+
+def sustained(stage, target_p95):
+    """True if a stage's pages met the latency target with under MAX_ERROR_RATE errors"""
+    return (stage['p95'] is not None and stage['p95'] <= target_p95
+            and stage['errors'] <= stage['requests'] * MAX_ERROR_RATE)
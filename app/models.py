@@ -1,12 +1,12 @@
 from app import db
 from flask_login import UserMixin
 from datetime import datetime, timezone
-from email_validator import validate_email, EmailNotValidError
 from sqlalchemy.orm import validates
 from sqlalchemy import JSON
 import re
 
-from app.validators import ValidationError
+from app.search import register_search_ddl
+from app.audit import register_audit_ddl
 
 
 class User(db.Model, UserMixin):
@@ -21,7 +21,7 @@ class User(db.Model, UserMixin):
 
     # Program tracking
     current_step = db.Column(db.Integer, default=1)
-    assigned_admin_id = db.Column(db.String(50), db.ForeignKey('admins.admin_id'), nullable=True)
+    assigned_admin_id = db.Column(db.String(50), db.ForeignKey('admins.admin_id'), nullable=True, index=True)
 
     is_active = db.Column(db.Boolean, default=True, nullable=False)
 
@@ -70,7 +70,7 @@ class AssessmentAttempt(db.Model):
     started_at = db.Column(db.DateTime, nullable=True)
     submitted_at = db.Column(db.DateTime, nullable=True, index=True)
     status = db.Column(db.String(20), default='in_progress', nullable=False, index=True)
-    reviewed_by = db.Column(db.String(50), db.ForeignKey('admins.admin_id'), nullable=True)
+    reviewed_by = db.Column(db.String(50), db.ForeignKey('admins.admin_id'), nullable=True, index=True)
     reviewed_at = db.Column(db.DateTime, nullable=True)
     clinician_notes = db.Column(db.Text, nullable=True)
     approval_viewed = db.Column(db.Boolean, default=False, nullable=False)
@@ -86,6 +86,8 @@ class AssessmentAttempt(db.Model):
     # Table-level index
     __table_args__ = (
         db.Index('idx_state_assessment', 'state_id', 'assessment_id'),
+        db.Index('idx_state_status', 'state_id', 'status'),  # In-progress attempt lookups
+        {'sqlite_autoincrement': True},  # Lets a SQLite shard start its own id range
     )
 
 
@@ -104,12 +106,11 @@ class Admin(db.Model, UserMixin):
 
     @validates('email')
     def validate_email_field(self, key, email):
-        """Validate email format using email-validator library"""
-        try:
-            result = validate_email(email)
-            return result.normalized
-        except EmailNotValidError as e:
-            raise ValidationError(str(e))
+        """Validate email format, and deliverability if configured (see app/email_validation.py)"""
+        # Imported here - only admin create/edit needs it, and email-validator is slow to import
+        from app.email_validation import normalize_email
+
+        return normalize_email(email)
 
     # Relationships
     reviewed_attempts = db.relationship('AssessmentAttempt', backref='reviewer', lazy=True)
@@ -143,7 +144,7 @@ class MultipleChoiceOption(db.Model):
     __tablename__ = 'multiple_choice_options'
 
     option_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    question_id = db.Column(db.Integer, db.ForeignKey('questions.question_id'), nullable=False)
+    question_id = db.Column(db.Integer, db.ForeignKey('questions.question_id'), nullable=False, index=True)
     option_text = db.Column(db.String(500), nullable=False)
     option_value = db.Column(db.Integer)  # For scoring if needed
 
@@ -154,7 +155,7 @@ class Response(db.Model):
 
     response_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     attempt_id = db.Column(db.Integer, db.ForeignKey('assessment_attempts.attempt_id'), nullable=False, index=True)
-    question_id = db.Column(db.Integer, db.ForeignKey('questions.question_id'), nullable=False)
+    question_id = db.Column(db.Integer, db.ForeignKey('questions.question_id'), nullable=False, index=True)
     response_text = db.Column(db.Text)  # For written responses
     selected_option_id = db.Column(db.Integer, db.ForeignKey('multiple_choice_options.option_id'))  # For MC
     clinician_comment = db.Column(db.Text, nullable=True)
@@ -167,4 +168,146 @@ class Response(db.Model):
     # Unique Constraint
     __table_args__ = (
         db.UniqueConstraint('attempt_id', 'question_id', name='uq_attempt_question'),
+        {'sqlite_autoincrement': True},  # Lets a SQLite shard start its own id range
     )
+
+
+# Full-text index over response_text (FTS5 table / GIN index), created with the table
+register_search_ddl(Response.__table__)
+
+
+class ResponseRevision(db.Model):
+    """One version of a written response (see app/revisions.py)"""
+    __tablename__ = 'response_revisions'
+
+    response_id = db.Column(db.Integer, db.ForeignKey('responses.response_id'), primary_key=True)
+    revision_number = db.Column(db.Integer, primary_key=True)  # 1 is the first answer
+    is_full = db.Column(db.Boolean, nullable=False)  # Full text, or a delta against the previous version
+    data = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+
+class ResponseSignature(db.Model):
+    """MinHash signature of a written response, for near-duplicate detection"""
+    __tablename__ = 'response_signatures'
+
+    response_id = db.Column(db.Integer, db.ForeignKey('responses.response_id'), primary_key=True)
+    signature = db.Column(db.LargeBinary, nullable=False)  # NUM_PERM packed 32-bit minimums
+    indexed_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class ResponseBand(db.Model):
+    """LSH bucket of one band of a response's signature; shared buckets are candidate matches"""
+    __tablename__ = 'response_bands'
+
+    band = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.BigInteger, primary_key=True)
+    response_id = db.Column(db.Integer, db.ForeignKey('responses.response_id'), primary_key=True, index=True)
+
+
+class ServerSession(db.Model):
+    """Server-side session data, for SESSION_BACKEND = 'database' (see app/sessions.py)"""
+    __tablename__ = 'server_sessions'
+
+    sid = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)  # Tagged JSON
+    expires = db.Column(db.Float, nullable=False, index=True)  # Unix time
+
+
+class ReviewQueueEvent(db.Model):
+    """Change feed of review queue updates, streamed to admin dashboards"""
+    __tablename__ = 'review_queue_events'
+
+    event_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'submitted', 'claimed' or 'reviewed'
+    # Kept in the attempt's shard (see app/review_feed.py); no foreign key, for databases created without one
+    attempt_id = db.Column(db.Integer, nullable=False)
+
+    # Denormalized so the stream reads a single table
+    state_id = db.Column(db.String(50), nullable=False)
+    participant_name = db.Column(db.String(201), nullable=False)
+    step_number = db.Column(db.Integer, nullable=True)
+    admin_id = db.Column(db.String(50), nullable=True)
+    admin_name = db.Column(db.String(201), nullable=True)
+    decision = db.Column(db.String(20), nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+
+
+class Job(db.Model):
+    """Background job, run by `flask jobs worker`"""
+    __tablename__ = 'jobs'
+
+    job_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(JSON, nullable=True)
+    dedup_key = db.Column(db.String(200), nullable=True)  # Cleared once the job is finished
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, succeeded, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    run_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    # Workers look for due queued jobs; a dedup_key is held by one pending job at a time
+    __table_args__ = (
+        db.Index('idx_job_status_run_at', 'status', 'run_at'),
+        db.Index('uq_job_pending_dedup_key', 'dedup_key', unique=True,
+                 postgresql_where=db.text("status IN ('queued', 'running')"),
+                 sqlite_where=db.text("status IN ('queued', 'running')")),
+    )
+
+
+class AuditEvent(db.Model):
+    """Append-only audit trail of security-relevant events (see app/audit.py)"""
+    __tablename__ = 'audit_events'
+
+    event_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    occurred_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False, index=True)
+    actor_type = db.Column(db.String(20), nullable=False)  # 'admin', 'participant', 'anonymous' or 'cli'
+    actor_id = db.Column(db.String(50), nullable=True)
+    action = db.Column(db.String(50), nullable=False)
+    target_type = db.Column(db.String(20), nullable=True)  # 'participant', 'admin', 'attempt', ...
+    target_id = db.Column(db.String(50), nullable=True)
+    details = db.Column(JSON, nullable=True)
+    ip_address = db.Column(db.String(45), nullable=True)
+    request_id = db.Column(db.String(64), nullable=True)
+
+    # The supervisor audit page filters by actor or target within a time range
+    __table_args__ = (
+        db.Index('idx_audit_actor_time', 'actor_id', 'occurred_at'),
+        db.Index('idx_audit_target_time', 'target_type', 'target_id', 'occurred_at'),
+    )
+
+
+register_audit_ddl(AuditEvent.__table__)
+
+
+class QuestionEvent(db.Model):
+    """Time a participant spent on a question page (see app/dwell.py)"""
+    __tablename__ = 'question_events'
+
+    event_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # No foreign keys: events live in the main database, the attempt may be in a shard
+    attempt_id = db.Column(db.Integer, nullable=False)
+    question_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(10), nullable=False)  # 'view' (left without saving) or 'answer'
+    dwell_ms = db.Column(db.Integer, nullable=False)  # Time the page was visible
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False, index=True)
+
+
+class QuestionTimeStat(db.Model):
+    """Per-question time statistics, rebuilt from question_events by rollup_question_times()"""
+    __tablename__ = 'question_time_stats'
+
+    question_id = db.Column(db.Integer, db.ForeignKey('questions.question_id'), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False)  # Attempts that opened the question
+    answered = db.Column(db.Integer, nullable=False)  # ... and saved an answer to it
+    visits = db.Column(db.Integer, nullable=False)  # Page visits across those attempts
+    mean_ms = db.Column(db.Integer, nullable=False)  # Per-attempt total time on the question
+    median_ms = db.Column(db.Integer, nullable=False)
+    p90_ms = db.Column(db.Integer, nullable=False)
+    max_ms = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
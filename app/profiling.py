@@ -0,0 +1,156 @@
+"""
+Startup and per-request profiling helpers for the CBT Application
+"""
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context, before_render_template, template_rendered
+from flask.sessions import SecureCookieSessionInterface
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class StartupTimer:
+    """Records how long each phase of create_app takes"""
+
+    def __init__(self):
+        self.phases = []
+        self._started = time.perf_counter()
+        self._last = self._started
+
+    def mark(self, phase):
+        """Close the current phase and start timing the next one"""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    @property
+    def total(self):
+        return self._last - self._started
+
+
+def parse_import_times(stderr_text, top=15):
+    """
+    Summarize `python -X importtime` output by top-level package.
+
+    Returns a list of (package, seconds) sorted slowest first. Each module's
+    self time is used, so nested imports are not counted twice.
+    """
+    packages = {}
+    for line in stderr_text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+
+        package = fields[2].strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(fields[0]) / 1_000_000
+
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def record_timing(phase, seconds):
+    """Add time spent in `phase` to the current request's Server-Timing totals"""
+    if not has_app_context():
+        return
+
+    timings = g.setdefault('server_timing', {})
+    total, count = timings.get(phase, (0.0, 0))
+    timings[phase] = (total + seconds, count + 1)
+
+
+@contextmanager
+def timing_phase(phase):
+    """Time a block of code as one Server-Timing phase"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(phase, time.perf_counter() - start)
+
+
+def format_server_timing(timings, total=None):
+    """Render phase timings as a Server-Timing header value"""
+    parts = []
+    for phase, (seconds, count) in timings.items():
+        parts.append(f'{phase};dur={seconds * 1000:.2f};desc="{count}x"')
+    if total is not None:
+        parts.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(parts)
+
+
+def timings_as_ms(timings):
+    """Phase timings in milliseconds, for the request log line"""
+    return {phase: round(seconds * 1000, 2) for phase, (seconds, count) in timings.items()}
+
+
+# The start time rides on the statement's execution context: after_cursor_execute
+# doesn't fire for a statement that raises, and a per-connection stack would
+# then hand its stale start to the connection's next query
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_query_start', None)
+    if start is not None:
+        record_timing('db', time.perf_counter() - start)
+
+
+def _before_render(sender, template, context, **extra):
+    g.setdefault('render_start', []).append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    record_timing('render', time.perf_counter() - g.render_start.pop())
+
+
+def _may_see_timing(app):
+    """
+    Timings leak what the server did (e.g. whether a login hashed a
+    password, i.e. the account exists), so outside debug mode they are only
+    sent to logged in supervisors.
+    """
+    if app.debug:
+        return True
+    user = g.get('_login_user')
+    return user is not None and user.is_authenticated and getattr(user, 'role', None) == 'supervisor'
+
+
+class SessionTimingMixin:
+    """
+    Times loading and saving the session for any Flask session interface.
+
+    Saving the session is the last thing Flask does to a response, so the
+    Server-Timing header is written here once every phase is known.
+    """
+
+    def open_session(self, app, request):
+        with timing_phase('session'):
+            return super().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        with timing_phase('session'):
+            super().save_session(app, session, response)
+
+        if app.config['SERVER_TIMING'] and 'server_timing' in g and _may_see_timing(app):
+            start = g.get('request_start')
+            total = time.perf_counter() - start if start is not None else None
+            response.headers['Server-Timing'] = format_server_timing(g.server_timing, total)
+
+
+class TimedSessionInterface(SessionTimingMixin, SecureCookieSessionInterface):
+    """Flask's signed cookie sessions, timed"""
+
+
+def init_server_timing(app):
+    """Hook database and template timing into every request (sessions: app/sessions.py)"""
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
@@ -0,0 +1,186 @@
+"""
+Read-only row projections for the CBT Application's list pages
+
+The participant and admin lists, the admin dashboard's review queue and
+the participant timeline only display a few columns. Loading full ORM
+instances for them means identity-map entries, change-tracking state and
+relationship loads for every row. These functions select just the
+displayed columns, with display fields such as the assigned admin's name
+and the step number joined in. They return named tuples (no __dict__, so
+no per-instance attribute dictionary) that templates read like model
+attributes.
+
+`flask profile lists` compares the memory each page's rows take as
+projections and as ORM instances, using tracemalloc.
+"""
+import time
+import tracemalloc
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+
+class ParticipantRow(NamedTuple):
+    """A row of Manage Users"""
+    state_id: str
+    first_name: str
+    last_name: str
+    current_step: Optional[int]
+    is_active: bool
+    assigned_admin_id: Optional[str]
+    admin_first_name: Optional[str]
+    admin_last_name: Optional[str]
+
+
+class AdminRow(NamedTuple):
+    """A row of Manage Admins"""
+    admin_id: str
+    first_name: str
+    last_name: str
+    email: str
+    role: str
+    is_active: bool
+
+
+class PendingAttemptRow(NamedTuple):
+    """A submitted attempt in the admin dashboard's review queue"""
+    attempt_id: int
+    state_id: str
+    first_name: str
+    last_name: str
+    step_number: Optional[int]
+    submitted_at: Optional[datetime]
+
+
+class TimelineRow(NamedTuple):
+    """An attempt on a participant's profile timeline"""
+    attempt_id: int
+    attempt_number: int
+    status: str
+    started_at: Optional[datetime]
+    submitted_at: Optional[datetime]
+    reviewed_at: Optional[datetime]
+    step_number: Optional[int]
+    reviewer_first_name: Optional[str]
+    reviewer_last_name: Optional[str]
+
+
+def participant_rows(*criteria):
+    """Participants in the current shard matching `criteria`, by name"""
+    from app import db
+    from app.models import Admin, User
+
+    query = db.session.query(
+        User.state_id,
+        User.first_name,
+        User.last_name,
+        User.current_step,
+        User.is_active,
+        User.assigned_admin_id,
+        Admin.first_name,
+        Admin.last_name
+    ).outerjoin(
+        Admin, Admin.admin_id == User.assigned_admin_id
+    ).filter(*criteria).order_by(User.last_name, User.first_name)
+
+    return [ParticipantRow._make(row) for row in query]
+
+
+def admin_rows(*criteria):
+    """Admins matching `criteria`, by name"""
+    from app import db
+    from app.models import Admin
+
+    query = db.session.query(
+        Admin.admin_id,
+        Admin.first_name,
+        Admin.last_name,
+        Admin.email,
+        Admin.role,
+        Admin.is_active
+    ).filter(*criteria).order_by(Admin.last_name, Admin.first_name)
+
+    return [AdminRow._make(row) for row in query]
+
+
+def pending_attempt_rows():
+    """Submitted attempts awaiting review in the current shard, newest first"""
+    from app import db
+    from app.models import Assessment, AssessmentAttempt, Step, User
+
+    query = db.session.query(
+        AssessmentAttempt.attempt_id,
+        AssessmentAttempt.state_id,
+        User.first_name,
+        User.last_name,
+        Step.step_number,
+        AssessmentAttempt.submitted_at
+    ).join(
+        User, User.state_id == AssessmentAttempt.state_id
+    ).outerjoin(
+        Assessment, Assessment.assessment_id == AssessmentAttempt.assessment_id
+    ).outerjoin(
+        Step, Step.step_id == Assessment.step_id
+    ).filter(
+        AssessmentAttempt.status == 'submitted'
+    ).order_by(AssessmentAttempt.submitted_at.desc())
+
+    return [PendingAttemptRow._make(row) for row in query]
+
+
+def _orm_lists():
+    """What the list pages loaded before projections, for comparison"""
+    from sqlalchemy.orm import joinedload
+    from app.models import Admin, Assessment, AssessmentAttempt, User
+
+    return {
+        'list_users': lambda: User.query.options(joinedload(User.assigned_admin))
+        .order_by(User.last_name, User.first_name).all(),
+        'list_admins': lambda: Admin.query.order_by(Admin.last_name, Admin.first_name).all(),
+        'admin_dashboard': lambda: AssessmentAttempt.query.filter_by(status='submitted').options(
+            joinedload(AssessmentAttempt.user),
+            joinedload(AssessmentAttempt.assessment).joinedload(Assessment.step)
+        ).order_by(AssessmentAttempt.submitted_at.desc()).all(),
+    }
+
+
+def _projected_lists():
+    return {
+        'list_users': participant_rows,
+        'list_admins': admin_rows,
+        'admin_dashboard': pending_attempt_rows,
+    }
+
+
+def _measure(load):
+    """(rows, bytes still allocated for the result, peak bytes, seconds) of one call of `load`"""
+    from app import db
+
+    db.session.expunge_all()
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        rows = load()
+        elapsed = time.perf_counter() - started
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    count = len(rows)
+    del rows
+    db.session.expunge_all()
+    return count, retained, peak, elapsed
+
+
+def measure_lists(repeat=3):
+    """
+    Memory of each list page's rows as ORM instances and as projections,
+    in the current shard: {page: {'orm': ..., 'projection': ...}}, each
+    the best of `repeat` runs as (rows, retained bytes, peak bytes, seconds).
+    """
+    orm, projected = _orm_lists(), _projected_lists()
+    results = {}
+    for page in orm:
+        results[page] = {
+            kind: min((_measure(loaders[page]) for _ in range(repeat)), key=lambda run: run[1])
+            for kind, loaders in (('orm', orm), ('projection', projected))
+        }
+    return results
@@ -0,0 +1,189 @@
+"""
+Caseload rebalancing for the CBT Application
+
+A clinician's load is the number of active participants assigned to them
+plus REBALANCE_PENDING_WEIGHT for each of those participants' submissions
+waiting for review. plan_rebalance() moves as few participants as it can:
+
+1. Active participants with no admin, or one who is inactive, go to the
+   least loaded clinician, heaviest first. Participants assigned to an
+   active supervisor are left with them and don't count towards any load.
+2. Then, while the busiest clinician is more than REBALANCE_TOLERANCE
+   above the average, it moves the participant whose load best closes
+   the gap between the busiest and the least busy clinician. It stops at
+   max_moves, or when no move helps.
+
+apply_plan() writes the moves with one UPDATE per (from, to) pair, in one
+transaction per shard. Each UPDATE only matches participants still
+assigned where the plan found them; if any in a shard have changed since,
+nothing in that shard is applied. Shards already committed keep their
+moves, and the next plan starts from there.
+"""
+import hashlib
+import heapq
+import json
+from dataclasses import dataclass, field
+
+from flask import current_app
+
+
+@dataclass
+class Move:
+    state_id: str
+    name: str
+    from_admin_id: str
+    to_admin_id: str
+    load: int
+
+
+@dataclass
+class RebalancePlan:
+    clinicians: dict                                # admin_id -> display name
+    before: dict                                    # admin_id -> load
+    after: dict
+    moves: list = field(default_factory=list)
+
+    @property
+    def token(self):
+        """Fingerprint of the moves, so the plan a supervisor confirms is the one applied"""
+        data = json.dumps([(m.state_id, m.from_admin_id, m.to_admin_id) for m in self.moves])
+        return hashlib.sha256(data.encode()).hexdigest()[:16]
+
+    def spread(self, loads):
+        return max(loads.values()) - min(loads.values()) if loads else 0
+
+
+def _participant_loads(pending_weight):
+    """Active participants in the current shard with their assigned clinician and load"""
+    from sqlalchemy import case, func
+    from app import db
+    from app.models import AssessmentAttempt, User
+
+    return db.session.query(
+        User.state_id,
+        User.first_name,
+        User.last_name,
+        User.assigned_admin_id,
+        (1 + pending_weight * func.count(case((AssessmentAttempt.status == 'submitted', 1)))).label('load')
+    ).outerjoin(
+        AssessmentAttempt, AssessmentAttempt.state_id == User.state_id
+    ).filter(
+        User.is_active.is_(True)
+    ).group_by(
+        User.state_id, User.first_name, User.last_name, User.assigned_admin_id
+    ).all()
+
+
+def plan_rebalance(max_moves=None):
+    """Compute a RebalancePlan over every active clinician; nothing is written"""
+    from app.models import Admin
+    from app.sharding import gather_all
+
+    config = current_app.config
+    max_moves = config['REBALANCE_MAX_MOVES'] if max_moves is None else max_moves
+
+    active = Admin.query.filter_by(is_active=True).order_by(Admin.admin_id).all()
+    clinicians = {
+        admin.admin_id: f'{admin.first_name} {admin.last_name}'
+        for admin in active if admin.role == 'clinician'
+    }
+    participants = gather_all(_participant_loads, config['REBALANCE_PENDING_WEIGHT'])
+
+    loads = dict.fromkeys(clinicians, 0)
+    caseloads = {admin_id: [] for admin_id in clinicians}
+    others = {admin.admin_id for admin in active} - set(clinicians)
+    orphans = []
+    for row in participants:
+        if row.assigned_admin_id in clinicians:
+            loads[row.assigned_admin_id] += row.load
+            caseloads[row.assigned_admin_id].append(row)
+        elif row.assigned_admin_id not in others:
+            orphans.append(row)
+
+    plan = RebalancePlan(clinicians=clinicians, before=dict(loads), after=loads)
+    if not clinicians:
+        return plan
+
+    def move(row, to_admin_id):
+        plan.moves.append(Move(row.state_id, f'{row.first_name} {row.last_name}',
+                               row.assigned_admin_id, to_admin_id, row.load))
+        loads[to_admin_id] += row.load
+        caseloads[to_admin_id].append(row)
+
+    # 1. Everyone needs a clinician; these moves don't count against max_moves
+    heap = [(load, admin_id) for admin_id, load in loads.items()]
+    heapq.heapify(heap)
+    for row in sorted(orphans, key=lambda row: row.load, reverse=True):
+        _, admin_id = heapq.heappop(heap)
+        move(row, admin_id)
+        heapq.heappush(heap, (loads[admin_id], admin_id))
+
+    # 2. Even out the rest
+    average = sum(loads.values()) / len(loads)
+    limit = average * (1 + config['REBALANCE_TOLERANCE'])
+    moved = set()
+    moves_left = max_moves
+    while moves_left > 0:
+        busiest = max(loads, key=lambda admin_id: (loads[admin_id], admin_id))
+        idlest = min(loads, key=lambda admin_id: (loads[admin_id], admin_id))
+        gap = loads[busiest] - loads[idlest]
+        if loads[busiest] <= limit or gap <= 1:
+            break
+
+        # Best fit: the largest load that still leaves the pair closer than before
+        candidates = [row for row in caseloads[busiest] if row.load < gap and row.state_id not in moved]
+        if not candidates:
+            break
+        row = max(candidates, key=lambda row: (min(row.load, gap - row.load), row.state_id))
+
+        caseloads[busiest].remove(row)
+        loads[busiest] -= row.load
+        move(row, idlest)
+        moved.add(row.state_id)
+        moves_left -= 1
+
+    return plan
+
+
+def apply_plan(plan):
+    """
+    Write a plan's moves, one transaction per shard; returns the number of participants moved.
+
+    Raises ValueError if any participant's assignment changed after the
+    plan was made. Nothing in that shard is written, but shards committed
+    before it keep their moves; the message says how many.
+    """
+    from app import db
+    from app.models import User
+    from app.sharding import shard_for_state_id, use_shard
+    from flask import g
+
+    groups = {}
+    for m in plan.moves:
+        shard = shard_for_state_id(m.state_id)
+        groups.setdefault(shard, {}).setdefault((m.from_admin_id, m.to_admin_id), []).append(m.state_id)
+
+    previous_shard = g.get('shard')
+    moved = 0
+    try:
+        for shard, pairs in groups.items():
+            use_shard(shard)
+            updated = 0
+            for (from_admin_id, to_admin_id), state_ids in pairs.items():
+                assigned = User.assigned_admin_id.is_(None) if from_admin_id is None else User.assigned_admin_id == from_admin_id
+                count = User.query.filter(User.state_id.in_(state_ids), assigned).update(
+                    {'assigned_admin_id': to_admin_id}, synchronize_session=False
+                )
+                if count != len(state_ids):
+                    raise ValueError('Caseloads changed since the plan was made; review the new plan.'
+                                     + (f' {moved} participant(s) were already reassigned.' if moved else ''))
+                updated += count
+            db.session.commit()
+            moved += updated
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        use_shard(previous_shard)
+
+    return moved
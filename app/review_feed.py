@@ -0,0 +1,243 @@
+"""
+Review queue change feed for the CBT Application
+
+assessment_complete, review_attempt and submit_review append a compact
+row to review_queue_events in the same transaction as the change itself.
+The feed lives next to the attempts, in the participant's shard (see
+app/sharding.py), so that transaction never spans two databases. Admin
+dashboards follow the feed over server-sent events (/admin/queue/events)
+and patch their pending list in place instead of reloading the whole
+page.
+
+Under sync gunicorn workers each stream request answers with whatever
+is new since the client's Last-Event-ID and closes; the browser's
+EventSource reconnects after SSE_RETRY_MS. No thread is held between
+events. With cooperative (async) workers SSE_HOLD_SECONDS can keep the
+connection open and poll the feed instead.
+
+Clients resume from a cursor: the last event id they saw in each shard
+("12" with one database, "0:12,1:100000045" with shards). On PostgreSQL,
+ids are handed out at insert but transactions can commit in any order,
+so an id may still be missing when a later one is visible. events_since()
+stops at such a gap until it is SSE_SETTLE_SECONDS old, so a late commit
+is never skipped. A gap that stays open that long was a rollback.
+"""
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+
+# Most events sent in one response; the client picks up the rest on reconnect
+MAX_EVENTS = 100
+
+
+def record_queue_event(kind, attempt_id, admin=None, decision=None):
+    """
+    Add a feed row for an attempt to the current transaction.
+
+    The caller commits it together with the status change, so the feed
+    never shows a change that was rolled back.
+    """
+    from app import db
+    from app.models import User, Assessment, AssessmentAttempt, Step, ReviewQueueEvent
+
+    attempt = db.session.query(
+        AssessmentAttempt.state_id,
+        User.first_name,
+        User.last_name,
+        Step.step_number
+    ).join(
+        User, User.state_id == AssessmentAttempt.state_id
+    ).outerjoin(
+        Assessment, Assessment.assessment_id == AssessmentAttempt.assessment_id
+    ).outerjoin(
+        Step, Step.step_id == Assessment.step_id
+    ).filter(
+        AssessmentAttempt.attempt_id == attempt_id
+    ).first()
+
+    db.session.add(ReviewQueueEvent(
+        kind=kind,
+        attempt_id=attempt_id,
+        state_id=attempt.state_id,
+        participant_name=f'{attempt.first_name} {attempt.last_name}',
+        step_number=attempt.step_number,
+        admin_id=admin.admin_id if admin else None,
+        admin_name=f'{admin.first_name} {admin.last_name}' if admin else None,
+        decision=decision
+    ))
+
+
+def _settled_before():
+    """Events created before this have committed or been rolled back (created_at is stored without a time zone)"""
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=current_app.config['SSE_SETTLE_SECONDS'])
+
+
+def parse_cursor(value):
+    """{shard number: last event id} from a cursor string; anything malformed starts from the beginning"""
+    cursor = {}
+    for part in (value or '').split(','):
+        number, _, event_id = part.rpartition(':')
+        try:
+            cursor[int(number or 0)] = int(event_id)
+        except ValueError:
+            return {}
+    return cursor
+
+
+def format_cursor(cursor):
+    """Cursor string for {shard number: last event id}; a bare id with a single database"""
+    if set(cursor) <= {0}:
+        return str(cursor.get(0, 0))
+    return ','.join(f'{number}:{event_id}' for number, event_id in sorted(cursor.items()))
+
+
+def _latest_settled_id():
+    from sqlalchemy import func
+    from app import db
+    from app.models import ReviewQueueEvent
+    from app.sharding import current_shard_number
+
+    return current_shard_number(), db.session.query(func.max(ReviewQueueEvent.event_id)).filter(
+        ReviewQueueEvent.created_at <= _settled_before()
+    ).scalar() or 0
+
+
+def latest_cursor():
+    """
+    Where a dashboard rendered now should start following the feed: in
+    each shard, the newest event that has settled (0 when there are none).
+    An uncommitted event with a lower id than the newest visible one would
+    otherwise never be sent. The dashboard applies the few recent events
+    it already shows again, which changes nothing.
+    """
+    from app.sharding import gather
+
+    return format_cursor(dict(gather(_latest_settled_id)))
+
+
+def claimed_by(attempt_id, admin_id):
+    """True when the attempt's latest claim is already this admin's"""
+    from app import db
+    from app.models import ReviewQueueEvent
+
+    latest = db.session.query(ReviewQueueEvent.admin_id).filter(
+        ReviewQueueEvent.attempt_id == attempt_id,
+        ReviewQueueEvent.kind.in_(['submitted', 'claimed'])
+    ).order_by(ReviewQueueEvent.event_id.desc()).first()
+    return latest is not None and latest.admin_id == admin_id
+
+
+def _shard_events(cursor):
+    """The current shard's feed rows after its cursor position, oldest first, up to the first gap that may still fill"""
+    from app import db
+    from app.models import ReviewQueueEvent
+    from app.sharding import current_shard_number
+
+    number = current_shard_number()
+    event_id = cursor.get(number, 0)
+    rows = db.session.query(
+        ReviewQueueEvent.event_id,
+        ReviewQueueEvent.kind,
+        ReviewQueueEvent.attempt_id,
+        ReviewQueueEvent.state_id,
+        ReviewQueueEvent.participant_name,
+        ReviewQueueEvent.step_number,
+        ReviewQueueEvent.admin_id,
+        ReviewQueueEvent.admin_name,
+        ReviewQueueEvent.decision,
+        ReviewQueueEvent.created_at
+    ).filter(
+        ReviewQueueEvent.event_id > event_id
+    ).order_by(ReviewQueueEvent.event_id).limit(MAX_EVENTS).all()
+
+    settled = _settled_before()
+    # From the start of the feed, ids below the first row were pruned, not pending
+    expected = event_id + 1 if event_id else None
+    for index, row in enumerate(rows):
+        # A missing id before a recent event may belong to a transaction still committing
+        if expected is not None and row.event_id != expected and row.created_at.replace(tzinfo=None) > settled:
+            rows = rows[:index]
+            break
+        expected = row.event_id + 1
+    return [(number, row) for row in rows]
+
+
+def events_since(cursor):
+    """
+    Feed rows after `cursor` ({shard number: event id}) from every shard,
+    as (shard number, row) pairs. Each shard's rows stay in id order;
+    shards are interleaved by time. Returns (pairs, more), where more is
+    True if some shard had more than MAX_EVENTS to send.
+    """
+    import heapq
+    from app.sharding import gather
+
+    per_shard = gather(_shard_events, cursor)
+    pairs = list(heapq.merge(*per_shard, key=lambda pair: pair[1].created_at))
+    return pairs, any(len(rows) == MAX_EVENTS for rows in per_shard)
+
+
+def format_event(row, cursor):
+    """One SSE message; the id is the cursor after this event, the data the delta the dashboard applies"""
+    data = {
+        'attempt_id': row.attempt_id,
+        'state_id': row.state_id,
+        'name': row.participant_name,
+        'step': row.step_number,
+        'by': row.admin_name,
+        'decision': row.decision,
+        'at': row.created_at.strftime('%B %d, %Y at %I:%M %p') if row.created_at else None
+    }
+    data = {key: value for key, value in data.items() if value is not None}
+    return f'id: {format_cursor(cursor)}\nevent: {row.kind}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+def stream_events(cursor):
+    """
+    Generator for the SSE response body.
+
+    Sends the reconnect delay and everything after `cursor` ({shard
+    number: event id}). With SSE_HOLD_SECONDS > 0 it keeps polling the
+    feed for that long before closing; otherwise it closes straight away.
+    """
+    from app import db
+
+    config = current_app.config
+    cursor = dict(cursor)
+    yield f'retry: {config["SSE_RETRY_MS"]}\n\n'
+
+    deadline = time.monotonic() + config['SSE_HOLD_SECONDS']
+    while True:
+        pairs, more = events_since(cursor)
+        # Don't hold a pooled connection while idle
+        db.session.remove()
+
+        for number, row in pairs:
+            cursor[number] = row.event_id
+            yield format_event(row, cursor)
+
+        if more:
+            continue
+        if time.monotonic() + config['SSE_POLL_SECONDS'] > deadline:
+            break
+        yield ': keepalive\n\n'
+        time.sleep(config['SSE_POLL_SECONDS'])
+
+
+def _prune_shard_events(cutoff):
+    from app import db
+    from app.models import ReviewQueueEvent
+
+    removed = ReviewQueueEvent.query.filter(ReviewQueueEvent.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+
+def prune_events(days):
+    """Delete feed rows older than `days` in every shard; returns how many were removed"""
+    from app.sharding import gather
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    return sum(gather(_prune_shard_events, cutoff))
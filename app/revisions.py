@@ -0,0 +1,194 @@
+"""
+Written response revision history for the CBT Application
+
+A participant revising an attempt after `needs_revision` overwrites
+Response.response_text. Before that happens, record_revision() appends
+the change to response_revisions. The first version is stored in full;
+each later version is stored as a word-level delta against the one
+before it. Deltas are JSON ops: a number copies that many tokens, a
+negative number skips them, and a string inserts text. Every row is
+zlib-compressed. A delta that would come out larger than the text
+itself is stored in full instead, which also keeps the chains short.
+
+text_at() rebuilds any version. It applies deltas forward from the
+nearest full version at or before it. changes_since() gives the review
+page a diff of each answer against the version the clinician last
+reviewed. It loads only the rows needed to rebuild that one version.
+"""
+import difflib
+import json
+import re
+import zlib
+from datetime import datetime, timezone
+
+_TOKEN = re.compile(r'\s+|[^\s]+')
+
+
+def _tokens(text):
+    return _TOKEN.findall(text or '')
+
+
+def encode_delta(old, new):
+    """Ops turning `old` into `new`, as a list"""
+    a, b = _tokens(old), _tokens(new)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(-(i2 - i1))
+        if j2 > j1:
+            ops.append(''.join(b[j1:j2]))
+    return ops
+
+
+def apply_delta(old, ops):
+    """The text `ops` (from encode_delta) produce from `old`"""
+    tokens = _tokens(old)
+    position = 0
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        elif op > 0:
+            parts.extend(tokens[position:position + op])
+            position += op
+        else:
+            position -= op
+    return ''.join(parts)
+
+
+def diff_segments(old, new):
+    """[(kind, text)] with kind 'equal', 'insert' or 'delete', for showing a change inline"""
+    a, b = _tokens(old), _tokens(new)
+    segments = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            segments.append(('equal', ''.join(a[i1:i2])))
+            continue
+        if i2 > i1:
+            segments.append(('delete', ''.join(a[i1:i2])))
+        if j2 > j1:
+            segments.append(('insert', ''.join(b[j1:j2])))
+    return segments
+
+
+def _pack(payload):
+    return zlib.compress(payload.encode('utf-8'), 9)
+
+
+def _unpack(data):
+    return zlib.decompress(data).decode('utf-8')
+
+
+def record_revision(response, old_text, new_text):
+    """
+    Append a written answer's new text to its history. `old_text` is its
+    text until now, None for a new answer. Adds to the session; the caller
+    commits along with the response.
+    """
+    from app import db
+    from app.models import ResponseRevision
+
+    now = datetime.now(timezone.utc)
+
+    if old_text is None:
+        db.session.add(ResponseRevision(response_id=response.response_id, revision_number=1,
+                                        is_full=True, data=_pack(new_text), created_at=now))
+        return
+    if old_text == new_text:
+        return
+
+    latest = db.session.query(db.func.max(ResponseRevision.revision_number)).filter(
+        ResponseRevision.response_id == response.response_id
+    ).scalar()
+    if latest is None:
+        # Answered before revisions were kept: the text until now becomes version 1
+        db.session.add(ResponseRevision(response_id=response.response_id, revision_number=1, is_full=True,
+                                        data=_pack(old_text), created_at=response.timestamp or now))
+        latest = 1
+
+    full = _pack(new_text)
+    delta = _pack(json.dumps(encode_delta(old_text, new_text), separators=(',', ':')))
+    is_full = len(full) <= len(delta)
+    db.session.add(ResponseRevision(response_id=response.response_id, revision_number=latest + 1,
+                                    is_full=is_full, data=full if is_full else delta, created_at=now))
+
+
+def _rebuild(rows):
+    """Text of the last of `rows`, consecutive revisions starting with a full one"""
+    text = None
+    for row in rows:
+        text = _unpack(row.data) if row.is_full else apply_delta(text, json.loads(_unpack(row.data)))
+    return text
+
+
+def _chains(targets):
+    """{response_id: text} for {response_id: revision_number}, loading only the rows each chain needs"""
+    from app import db
+    from app.models import ResponseRevision as Revision
+
+    if not targets:
+        return {}
+
+    # Each chain starts at the newest full revision at or before its target;
+    # found from the revision numbers alone, without loading any data
+    up_to = [db.and_(Revision.response_id == response_id, Revision.revision_number <= number)
+             for response_id, number in targets.items()]
+    starts = db.session.query(
+        Revision.response_id, db.func.max(Revision.revision_number)
+    ).filter(Revision.is_full.is_(True), db.or_(*up_to)).group_by(Revision.response_id).all()
+    if not starts:
+        return {}
+
+    ranges = [db.and_(Revision.response_id == response_id,
+                      Revision.revision_number.between(start, targets[response_id]))
+              for response_id, start in starts]
+    chains = {}
+    for row in db.session.query(
+        Revision.response_id, Revision.revision_number, Revision.is_full, Revision.data
+    ).filter(db.or_(*ranges)).order_by(Revision.response_id, Revision.revision_number):
+        chains.setdefault(row.response_id, []).append(row)
+
+    return {response_id: _rebuild(chain) for response_id, chain in chains.items()}
+
+
+def text_at(response_id, revision_number):
+    """A response's text as of one revision (None if there is no such revision)"""
+    return _chains({response_id: revision_number}).get(response_id)
+
+
+def changes_since(responses, since):
+    """
+    What changed in written answers after `since` (the attempt's last review).
+
+    `responses` are the attempt's Response objects. Returns
+    {response_id: [(kind, text)]} for every answer edited since then (see
+    diff_segments()). An answer first written after the review is one
+    insert.
+    """
+    from app import db
+    from app.models import ResponseRevision
+
+    written = {response.response_id: response for response in responses if response.response_text is not None}
+    if since is None or not written:
+        return {}
+    since = since.replace(tzinfo=None)
+
+    # Per response: the newest revision at the review and whether anything came after
+    rows = db.session.query(
+        ResponseRevision.response_id,
+        db.func.max(db.case((ResponseRevision.created_at <= since, ResponseRevision.revision_number))).label('reviewed'),
+        db.func.max(db.case((ResponseRevision.created_at > since, ResponseRevision.revision_number))).label('latest')
+    ).filter(
+        ResponseRevision.response_id.in_(written)
+    ).group_by(ResponseRevision.response_id).all()
+
+    changed = {row.response_id: row.reviewed for row in rows if row.latest is not None}
+    reviewed_texts = _chains({response_id: number for response_id, number in changed.items() if number})
+
+    return {
+        response_id: diff_segments(reviewed_texts.get(response_id, ''), written[response_id].response_text)
+        for response_id in changed
+    }
@@ -1,12 +1,25 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash, session, abort, current_app
+from flask import (Blueprint, render_template, redirect, url_for, request, flash, session, abort, current_app,
+                   stream_with_context)
 from flask_login import login_user, login_required, current_user
-from werkzeug.security import check_password_hash
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import joinedload
 from functools import wraps
-from datetime import datetime, timezone
-
-from app import db, limiter
+from markupsafe import Markup
+from datetime import datetime, timedelta, timezone
+
+from app import audit, db, limiter
+from app.caseload import clinician_caseload, days_waiting
+from app.conditional import attempt_validator, make_etag, latest, not_modified, with_validators
+from app.profiling import timing_phase
+from app.projections import pending_attempt_rows
+from app.review_feed import record_queue_event, latest_cursor, parse_cursor, claimed_by, stream_events
+from app.jobs import enqueue_after_commit
+from app.revisions import changes_since
+from app.search import search_responses
+from app.serving import check_password
+from app.sharding import gather_all
+from app.similarity import similar_responses
+from app.snapshots import snapshot_version, load_snapshot, save_snapshot, invalidate_snapshots
 from app.models import User, Admin, Assessment, AssessmentAttempt, Response, Question
 from app.validators import (
     ValidationError,
@@ -44,14 +57,19 @@ def admin_login():
 
             admin = Admin.query.get(admin_id)
 
-            if admin and admin.is_active and check_password_hash(admin.password_hash, password):
+            with timing_phase('hash'):
+                valid_login = admin and admin.is_active and check_password(admin.password_hash, password)
+
+            if valid_login:
                 session.clear()
                 login_user(admin)
                 session['user_type'] = 'admin'
                 current_app.logger.info(f'Successful admin login: admin_id={admin_id}')
+                audit.record('login', actor_type='admin', actor_id=admin_id)
                 return redirect(url_for('admin.admin_dashboard'))
             else:
                 current_app.logger.warning(f'Failed admin login attempt: admin_id={admin_id}, reason=invalid_credentials')
+                audit.record('login_failed', actor_type='admin', actor_id=admin_id)
                 flash('Invalid admin ID or password')
         except ValidationError as e:
             current_app.logger.warning(f'Failed admin login attempt: admin_id={request.form.get("admin_id")}, reason=validation_error, error={str(e)}')
@@ -65,15 +83,96 @@ def admin_login():
 @admin_required
 def admin_dashboard():
     """Admin dashboard showing pending assessments"""
-    # Get all submitted attempts that need review (status = 'submitted')
-    pending_attempts = AssessmentAttempt.query.filter_by(
-        status='submitted'
-    ).options(
-        joinedload(AssessmentAttempt.user),
-        joinedload(AssessmentAttempt.assessment).joinedload(Assessment.step)
-    ).order_by(AssessmentAttempt.submitted_at.desc()).all()
+    # Submitted attempts from every shard, newest first
+    pending_attempts = sorted(gather_all(pending_attempt_rows), key=lambda attempt: attempt.submitted_at, reverse=True)
+
+    # The page follows the review queue feed from here on
+    return render_template('admin_dashboard.html', pending_attempts=pending_attempts,
+                           feed_cursor=latest_cursor())
+
+
+@admin.route('/queue/events')
+@login_required
+@admin_required
+def queue_events():
+    """Server-sent events: review queue changes after the client's last event"""
+    cursor = parse_cursor(request.headers.get('Last-Event-ID') or request.args.get('after'))
+
+    response = current_app.response_class(stream_with_context(stream_events(cursor)),
+                                          mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
 
-    return render_template('admin_dashboard.html', pending_attempts=pending_attempts)
+
+@admin.route('/caseload')
+@login_required
+@admin_required
+def caseload():
+    """Assigned participants with their progress and review backlog"""
+    admin_id = current_user.admin_id
+    clinicians = None
+
+    # Supervisors can look at any clinician's caseload
+    if current_user.role == 'supervisor':
+        clinicians = Admin.query.filter_by(is_active=True).order_by(Admin.last_name).all()
+        if request.args.get('admin_id'):
+            try:
+                admin_id = validate_admin_id(request.args.get('admin_id'))
+            except ValidationError as e:
+                flash(str(e))
+                return redirect(url_for('admin.caseload'))
+
+    clinician = current_user if admin_id == current_user.admin_id else Admin.query.get_or_404(admin_id)
+    participants = clinician_caseload(admin_id)
+
+    return render_template('caseload.html',
+                           clinician=clinician,
+                           clinicians=clinicians,
+                           participants=participants,
+                           days_waiting=days_waiting,
+                           awaiting_review=sum(1 for row in participants if row.unreviewed))
+
+
+@admin.route('/search')
+@login_required
+@admin_required
+def search():
+    """Ranked full-text search over participants' written responses"""
+    q = request.args.get('q', '').strip()
+    step = request.args.get('step', type=int)
+    admin_filter = request.args.get('admin', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    date_from = request.args.get('start', '')
+    date_to = request.args.get('end', '')
+
+    results, has_more = [], False
+    if q:
+        try:
+            start = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
+            # The end date is inclusive: everything before the following midnight
+            end = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1) if date_to else None
+            results, has_more = search_responses(q, step=step, date_from=start, date_to=end,
+                                                 admin_id=admin_filter or None, page=page)
+        except ValueError:
+            flash('Dates must be in YYYY-MM-DD format.')
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            current_app.logger.error(f'Database error in search: admin={current_user.admin_id}, q={q!r}, error={str(e)}')
+            flash('Search is unavailable right now. Please try again.')
+
+    all_admins = Admin.query.filter_by(is_active=True).order_by(Admin.last_name).all()
+
+    return render_template('search_responses.html',
+                           q=q,
+                           step=step,
+                           admin_filter=admin_filter,
+                           date_from=date_from,
+                           date_to=date_to,
+                           page=page,
+                           results=results,
+                           has_more=has_more,
+                           all_admins=all_admins)
 
 
 @admin.route('/review/<int:attempt_id>', methods=['GET', 'POST'])
@@ -95,17 +194,53 @@ def review_attempt(attempt_id):
         assessment_id=attempt.assessment_id
     ).order_by(Question.question_order).all()
 
+    # Written answers that closely match another participant's or an earlier step's
+    similar = similar_responses(attempt_id)
+
+    # A resubmitted attempt: what the participant changed since it was last reviewed
+    changes = changes_since(responses, attempt.reviewed_at)
+
     return render_template('review_attempt.html',
                            attempt=attempt,
                            questions=questions,
-                           responses_by_question=responses_by_question)
+                           responses_by_question=responses_by_question,
+                           similar=similar,
+                           changes=changes,
+                           claimed=attempt.status == 'submitted' and claimed_by(attempt_id, current_user.admin_id))
 
 
-@admin.route('/view/<int:attempt_id>')
+@admin.route('/review/<int:attempt_id>/claim', methods=['POST'])
 @login_required
 @admin_required
-def view_attempt(attempt_id):
-    """View any assessment attempt in read-only mode"""
+def claim_review(attempt_id):
+    """Show every other dashboard that this admin is reviewing the attempt"""
+    attempt = AssessmentAttempt.query.get_or_404(attempt_id)
+
+    if attempt.status == 'submitted' and not claimed_by(attempt_id, current_user.admin_id):
+        try:
+            record_queue_event('claimed', attempt_id, admin=current_user)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            current_app.logger.error(f'Database error recording review claim: admin={current_user.admin_id}, attempt_id={attempt_id}, error={str(e)}')
+            flash('An error occurred while claiming the review. Please try again.')
+
+    return redirect(url_for('admin.review_attempt', attempt_id=attempt_id))
+
+
+def render_attempt_body(attempt_id, validator):
+    """
+    Render the read-only body of an attempt page.
+
+    Approved attempts are served from their on-disk snapshot, which is
+    written the first time they are rendered.
+    """
+    version = snapshot_version(validator) if validator.status == 'approved' else None
+    if version:
+        body = load_snapshot(attempt_id, version)
+        if body is not None:
+            return Markup(body)
+
     # Get attempt with eager loading to avoid N+1 queries
     attempt = AssessmentAttempt.query.options(
         joinedload(AssessmentAttempt.user),
@@ -128,12 +263,71 @@ def view_attempt(attempt_id):
         assessment_id=attempt.assessment_id
     ).order_by(AssessmentAttempt.attempt_number).all()
 
-    return render_template('view_attempt.html',
+    body = render_template('view_attempt_body.html',
                            attempt=attempt,
                            questions=questions,
                            responses_by_question=responses_by_question,
                            all_attempts=all_attempts)
 
+    if version:
+        save_snapshot(attempt_id, version, body)
+
+    return Markup(body)
+
+
+def render_attempt_print(attempt_id, validator):
+    """Render the standalone print page, snapshotted like the body for approved attempts"""
+    version = snapshot_version(validator) if validator.status == 'approved' else None
+    if version:
+        page = load_snapshot(attempt_id, version, variant='print')
+        if page is not None:
+            return page
+
+    page = render_template('view_attempt_print.html',
+                           attempt_id=attempt_id,
+                           attempt_body=render_attempt_body(attempt_id, validator))
+
+    if version:
+        save_snapshot(attempt_id, version, page, variant='print')
+
+    return page
+
+
+@admin.route('/view/<int:attempt_id>')
+@login_required
+@admin_required
+def view_attempt(attempt_id):
+    """View any assessment attempt in read-only mode"""
+    # Answer revalidation from a one-row validator query before loading anything.
+    # In-progress attempts can change without touching the validator columns.
+    validator = attempt_validator(attempt_id)
+    if validator is None:
+        abort(404)
+
+    cacheable = validator.status != 'in_progress'
+    if cacheable:
+        etag = make_etag(current_user.get_id(), current_user.first_name, *validator)
+        last_modified = latest(validator.submitted_at, validator.reviewed_at, validator.last_response_at)
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+
+    html = render_template('view_attempt.html', attempt_body=render_attempt_body(attempt_id, validator))
+
+    return with_validators(html, etag, last_modified) if cacheable else html
+
+
+@admin.route('/view/<int:attempt_id>/print')
+@login_required
+@admin_required
+def view_attempt_print(attempt_id):
+    """Print-friendly read-only view of an attempt"""
+    validator = attempt_validator(attempt_id)
+    if validator is None:
+        abort(404)
+
+    return render_attempt_print(attempt_id, validator)
+
 
 @admin.route('/review/<int:attempt_id>/submit', methods=['POST'])
 @login_required
@@ -147,6 +341,9 @@ def submit_review(attempt_id):
         decision = validate_decision(request.form.get('decision'))
         clinician_notes = validate_text_response(request.form.get('clinician_notes'), "Clinician note", max_length=5000)
 
+        # Reviewing an approved attempt again reopens it
+        reopened = attempt.status == 'approved'
+
         # Update the attempt based on decision
         if decision == 'approve':
             attempt.status = 'approved'
@@ -165,10 +362,18 @@ def submit_review(attempt_id):
         attempt.reviewed_by = current_user.admin_id
         attempt.reviewed_at = datetime.now(timezone.utc)
         attempt.clinician_notes = clinician_notes
+        record_queue_event('reviewed', attempt_id, admin=current_user, decision=decision)
 
         # Save changes
         db.session.commit()
+        if reopened:
+            invalidate_snapshots(attempt_id)
+
+        # Render the approved attempt's snapshot in the background, not on its first view
+        if decision == 'approve':
+            enqueue_after_commit('snapshot_attempt', {'attempt_id': attempt_id}, dedup_key=f'snapshot_attempt:{attempt_id}')
         current_app.logger.info(f'Assessment review submitted: admin={current_user.admin_id}, attempt_id={attempt_id}, decision={decision}')
+        audit.record('review_submitted', 'attempt', attempt_id, {'decision': decision}, critical=True)
     except ValidationError as e:
         flash(str(e))
         return redirect(url_for('admin.review_attempt', attempt_id=attempt_id))
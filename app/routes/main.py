@@ -1,8 +1,16 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, session, abort, current_app
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import check_password_hash
 from sqlalchemy.exc import SQLAlchemyError
-from app import db, limiter
+from app import audit, db, limiter
+from app.conditional import participant_validator, make_etag, latest, not_modified, with_validators
+from app.dwell import record_event
+from app.jobs import enqueue_after_commit
+from app.profiling import timing_phase
+from app.review_feed import record_queue_event
+from app.revisions import record_revision
+from app.search import index_response
+from app.serving import check_password
+from app.sharding import use_shard, shard_for_state_id
 from app.models import User, Step, Assessment, Question, Response, AssessmentAttempt, Admin
 from app.validators import (
     ValidationError,
@@ -36,16 +44,22 @@ def login():
             state_id = validate_state_id(request.form.get('state_id'))
             password = validate_password(request.form.get('password'))
 
+            use_shard(shard_for_state_id(state_id))
             user = User.query.get(state_id)
 
-            if user and user.is_active and check_password_hash(user.password_hash, password):
+            with timing_phase('hash'):
+                valid_login = user and user.is_active and check_password(user.password_hash, password)
+
+            if valid_login:
                 session.clear()
                 login_user(user)
                 session['user_type'] = 'participant'
                 current_app.logger.info(f'Successful login: user={state_id}')
+                audit.record('login', actor_type='participant', actor_id=state_id)
                 return redirect(url_for('main.dashboard'))
             else:
                 current_app.logger.warning(f'Failed login attempt: state_id={state_id}, reason=invalid_credentials')
+                audit.record('login_failed', actor_type='participant', actor_id=state_id)
                 flash('Invalid state ID or password')
         except ValidationError as e:
             current_app.logger.warning(f'Failed login attempt: state_id={request.form.get("state_id")}, reason=validation_error, error={str(e)}')
@@ -59,9 +73,11 @@ def login():
 def logout():
     """Logout user"""
     user_id = current_user.get_id()
+    user_type = session.get('user_type', 'participant')
     session.clear()
     logout_user()
     current_app.logger.info(f'User logged out: user={user_id}')
+    audit.record('logout', actor_type=user_type, actor_id=user_id)
     return redirect(url_for('main.login'))
 
 
@@ -73,6 +89,17 @@ def dashboard():
     if isinstance(current_user, Admin):
         return redirect(url_for('admin.admin_dashboard'))
 
+    # Revalidate cached copies from the participant's attempt summary. Skipped
+    # while an approval can be dismissed, since that form carries a CSRF token.
+    user_fields, attempt_rows = participant_validator(current_user.state_id)
+    cacheable = not any(row.status == 'approved' and not row.approval_viewed for row in attempt_rows)
+    if cacheable:
+        etag = make_etag(user_fields, *attempt_rows)
+        last_modified = latest(*(latest(row.started_at, row.submitted_at, row.reviewed_at) for row in attempt_rows))
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+
     # Get current step
     current_step = Step.query.filter_by(step_number=current_user.current_step).first()
 
@@ -113,13 +140,15 @@ def dashboard():
             unviewed_approval = prev_attempt_data
             break
 
-    return render_template('dashboard.html',
+    html = render_template('dashboard.html',
                            current_step=current_step,
                            current_attempt=current_attempt,
                            previous_attempts=previous_attempts,
                            unviewed_approval=unviewed_approval
                            )
 
+    return with_validators(html, etag, last_modified) if cacheable else html
+
 
 @main.route('/dismiss-approval/<int:attempt_id>', methods=['POST'])
 @login_required
@@ -219,10 +248,8 @@ def start_assessment(step_number):
 
         db.session.commit()
 
-        # Store in session for performance (acts as cache)
+        # The session only points at the attempt; its order and position stay in the database
         session['current_attempt_id'] = attempt.attempt_id
-        session['question_order'] = question_order
-        session['current_question_index'] = attempt.current_question_index
 
         # Redirect to first question
         first_question_id = question_order[attempt.current_question_index]
@@ -266,8 +293,7 @@ def show_question(question_id):
         flash('Question not found.')
         return redirect(url_for('main.dashboard'))
 
-    # Get question order from database (source of truth)
-    question_order = attempt.question_order or session.get('question_order', [])
+    question_order = attempt.question_order or []
 
     # Determine the actual index of the current question in the order
     # This ensures correct tracking whether user navigates forward or backward
@@ -278,7 +304,7 @@ def show_question(question_id):
         flash('Invalid question for this assessment.')
         return redirect(url_for('main.dashboard'))
 
-    # Update database and session cache with the actual index
+    # Remember the actual index so the participant can resume here
     if attempt.current_question_index != current_index:
         try:
             attempt.current_question_index = current_index
@@ -288,9 +314,6 @@ def show_question(question_id):
             current_app.logger.error(f'Error updating question index: user={current_user.state_id}, question_id={question_id}, error={str(e)}')
             # Continue anyway - this is not critical
 
-    session['question_order'] = question_order
-    session['current_question_index'] = current_index
-
     if request.method == 'POST':
         try:
             # Check if a response already exists for this attempt/question combo
@@ -315,6 +338,8 @@ def show_question(question_id):
                 response_text = validate_text_response(request.form.get('response_text'),"Response")
 
                 if response:
+                    # Keep the text being replaced in the revision history
+                    record_revision(response, response.response_text, response_text)
                     response.response_text = response_text
                 else:
                     response = Response(
@@ -323,6 +348,11 @@ def show_question(question_id):
                         response_text=response_text
                     )
                     db.session.add(response)
+                    db.session.flush()
+                    record_revision(response, None, response_text)
+
+                # Same transaction as the response, so the search index can't drift
+                index_response(response.response_id, response_text)
 
             # Move to next question or finish
             next_index = current_index + 1
@@ -367,6 +397,18 @@ def show_question(question_id):
                            )
 
 
+@main.route('/question/<int:question_id>/dwell', methods=['POST'])
+@login_required
+@limiter.limit("120 per minute")
+def question_dwell(question_id):
+    """Timing beacon from the question page; buffered, so it never touches the database here"""
+    attempt_id = session.get('current_attempt_id')
+    dwell_ms = request.form.get('dwell_ms', type=int)
+    if attempt_id and dwell_ms is not None:
+        record_event(attempt_id, question_id, request.form.get('kind'), dwell_ms)
+    return '', 204
+
+
 @main.route('/assessment/complete')
 @login_required
 def assessment_complete():
@@ -384,16 +426,18 @@ def assessment_complete():
                 # Mark as submitted (no longer in_progress)
                 attempt.status = 'submitted'
                 attempt.submitted_at = datetime.now(timezone.utc)
+                record_queue_event('submitted', attempt_id)
                 db.session.commit()
                 current_app.logger.info(f'Assessment submitted: user={current_user.state_id}, attempt_id={attempt_id}')
             except SQLAlchemyError as e:
                 db.session.rollback()
                 current_app.logger.error(f'Database error in assessment_complete: user={current_user.state_id}, attempt_id={attempt_id}, error={str(e)}')
                 flash('An error occurred while submitting the assessment. Please contact support.')
+            else:
+                # MinHash signatures take a while in pure Python; the job worker computes them
+                enqueue_after_commit('index_attempt', {'attempt_id': attempt_id}, dedup_key=f'index_attempt:{attempt_id}')
 
     # Clear session data
-    session.pop('question_order', None)
-    session.pop('current_question_index', None)
     session.pop('current_attempt_id', None)
 
     return render_template('assessment_complete.html')
@@ -403,7 +447,8 @@ def assessment_complete():
 @main.app_errorhandler(404)
 def page_not_found(error):
     """Handle 404 errors with a custom page"""
-    current_app.logger.warning(f'404 error: path={request.path}, user={current_user.get_id() if current_user.is_authenticated else "anonymous"}')
+    current_app.logger.warning(f'404 error: path={request.path}, user={current_user.get_id() if current_user.is_authenticated else "anonymous"}',
+                               extra={'sample': True})
     return render_template('404.html'), 404
 
 
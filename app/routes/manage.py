@@ -1,11 +1,20 @@
+from datetime import date, datetime, timedelta, timezone
 from functools import wraps
-from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, current_app, g
 from flask_login import login_required, current_user
 from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.security import generate_password_hash
 
-from app import db
-from app.models import User, Admin, AssessmentAttempt
+from app import audit, db
+from app.models import User, Admin, Job
+from app.audit import AUDIT_ACTIONS, query_events
+from app.conditional import participant_validator, make_etag, latest, not_modified, with_validators
+from app.dwell import question_time_rows
+from app.jobs import job_counts
+from app.projections import participant_rows, admin_rows
+from app.rebalance import plan_rebalance, apply_plan
+from app.sharding import gather_all, use_shard, shard_for_state_id, shard_keys
+from app.timeline import participant_timeline, timeline_summary
 from app.validators import (
     ValidationError,
     validate_state_id,
@@ -50,10 +59,34 @@ def list_users():
     step_filter = request.args.get('step', '')
     admin_filter = request.args.get('admin', '')
 
-    query = User.query
+    try:
+        criteria = _user_filters(search, step_filter, admin_filter)
+    except ValidationError as e:
+        flash(str(e), 'error')
+        step_filter = ''
+        criteria = _user_filters(search, step_filter, admin_filter)
+
+    # Every shard is searched in parallel, then the pages merged
+    users = sorted(gather_all(participant_rows, *criteria),
+                   key=lambda user: (user.last_name, user.first_name))
+
+    # Admin list for filter dropdown
+    all_admins = Admin.query.filter_by(is_active=True).order_by(Admin.last_name).all()
+
+    return render_template('manage_users_list.html',
+                           users=users,
+                           all_admins=all_admins,
+                           search=search,
+                           step_filter=step_filter,
+                           admin_filter=admin_filter)
+
+
+def _user_filters(search, step_filter, admin_filter):
+    """WHERE criteria for the user list filters; raises ValidationError for a bad step"""
+    criteria = []
 
     if search:
-        query = query.filter(
+        criteria.append(
             db.or_(
                 User.state_id.ilike(f'%{search}%'),
                 User.first_name.ilike(f'%{search}%'),
@@ -62,22 +95,42 @@ def list_users():
         )
 
     if step_filter:
-        query = query.filter_by(current_step=int(step_filter))
+        criteria.append(User.current_step == validate_integer_id(step_filter, 'Step'))
 
     if admin_filter:
-        query = query.filter_by(assigned_admin_id=admin_filter)
+        criteria.append(User.assigned_admin_id == admin_filter)
 
-    users = query.order_by(User.last_name, User.first_name).all()
+    return criteria
 
-    # Admin list for filter dropdown
-    all_admins = Admin.query.filter_by(is_active=True).order_by(Admin.last_name).all()
 
-    return render_template('manage_users_list.html',
-                           users=users,
-                           all_admins=all_admins,
-                           search=search,
-                           step_filter=step_filter,
-                           admin_filter=admin_filter)
+def _bulk_update(action, form):
+    """
+    The column values a bulk action sets, and a criterion matching only the
+    users it would change (so the affected count is what really changed)
+    """
+    if action == 'deactivate':
+        return {'is_active': False}, User.is_active.is_(True)
+
+    if action == 'reactivate':
+        return {'is_active': True}, User.is_active.is_(False)
+
+    if action == 'reassign':
+        admin_id = form.get('assigned_admin_id') or None
+        if admin_id is None:
+            return {'assigned_admin_id': None}, User.assigned_admin_id.isnot(None)
+        if not Admin.query.filter_by(admin_id=admin_id, is_active=True).first():
+            raise ValidationError("Select an active admin to reassign to.")
+        return {'assigned_admin_id': admin_id}, db.or_(User.assigned_admin_id.is_(None),
+                                                       User.assigned_admin_id != admin_id)
+
+    if action == 'move_step':
+        current_step = validate_integer_id(form.get('current_step'), 'Step')
+        if current_step > 12:
+            raise ValidationError("Step must be between 1 and 12")
+        return {'current_step': current_step}, db.or_(User.current_step.is_(None),
+                                                      User.current_step != current_step)
+
+    raise ValidationError("Choose a bulk action.")
 
 
 @manage.route('/users/create', methods=['GET', 'POST'])
@@ -88,6 +141,7 @@ def create_user():
     if request.method == 'POST':
         try:
             state_id = validate_state_id(request.form.get('state_id'))
+            use_shard(shard_for_state_id(state_id))
             validate_unique_state_id(state_id)
             first_name = validate_name(request.form.get('first_name'), 'First name')
             last_name = validate_name(request.form.get('last_name'), 'Last name')
@@ -112,6 +166,8 @@ def create_user():
             db.session.commit()
 
             current_app.logger.info(f'User created: state_id={state_id}, created_by={current_user.admin_id}')
+            audit.record('user_created', 'participant', state_id,
+                         {'current_step': current_step, 'assigned_admin_id': assigned_admin_id}, critical=True)
             flash(f'User {state_id} created successfully!', 'success')
             return redirect(url_for('manage.list_users'))
 
@@ -163,6 +219,9 @@ def edit_user(state_id):
             db.session.commit()
 
             current_app.logger.info(f'User updated: state_id={state_id}, updated_by={current_user.admin_id}')
+            audit.record('user_updated', 'participant', state_id,
+                         {'current_step': current_step, 'assigned_admin_id': assigned_admin_id,
+                          'password_changed': bool(new_password)}, critical=True)
             flash(f'User {state_id} updated successfully!', 'success')
             return redirect(url_for('manage.list_users'))
 
@@ -192,6 +251,7 @@ def deactivate_user(state_id):
     db.session.commit()
 
     current_app.logger.info(f'User deactivated: state_id={state_id}, deactivated_by={current_user.admin_id}')
+    audit.record('user_deactivated', 'participant', state_id, critical=True)
     flash(f'User {state_id} deactivated successfully.', 'success')
     return redirect(url_for('manage.list_users'))
 
@@ -207,10 +267,81 @@ def reactivate_user(state_id):
     db.session.commit()
 
     current_app.logger.info(f'User reactivated: state_id={state_id}, reactivated_by={current_user.admin_id}')
+    audit.record('user_reactivated', 'participant', state_id, critical=True)
     flash(f'User {state_id} reactivated successfully.', 'success')
     return redirect(url_for('manage.list_users'))
 
 
+@manage.route('/users/bulk', methods=['POST'])
+@login_required
+@supervisor_required
+def bulk_users():
+    """Apply one action to the selected users, or to every user matching the list filters"""
+    action = request.form.get('action', '')
+    scope = request.form.get('scope', 'selected')
+    search = request.form.get('search', '').strip()
+    step_filter = request.form.get('step', '')
+    admin_filter = request.form.get('admin', '')
+    back = redirect(url_for('manage.list_users', search=search or None,
+                            step=step_filter or None, admin=admin_filter or None))
+
+    affected = 0
+    try:
+        values, changes = _bulk_update(action, request.form)
+
+        # One UPDATE per shard holding any of the users
+        if scope == 'filter':
+            criteria = _user_filters(search, step_filter, admin_filter)
+            batches = {key: criteria for key in shard_keys()}
+            target = f'filter(search={search!r}, step={step_filter or None}, admin={admin_filter or None})'
+        else:
+            state_ids = request.form.getlist('state_ids')
+            if not state_ids:
+                raise ValidationError("Select at least one user.")
+            by_shard = {}
+            for state_id in state_ids:
+                by_shard.setdefault(shard_for_state_id(state_id), []).append(state_id)
+            batches = {key: [User.state_id.in_(ids)] for key, ids in by_shard.items()}
+            target = f'{len(state_ids)} selected'
+
+        # A transaction can't span shards: each shard commits on its own. The
+        # criteria only match users still needing the change, so repeating
+        # the action after a failure finishes what is left
+        previous_shard = g.get('shard')
+        try:
+            for key, criteria in batches.items():
+                use_shard(key)
+                updated = User.query.filter(*criteria, changes).update(values, synchronize_session=False)
+                db.session.commit()
+                affected += updated
+        finally:
+            use_shard(previous_shard)
+
+        current_app.logger.info(f'Bulk user update: action={action}, values={values}, target={target}, '
+                                f'affected={affected}, updated_by={current_user.admin_id}')
+        audit.record('users_bulk_updated', 'participant', details={
+            'action': action, 'values': values, 'target': target, 'affected': affected,
+            'state_ids': request.form.getlist('state_ids') if scope != 'filter' else None
+        }, critical=True)
+        flash(f'{affected} user(s) updated.', 'success')
+
+    except ValidationError as e:
+        flash(str(e), 'error')
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.error(f'Database error in bulk_users: admin={current_user.admin_id}, action={action}, '
+                                 f'affected={affected}, error={str(e)}')
+        if affected:
+            audit.record('users_bulk_updated', 'participant', details={
+                'action': action, 'values': values, 'target': target, 'affected': affected, 'incomplete': True
+            }, critical=True)
+            flash(f'An error occurred after {affected} user(s) were updated. Run the action again to update the rest.', 'error')
+        else:
+            flash('An error occurred while updating the users.', 'error')
+
+    return back
+
+
 # Manage admins
 @manage.route('/admins')
 @login_required
@@ -220,10 +351,10 @@ def list_admins():
     search = request.args.get('search', '').strip()
     role_filter = request.args.get('role', '')
 
-    query = Admin.query
+    criteria = []
 
     if search:
-        query = query.filter(
+        criteria.append(
             db.or_(
                 Admin.admin_id.ilike(f'%{search}%'),
                 Admin.first_name.ilike(f'%{search}%'),
@@ -233,9 +364,9 @@ def list_admins():
         )
 
     if role_filter:
-        query = query.filter_by(role=role_filter)
+        criteria.append(Admin.role == role_filter)
 
-    admins = query.order_by(Admin.last_name, Admin.first_name).all()
+    admins = admin_rows(*criteria)
 
     return render_template('manage_admins_list.html',
                            admins=admins,
@@ -280,6 +411,7 @@ def create_admin():
             db.session.commit()
 
             current_app.logger.info(f'Admin created: admin_id={admin_id}, role={role}, created_by={current_user.admin_id}')
+            audit.record('admin_created', 'admin', admin_id, {'role': role}, critical=True)
             flash(f'Admin {admin_id} created successfully!', 'success')
             return redirect(url_for('manage.list_admins'))
 
@@ -326,6 +458,8 @@ def edit_admin(admin_id):
             db.session.commit()
 
             current_app.logger.info(f'Admin updated: admin_id={admin_id}, updated_by={current_user.admin_id}')
+            audit.record('admin_updated', 'admin', admin_id,
+                         {'role': role, 'password_changed': bool(new_password)}, critical=True)
             flash(f'Admin {admin_id} updated successfully!', 'success')
             return redirect(url_for('manage.list_admins'))
 
@@ -356,6 +490,7 @@ def deactivate_admin(admin_id):
     db.session.commit()
 
     current_app.logger.info(f'Admin deactivated: admin_id={admin_id}, deactivated_by={current_user.admin_id}')
+    audit.record('admin_deactivated', 'admin', admin_id, critical=True)
     flash(f'Admin {admin_id} deactivated successfully.', 'success')
     return redirect(url_for('manage.list_admins'))
 
@@ -371,6 +506,7 @@ def reactivate_admin(admin_id):
     db.session.commit()
 
     current_app.logger.info(f'Admin reactivated: admin_id={admin_id}, reactivated_by={current_user.admin_id}')
+    audit.record('admin_reactivated', 'admin', admin_id, critical=True)
     flash(f'Admin {admin_id} reactivated successfully.', 'success')
     return redirect(url_for('manage.list_admins'))
 
@@ -380,8 +516,147 @@ def reactivate_admin(admin_id):
 @supervisor_required
 def user_profile(state_id):
     """View detailed user profile and history"""
-    user = User.query.get_or_404(state_id)
+    validator = participant_validator(state_id)
+    if validator is None:
+        abort(404)
+
+    user_fields, attempt_rows = validator
+    before = request.args.get('before', type=int)
+    etag = make_etag(current_user.get_id(), current_user.first_name, before, user_fields, *attempt_rows)
+    last_modified = latest(*(latest(row.started_at, row.submitted_at, row.reviewed_at) for row in attempt_rows))
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+
+    attempts, next_cursor = participant_timeline(state_id, before=before)
+
+    # Ongoing steps count days up to today, so the summary also turns over daily
+    summary = timeline_summary(state_id, make_etag(date.today(), *attempt_rows))
+
+    html = render_template('user_profile.html', state_id=state_id, user=user_fields, attempts=attempts,
+                           next_cursor=next_cursor, before=before, summary=summary)
+    return with_validators(html, etag, last_modified)
+
+
+# Background jobs
+@manage.route('/jobs')
+@login_required
+@supervisor_required
+def list_jobs():
+    """Background job counts and the most recent jobs"""
+    status_filter = request.args.get('status', '')
+
+    query = db.session.query(
+        Job.job_id, Job.name, Job.status, Job.attempts, Job.max_attempts,
+        Job.run_at, Job.created_at, Job.finished_at, Job.last_error
+    )
+    if status_filter:
+        query = query.filter(Job.status == status_filter)
+    jobs = query.order_by(Job.job_id.desc()).limit(100).all()
+
+    return render_template('manage_jobs_list.html',
+                           jobs=jobs,
+                           counts=job_counts(),
+                           status_filter=status_filter
+                           )
+
+
+@manage.route('/jobs/<int:job_id>/retry', methods=['POST'])
+@login_required
+@supervisor_required
+def retry_job(job_id):
+    """Queue a failed job again with a fresh set of attempts"""
+    job = Job.query.get_or_404(job_id)
+    if job.status != 'failed':
+        flash(f'Job {job_id} is {job.status} and cannot be retried.')
+        return redirect(url_for('manage.list_jobs'))
+
+    job.status = 'queued'
+    job.attempts = 0
+    job.run_at = datetime.now(timezone.utc)
+    job.finished_at = None
+    db.session.commit()
 
-    attempts = AssessmentAttempt.query.filter_by(state_id=state_id).order_by(AssessmentAttempt.submitted_at.desc()).all()
+    current_app.logger.info(f'Job retried: job_id={job_id}, name={job.name}, retried_by={current_user.admin_id}')
+    flash(f'Job {job_id} queued again.', 'success')
+    return redirect(url_for('manage.list_jobs'))
 
-    return render_template('user_profile.html', user=user, attempts=attempts)
+
+@manage.route('/caseloads/rebalance', methods=['GET', 'POST'])
+@login_required
+@supervisor_required
+def rebalance_caseloads():
+    """Preview a caseload rebalancing plan; POST applies it if it is still the plan confirmed"""
+    plan = plan_rebalance()
+
+    if request.method == 'POST':
+        if request.form.get('token') != plan.token:
+            flash('Caseloads changed since the plan was shown. Review the updated plan below.')
+            return render_template('manage_rebalance.html', plan=plan)
+
+        try:
+            moved = apply_plan(plan)
+            current_app.logger.info(f'Caseloads rebalanced: moved={moved}, by={current_user.admin_id}')
+            audit.record('caseloads_rebalanced', details={
+                'moves': [[m.state_id, m.from_admin_id, m.to_admin_id] for m in plan.moves]
+            }, critical=True)
+            flash(f'Caseloads rebalanced: {moved} participant(s) reassigned.', 'success')
+            return redirect(url_for('manage.rebalance_caseloads'))
+        except ValueError as e:
+            flash(str(e))
+        except SQLAlchemyError as e:
+            current_app.logger.error(f'Database error rebalancing caseloads: {e}')
+            flash('Database error: Unable to rebalance caseloads.')
+        plan = plan_rebalance()
+
+    return render_template('manage_rebalance.html', plan=plan)
+
+
+@manage.route('/audit')
+@login_required
+@supervisor_required
+def audit_log():
+    """Audit trail filtered by actor, target, action and date range"""
+    actor = request.args.get('actor', '').strip()
+    target_type = request.args.get('target_type', '')
+    target = request.args.get('target', '').strip()
+    action = request.args.get('action', '')
+    date_from = request.args.get('start', '')
+    date_to = request.args.get('end', '')
+    before = request.args.get('before', type=int)
+
+    # Include events still waiting in this process's buffer
+    audit.flush()
+
+    events, next_before = [], None
+    try:
+        start = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
+        # The end date is inclusive: everything before the following midnight
+        end = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1) if date_to else None
+        events, next_before = query_events(actor_id=actor or None, target_type=target_type or None,
+                                           target_id=target or None, action=action or None,
+                                           start=start, end=end, before=before)
+    except ValueError:
+        flash('Dates must be in YYYY-MM-DD format.')
+
+    return render_template('manage_audit.html',
+                           events=events,
+                           next_before=next_before,
+                           actor=actor,
+                           target_type=target_type,
+                           target=target,
+                           action=action,
+                           date_from=date_from,
+                           date_to=date_to,
+                           actions=AUDIT_ACTIONS)
+
+
+@manage.route('/question-times')
+@login_required
+@supervisor_required
+def question_times():
+    """Time participants spend on each question, from the last statistics rollup"""
+    rows = question_time_rows()
+    return render_template('manage_question_times.html',
+                           rows=rows,
+                           updated_at=max((stat.updated_at for stat, *_ in rows), default=None))
@@ -0,0 +1,234 @@
+"""
+Full-text search over written responses for the CBT Application
+
+- SQLite: an FTS5 table (responses_fts, porter-stemmed) keyed by
+  response_id, kept in step by index_response() when show_question saves
+  a written answer.
+- PostgreSQL: a GIN index on to_tsvector('english', response_text),
+  which PostgreSQL maintains itself as responses are written.
+
+Both are created alongside the responses table by db.create_all();
+existing databases run migrate_add_response_search.py. search_responses()
+ranks matches (bm25 / ts_rank), highlights them and applies the step,
+date and clinician filters, one page at a time, across every shard.
+"""
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import DDL, column, event, func, literal_column, table, text
+
+# Must match the expression the GIN index is built on, or it won't be used
+PG_VECTOR = "to_tsvector('english', coalesce(responses.response_text, ''))"
+
+SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS responses_fts USING fts5("
+    "response_text, tokenize = 'porter unicode61')"
+)
+PG_DDL = (
+    "CREATE INDEX IF NOT EXISTS ix_responses_search ON responses "
+    "USING GIN (to_tsvector('english', coalesce(response_text, '')))"
+)
+
+# Highlight markers; control characters can't appear in validated responses
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+# The FTS5 table isn't a model; this is enough to join and filter on it
+responses_fts = table('responses_fts', column('rowid'), column('response_text'))
+
+
+def register_search_ddl(responses_table):
+    """Create the search index whenever the responses table is created"""
+    event.listen(responses_table, 'after_create', DDL(SQLITE_DDL).execute_if(dialect='sqlite'))
+    event.listen(responses_table, 'after_create', DDL(PG_DDL).execute_if(dialect='postgresql'))
+
+
+def ensure_search_index(connection):
+    """Create the search index on an existing database; returns True if it was missing"""
+    if connection.dialect.name == 'postgresql':
+        exists = connection.execute(text("SELECT to_regclass('ix_responses_search')")).scalar()
+        connection.execute(text(PG_DDL))
+    else:
+        exists = connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE name = 'responses_fts'"
+        )).scalar()
+        connection.execute(text(SQLITE_DDL))
+    return exists is None
+
+
+def rebuild_search_index(connection):
+    """Refill the SQLite FTS table from responses (PostgreSQL needs nothing); returns row count"""
+    if connection.dialect.name == 'postgresql':
+        return None
+    connection.execute(text('DELETE FROM responses_fts'))
+    return connection.execute(text(
+        'INSERT INTO responses_fts (rowid, response_text) '
+        'SELECT response_id, response_text FROM responses WHERE response_text IS NOT NULL'
+    )).rowcount
+
+
+def copy_search_entries(connection, responses):
+    """Add (response_id, response_text) pairs to the search index on `connection` (PostgreSQL needs nothing)"""
+    if connection.dialect.name == 'postgresql':
+        return
+    rows = [{'id': response_id, 'text': response_text} for response_id, response_text in responses if response_text]
+    if rows:
+        connection.execute(text('INSERT INTO responses_fts (rowid, response_text) VALUES (:id, :text)'), rows)
+
+
+def remove_search_entries(connection, response_ids):
+    """Drop responses from the search index on `connection` (PostgreSQL needs nothing)"""
+    if connection.dialect.name == 'postgresql' or not response_ids:
+        return
+    connection.execute(text('DELETE FROM responses_fts WHERE rowid = :id'),
+                       [{'id': response_id} for response_id in response_ids])
+
+
+def index_response(response_id, response_text):
+    """Update one response's search entry, in the caller's transaction"""
+    from app import db
+    from app.sharding import shard_engine
+
+    # Textual SQL names no mapped table, so it is sent to the participant's shard explicitly
+    engine = shard_engine()
+    if engine.dialect.name != 'sqlite':
+        return
+
+    bind = {'bind': engine}
+    db.session.execute(text('DELETE FROM responses_fts WHERE rowid = :id'), {'id': response_id},
+                       bind_arguments=bind)
+    if response_text:
+        db.session.execute(text('INSERT INTO responses_fts (rowid, response_text) VALUES (:id, :text)'),
+                           {'id': response_id, 'text': response_text}, bind_arguments=bind)
+
+
+def _fts5_query(terms):
+    # Quote every term so user input can't inject FTS5 query syntax; terms are ANDed
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def highlight(snippet):
+    """Escape a snippet and turn the highlight markers into <mark> tags"""
+    html = str(escape(snippet or ''))
+    return Markup(html.replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>'))
+
+
+def search_responses(query, step=None, date_from=None, date_to=None, admin_id=None, page=1, per_page=20):
+    """
+    Ranked written responses matching every word of `query`, from every shard.
+
+    Filters: step number, response date range (datetimes, end exclusive)
+    and the participant's assigned clinician. Returns (rows, has_more);
+    each row has response_id, attempt_id, status, state_id, participant
+    names, step_number, timestamp and a highlighted snippet.
+
+    Each shard ranks its own matches (see app/sharding.py); the top
+    page * per_page of each are merged by score, so a shard's scores are
+    relative to its own responses.
+    """
+    from app.sharding import gather, gather_all
+
+    terms = _TERM.findall(query or '')
+    if not terms:
+        return [], False
+
+    limit = page * per_page + 1
+    rows = sorted(gather_all(_ranked_matches, terms, step, date_from, date_to, admin_id, limit),
+                  key=lambda row: (row['rank'], -row['response_id']))
+    rows = rows[(page - 1) * per_page:limit]
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    snippets = {}
+    for found in gather(_snippets, [row['response_id'] for row in rows], terms):
+        snippets.update(found)
+    return [_with_snippet(row, snippets.get(row['response_id'])) for row in rows], has_more
+
+
+def _ranked_matches(terms, step, date_from, date_to, admin_id, limit):
+    """The current shard's best `limit` matches as dicts; a lower rank is a better match"""
+    from app import db
+    from app.models import Assessment, AssessmentAttempt, Response, Step, User
+    from app.sharding import shard_engine
+
+    dialect = shard_engine().dialect.name
+    if dialect == 'postgresql':
+        q = ' '.join(terms)
+        match = text(f"{PG_VECTOR} @@ websearch_to_tsquery('english', :q)").bindparams(q=q)
+        rank = -func.ts_rank(literal_column(PG_VECTOR), func.websearch_to_tsquery('english', q))
+    else:
+        match = literal_column('responses_fts').op('MATCH')(_fts5_query(terms))
+        # bm25() is lower for better matches
+        rank = func.bm25(literal_column('responses_fts'))
+
+    results = db.session.query(
+        Response.response_id,
+        Response.attempt_id,
+        Response.timestamp,
+        AssessmentAttempt.status,
+        AssessmentAttempt.state_id,
+        User.first_name,
+        User.last_name,
+        Step.step_number,
+        rank.label('rank')
+    )
+    if dialect != 'postgresql':
+        results = results.select_from(responses_fts).join(
+            Response, Response.response_id == responses_fts.c.rowid
+        )
+    results = results.join(
+        AssessmentAttempt, AssessmentAttempt.attempt_id == Response.attempt_id
+    ).join(
+        User, User.state_id == AssessmentAttempt.state_id
+    ).join(
+        Assessment, Assessment.assessment_id == AssessmentAttempt.assessment_id
+    ).join(
+        Step, Step.step_id == Assessment.step_id
+    ).filter(match)
+
+    if step:
+        results = results.filter(Step.step_number == step)
+    if date_from:
+        results = results.filter(Response.timestamp >= date_from)
+    if date_to:
+        results = results.filter(Response.timestamp < date_to)
+    if admin_id:
+        results = results.filter(User.assigned_admin_id == admin_id)
+
+    return [row._asdict() for row in results.order_by(rank, Response.response_id.desc()).limit(limit)]
+
+
+def _snippets(response_ids, terms):
+    """{response_id: snippet} for the ids allocated by the current shard"""
+    # Only for the page being shown - highlighting is the expensive part
+    from flask import g
+    from app import db
+    from app.sharding import shard_engine, shard_for_id
+
+    ids = [response_id for response_id in response_ids if shard_for_id(response_id) == g.get('shard')]
+    if not ids:
+        return {}
+    params = {f'id{i}': response_id for i, response_id in enumerate(ids)}
+    placeholders = ', '.join(f':id{i}' for i in range(len(ids)))
+
+    engine = shard_engine()
+    if engine.dialect.name == 'postgresql':
+        sql = (
+            f"SELECT response_id, ts_headline('english', response_text, websearch_to_tsquery('english', :q), "
+            f"'StartSel=\x02, StopSel=\x03, MaxWords=30, MinWords=12') "
+            f"FROM responses WHERE response_id IN ({placeholders})"
+        )
+        params['q'] = ' '.join(terms)
+    else:
+        sql = (
+            f"SELECT rowid, snippet(responses_fts, 0, '\x02', '\x03', '…', 24) FROM responses_fts "
+            f"WHERE responses_fts MATCH :q AND rowid IN ({placeholders})"
+        )
+        params['q'] = _fts5_query(terms)
+
+    return dict(db.session.execute(text(sql), params, bind_arguments={'bind': engine}).all())
+
+
+def _with_snippet(row, snippet):
+    return {**{key: value for key, value in row.items() if key != 'rank'}, 'snippet': highlight(snippet)}
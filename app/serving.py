@@ -0,0 +1,100 @@
+"""
+Serving modes for the CBT Application
+
+- sync (the Procfile default): gunicorn workers × threads. Each slow
+  request holds a thread until it finishes.
+- gevent / eventlet: `gunicorn --worker-class gevent`. Each request is a
+  greenlet, and while it waits on the database, a hash or a held-open SSE
+  stream, the worker serves the others.
+
+Green workers monkey-patch the standard library before the app is
+imported. init_serving() detects that and makes the rest safe under it:
+
+- psycopg2 is made cooperative with psycogreen; otherwise every query
+  blocks the whole worker.
+- The connection pool is bounded, with a checkout timeout, so a burst
+  of greenlets queues for connections instead of exhausting PostgreSQL
+  (or, on SQLite, failing behind the default pool's 30 second timeout).
+- Review queue SSE streams are held open (ASYNC_SSE_HOLD_SECONDS),
+  which is cheap when a stream costs a greenlet rather than a thread.
+
+run_blocking() moves CPU-heavy calls (password hashing) to a real OS
+thread so they don't stall the other greenlets. check_password() also
+gives the request's connection back to the pool while it hashes.
+"""
+import sys
+
+
+def green_mode():
+    """'gevent' or 'eventlet' when the process runs under green threads, else None"""
+    if 'gevent.monkey' in sys.modules:
+        from gevent import monkey
+        if monkey.is_module_patched('socket'):
+            return 'gevent'
+    if 'eventlet.patcher' in sys.modules:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('socket'):
+            return 'eventlet'
+    return None
+
+
+def init_serving(app):
+    """Adapt the database driver, pool and SSE streams to the serving mode; before db.init_app()"""
+    mode = green_mode()
+    app.config['SERVING_MODE'] = mode or 'sync'
+    if mode is None:
+        return
+
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if uri.startswith('postgres'):
+        if mode == 'gevent':
+            from psycogreen.gevent import patch_psycopg
+        else:
+            from psycogreen.eventlet import patch_psycopg
+        patch_psycopg()
+
+    # Every backend: SQLite files get the same bounded queue of greenlets.
+    # In-memory SQLite keeps its single static connection
+    if ':memory:' not in uri and uri not in ('sqlite://', 'sqlite:///'):
+        options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        options.setdefault('pool_size', app.config['ASYNC_DB_POOL_SIZE'])
+        options.setdefault('max_overflow', app.config['ASYNC_DB_MAX_OVERFLOW'])
+        options.setdefault('pool_timeout', app.config['ASYNC_DB_POOL_TIMEOUT'])
+        options.setdefault('pool_pre_ping', True)
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    if not app.config['SSE_HOLD_SECONDS']:
+        app.config['SSE_HOLD_SECONDS'] = app.config['ASYNC_SSE_HOLD_SECONDS']
+
+
+def run_blocking(fn, *args):
+    """
+    Call fn(*args), on an OS thread under green workers.
+
+    hashlib's PBKDF2 releases the GIL, so a login burst hashes in the
+    hub's thread pool while the worker keeps serving other requests.
+    """
+    mode = green_mode()
+    if mode == 'gevent':
+        from gevent import get_hub
+        return get_hub().threadpool.apply(fn, args)
+    if mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(fn, *args)
+    return fn(*args)
+
+
+def check_password(password_hash, password):
+    """
+    check_password_hash() via run_blocking(), outside any transaction.
+
+    The lookup that loaded the hash leaves its connection checked out until
+    the request ends. Ending that read first returns it to the pool for the
+    length of the hash; otherwise a burst of logins holds every pooled
+    connection while it hashes and the rest of the worker queues behind it.
+    """
+    from werkzeug.security import check_password_hash
+    from app import db
+
+    db.session.rollback()
+    return run_blocking(check_password_hash, password_hash, password)
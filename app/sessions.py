@@ -0,0 +1,269 @@
+"""
+Server-side session store for the CBT Application
+
+The session cookie carries only a random opaque id. Session data is
+stored as compact tagged JSON, and is only written back when it actually
+changed. It lives in either:
+
+- 'sqlite': a local SQLite file shared by all gunicorn workers on one
+  instance (the development default), or
+- 'database': the server_sessions table of the application database,
+  shared by every instance (the production default).
+
+Expired sessions are swept periodically and by `flask sessions sweep`.
+"""
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import types
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+
+from app.profiling import SessionTimingMixin, TimedSessionInterface
+
+# 32 random bytes, URL-safe base64 encoded
+SESSION_ID_LENGTH = 43
+
+
+class ServerSideSession(SecureCookieSession):
+    """Session dict that remembers its id and the data it was loaded with"""
+
+    def __init__(self, initial=None, sid=None, new=False, stored=None, expires=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.new = new
+        self.stored = stored
+        self.expires = expires
+        self.loaded_user_id = self.get('_user_id')
+        self.accessed = False
+
+
+class SQLiteSessionStore:
+    """Session rows in a SQLite file; one connection per thread and process (per process if shared)"""
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        # Under green workers threading.local is per greenlet, i.e. a new
+        # connection per request; sqlite3 calls never yield, so one will do
+        self._local = types.SimpleNamespace(conn=None, pid=None) if shared else threading.local()
+
+    def _connection(self):
+        # Connections must not cross a fork (gunicorn --preload), so key by pid
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, sid):
+        """Return (data, expires) for a live session, or None"""
+        row = self._connection().execute(
+            'SELECT data, expires FROM sessions WHERE sid = ?', (sid,)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row
+
+    def set(self, sid, data, expires):
+        self._connection().execute(
+            'INSERT INTO sessions (sid, data, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT(sid) DO UPDATE SET data = excluded.data, expires = excluded.expires',
+            (sid, data, expires)
+        )
+
+    def touch(self, sid, expires):
+        self._connection().execute('UPDATE sessions SET expires = ? WHERE sid = ?', (expires, sid))
+
+    def delete(self, sid):
+        self._connection().execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def sweep(self):
+        """Delete expired sessions; returns how many were removed"""
+        return self._connection().execute('DELETE FROM sessions WHERE expires < ?', (time.time(),)).rowcount
+
+
+class DatabaseSessionStore:
+    """
+    Session rows in the application database's server_sessions table.
+
+    Each call runs on its own connection and commits straight away, outside
+    the request's transaction, so a rolled back request keeps its login.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._table_checked = False
+
+    def _begin(self):
+        from app import db
+        from app.models import ServerSession
+
+        # Created on first use, like the SQLite store, so switching backends needs no migration
+        if not self._table_checked:
+            ServerSession.__table__.create(db.engine, checkfirst=True)
+            self._table_checked = True
+        return db.engine.begin()
+
+    def _table(self):
+        from app.models import ServerSession
+        return ServerSession.__table__
+
+    def get(self, sid):
+        """Return (data, expires) for a live session, or None"""
+        table = self._table()
+        with self._begin() as conn:
+            row = conn.execute(
+                table.select().with_only_columns(table.c.data, table.c.expires).where(table.c.sid == sid)
+            ).first()
+        if row is None or row.expires < time.time():
+            return None
+        return row.data, row.expires
+
+    def set(self, sid, data, expires):
+        table = self._table()
+        with self._begin() as conn:
+            # Ids are random and belong to one browser, so update-then-insert can't race
+            updated = conn.execute(
+                table.update().where(table.c.sid == sid).values(data=data, expires=expires)
+            ).rowcount
+            if not updated:
+                conn.execute(table.insert().values(sid=sid, data=data, expires=expires))
+
+    def touch(self, sid, expires):
+        table = self._table()
+        with self._begin() as conn:
+            conn.execute(table.update().where(table.c.sid == sid).values(expires=expires))
+
+    def delete(self, sid):
+        table = self._table()
+        with self._begin() as conn:
+            conn.execute(table.delete().where(table.c.sid == sid))
+
+    def sweep(self):
+        """Delete expired sessions; returns how many were removed"""
+        table = self._table()
+        with self._begin() as conn:
+            return conn.execute(table.delete().where(table.c.expires < time.time())).rowcount
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Flask session interface backed by SQLiteSessionStore or DatabaseSessionStore.
+
+    Sessions expire after PERMANENT_SESSION_LIFETIME of inactivity; the
+    expiry is only pushed forward once half of it has been used, so most
+    requests don't write at all. The session id is rotated whenever the
+    logged-in user changes, to prevent session fixation.
+    """
+
+    serializer = TaggedJSONSerializer()
+    session_class = ServerSideSession
+
+    def __init__(self, store, sweep_interval=3600):
+        self.store = store
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.time() + sweep_interval
+
+    def _new_session(self):
+        return self.session_class(sid=secrets.token_urlsafe(32), new=True)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid or len(sid) != SESSION_ID_LENGTH:
+            return self._new_session()
+
+        row = self.store.get(sid)
+        if row is None:
+            return self._new_session()
+
+        data, expires = row
+        return self.session_class(self.serializer.loads(data), sid=sid, stored=data, expires=expires)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            # Emptied (e.g. logout) - remove the stored row and the cookie
+            if not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        data = self.serializer.dumps(dict(session))
+
+        # New login or logout on an existing session - issue a fresh id
+        if not session.new and session.get('_user_id') != session.loaded_user_id:
+            self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+            session.new = True
+            session.stored = None
+
+        refreshed = True
+        if data != session.stored:
+            self.store.set(session.sid, data, now + lifetime)
+        elif session.expires - now < lifetime / 2:
+            self.store.touch(session.sid, now + lifetime)
+        else:
+            refreshed = False
+
+        if session.new or (session.permanent and refreshed):
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+                partitioned=self.get_cookie_partitioned(app)
+            )
+
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            self.store.sweep()
+
+
+class TimedServerSideSessionInterface(SessionTimingMixin, ServerSideSessionInterface):
+    """Server-side sessions with load/save time reported in Server-Timing"""
+
+
+def init_sessions(app):
+    """Install the session backend selected by SESSION_BACKEND"""
+    backend = app.config['SESSION_BACKEND']
+    if backend == 'cookie':
+        app.session_interface = TimedSessionInterface()
+        return
+
+    if backend == 'sqlite':
+        store = SQLiteSessionStore(app.config['SESSION_DB_PATH'],
+                                   shared=app.config['SERVING_MODE'] != 'sync')
+    elif backend == 'database':
+        store = DatabaseSessionStore(app)
+    else:
+        raise ValueError(f"Unknown SESSION_BACKEND '{backend}'; expected 'database', 'sqlite' or 'cookie'")
+    app.session_interface = TimedServerSideSessionInterface(
+        store, sweep_interval=app.config['SESSION_SWEEP_INTERVAL']
+    )
@@ -0,0 +1,438 @@
+"""
+Participant data sharded by state code for the CBT Application
+
+State IDs start with a two-letter state code (see validate_state_id). The
+SHARDS setting maps state codes to separate databases:
+
+    SHARDS='{"west": {"number": 1, "url": "postgresql://.../west", "states": ["CA", "NV"]}}'
+
+- users, assessment_attempts, responses and the per-response indexes
+  live in the participant's shard. States that aren't listed stay in the
+  main database (shard 0).
+- Admins and the curriculum stay in the main database. A read-only copy
+  is kept in every shard so joins within a shard still work. It is
+  refreshed whenever those tables change. The admins copy holds ids,
+  names and roles only; emails and password hashes are replaced by
+  placeholders (REDACTED_COLUMNS).
+- Each request works against one shard, chosen from the participant
+  (login, user_loader) or from a state_id / attempt_id in the URL.
+  ShardRoutingSession sends statements touching participant tables to
+  that shard and everything else to the main database. Textual SQL names
+  no tables, so it goes to the main database unless the caller binds it
+  to shard_engine().
+- Attempt and response ids are allocated in a separate range per shard
+  (number * SHARD_ID_SPAN upwards), so an id alone identifies its shard.
+- gather() runs a query on every shard in parallel for list views,
+  response search and near-duplicate matching.
+
+- move_participant() (`flask shards migrate`) moves a participant stored
+  outside their state's shard, e.g. after a state is added to SHARDS.
+
+With SHARDS unset (the default) nothing changes: one database, no routing.
+SQLite files work as shards for local testing.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.util import find_tables
+
+# Tables whose rows live in the participant's shard
+SHARDED_TABLES = frozenset({
+    'users', 'assessment_attempts', 'responses', 'response_revisions', 'response_signatures', 'response_bands',
+    'review_queue_events'
+})
+
+# Shared tables copied into every shard so joins within a shard work
+REPLICATED_TABLES = ('admins', 'steps', 'assessments', 'questions', 'multiple_choice_options')
+
+# Columns the shards' copies never receive, and the placeholder stored instead.
+# Joins in a shard only show an admin's name; credentials and contact
+# details stay in the main database
+REDACTED_COLUMNS = {
+    'admins': {
+        'email': lambda row: f'{row["admin_id"]}@shard.invalid',
+        'password_hash': lambda row: '!'  # Never matches a werkzeug hash
+    }
+}
+
+# Per-shard id ranges; shard 3 allocates attempt and response ids from 300,000,000
+SHARD_ID_SPAN = 100_000_000
+_SEQUENCED_COLUMNS = (('assessment_attempts', 'attempt_id'), ('responses', 'response_id'))
+
+
+def parse_shards(value):
+    """SHARDS setting (a JSON string or dict) as {name: {'number', 'url', 'states'}}"""
+    shards = json.loads(value) if isinstance(value, str) else dict(value or {})
+    numbers = set()
+    for name, shard in shards.items():
+        number = shard.get('number')
+        if not isinstance(number, int) or number < 1 or number in numbers:
+            raise ValueError(f'Shard {name!r} needs a unique "number" of 1 or more')
+        if not shard.get('url') or not shard.get('states'):
+            raise ValueError(f'Shard {name!r} needs a "url" and a list of "states"')
+        numbers.add(number)
+        shard['states'] = [state.upper() for state in shard['states']]
+    return shards
+
+
+class ShardMap:
+    """State code -> bind key and shard number -> bind key lookups"""
+
+    def __init__(self, shards):
+        self.keys = [None]  # None is the main database
+        self.by_state = {}
+        self.by_number = {0: None}
+        for name, shard in sorted(shards.items(), key=lambda item: item[1]['number']):
+            key = f'shard_{name}'
+            self.keys.append(key)
+            self.by_number[shard['number']] = key
+            for state in shard['states']:
+                self.by_state[state] = key
+        self.numbers = {key: number for number, key in self.by_number.items()}
+
+
+class ShardRoutingSession(Session):
+    """Sends statements that touch participant tables to the request's shard"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            shard = g.get('shard')
+            if shard is not None and _touches_sharded_table(mapper, clause):
+                return self._db.engines[shard]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _touches_sharded_table(mapper, clause):
+    if clause is not None:
+        # Textual SQL names no tables and goes to the main database; statements
+        # for a shard (e.g. the search index) pass bind=shard_engine() instead
+        tables = find_tables(clause, include_crud=True, include_joins=True)
+        return any(table.name in SHARDED_TABLES for table in tables)
+    if mapper is not None:
+        return inspect(mapper).local_table.name in SHARDED_TABLES
+    return False
+
+
+def init_sharding(app):
+    """Add a bind per shard; must run before db.init_app() creates the engines"""
+    shards = parse_shards(app.config.get('SHARDS'))
+    if not shards:
+        return
+
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for name, shard in shards.items():
+        binds[f'shard_{name}'] = shard['url']
+    app.config['SQLALCHEMY_BINDS'] = binds
+    app.extensions['shards'] = ShardMap(shards)
+
+    app.url_value_preprocessor(_route_request)
+
+    # Refresh the shards' copies of shared tables after commits that change them
+    if not event.contains(ShardRoutingSession, 'after_commit', _replicate_changes):
+        event.listen(ShardRoutingSession, 'before_flush', _note_shared_changes)
+        event.listen(ShardRoutingSession, 'after_commit', _replicate_changes)
+        event.listen(ShardRoutingSession, 'after_soft_rollback', _forget_shared_changes)
+
+
+def _note_shared_changes(session, flush_context, instances):
+    changed = session.info.setdefault('replicate', set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        table = inspect(obj).mapper.local_table.name
+        if table in REPLICATED_TABLES:
+            changed.add(table)
+
+
+def _forget_shared_changes(session, previous_transaction):
+    session.info.pop('replicate', None)
+
+
+def _replicate_changes(session):
+    changed = session.info.pop('replicate', None)
+    if changed and has_app_context() and 'shards' in current_app.extensions:
+        # The change itself is committed; a stale copy is fixed by `flask shards sync`
+        try:
+            sync_shared_tables(tables=changed)
+        except SQLAlchemyError as e:
+            current_app.logger.error(f'Shard replication failed: tables={sorted(changed)}, error={str(e)}')
+
+
+def shard_map():
+    return current_app.extensions.get('shards')
+
+
+def is_sharded():
+    """True when SHARDS is configured"""
+    return has_app_context() and 'shards' in current_app.extensions
+
+
+def shard_keys():
+    """Bind keys of every shard, None (the main database) first"""
+    shards = shard_map()
+    return list(shards.keys) if shards else [None]
+
+
+def shard_for_state_id(state_id):
+    """Bind key of the shard holding a participant (None for the main database)"""
+    shards = shard_map()
+    if not shards or not state_id:
+        return None
+    return shards.by_state.get(state_id[:2].upper())
+
+
+def shard_for_id(record_id):
+    """Bind key of the shard that allocated an attempt or response id"""
+    shards = shard_map()
+    if not shards or not record_id:
+        return None
+    return shards.by_number.get(int(record_id) // SHARD_ID_SPAN)
+
+
+def current_shard_number():
+    """Number of the shard this app context is routed to (0 for the main database)"""
+    shards = shard_map()
+    return shards.numbers.get(g.get('shard'), 0) if shards else 0
+
+
+def shard_engine():
+    """Engine of the shard this app context is routed to, for SQL the session can't route"""
+    from app import db
+
+    return db.engines[g.get('shard')]
+
+
+def use_shard(key):
+    """Route this app context's participant queries to shard `key` (None: main database)"""
+    g.shard = key
+
+
+def _route_request(endpoint, values):
+    # Admin pages about one participant or attempt carry it in the URL
+    if not values:
+        return
+    if values.get('state_id'):
+        use_shard(shard_for_state_id(values['state_id']))
+    elif values.get('attempt_id'):
+        use_shard(shard_for_id(values['attempt_id']))
+
+
+def _on_shard(app, key, fn, args, kwargs):
+    from app import db
+
+    with app.app_context():
+        use_shard(key)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            db.session.remove()
+
+
+def gather(fn, *args, **kwargs):
+    """
+    Call fn(*args, **kwargs) once per shard, in parallel, and return the results.
+
+    Each call runs in its own app context and session, routed to one shard.
+    Results come back in shard order. ORM objects are detached, so load
+    anything the caller needs eagerly. Without shards this is just [fn()].
+    """
+    keys = shard_keys()
+    if len(keys) == 1:
+        return [fn(*args, **kwargs)]
+
+    app = current_app._get_current_object()
+    executor = app.extensions.get('shard_executor')
+    if executor is None:
+        executor = app.extensions['shard_executor'] = ThreadPoolExecutor(
+            max_workers=len(keys) * 2, thread_name_prefix='shard')
+
+    futures = [executor.submit(_on_shard, app, key, fn, args, kwargs) for key in keys]
+    return [future.result() for future in futures]
+
+
+def gather_all(fn, *args, **kwargs):
+    """gather() with the per-shard lists concatenated"""
+    return [row for rows in gather(fn, *args, **kwargs) for row in rows]
+
+
+def sync_shared_tables(tables=None):
+    """Upsert the main database's shared tables into every shard; returns rows copied per shard"""
+    from sqlalchemy.dialects import postgresql, sqlite
+    from app import db
+
+    copied = {}
+    metadata_tables = db.metadata.tables
+    names = [name for name in REPLICATED_TABLES if tables is None or name in tables]
+
+    with db.engines[None].connect() as source:
+        data = {name: [_redacted(name, dict(row._mapping)) for row in source.execute(metadata_tables[name].select())]
+                for name in names}
+
+    for key in shard_keys()[1:]:
+        engine = db.engines[key]
+        dialect_insert = postgresql.insert if engine.dialect.name == 'postgresql' else sqlite.insert
+        with engine.begin() as connection:
+            for name in names:  # Parents before children, for foreign keys
+                table = metadata_tables[name]
+                if not data[name]:
+                    continue
+                statement = dialect_insert(table)
+                primary_key = [column.name for column in table.primary_key]
+                statement = statement.on_conflict_do_update(
+                    index_elements=primary_key,
+                    set_={column.name: statement.excluded[column.name]
+                          for column in table.columns if column.name not in primary_key}
+                )
+                connection.execute(statement, data[name])
+        copied[key] = sum(len(rows) for rows in data.values())
+    return copied
+
+
+def _redacted(table, row):
+    for column, placeholder in REDACTED_COLUMNS.get(table, {}).items():
+        row[column] = placeholder(row)
+    return row
+
+
+def init_shard(key):
+    """Create a shard's tables, start its id ranges and copy the shared tables into it"""
+    from app import db
+
+    engine = db.engines[key]
+    db.metadata.create_all(engine)
+
+    base = shard_map().numbers[key] * SHARD_ID_SPAN
+    with engine.begin() as connection:
+        for table, column in _SEQUENCED_COLUMNS:
+            if connection.execute(text(f'SELECT MAX({column}) FROM {table}')).scalar() is not None:
+                continue
+            if engine.dialect.name == 'postgresql':
+                connection.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), :base)"),
+                                   {'base': base})
+            else:
+                # AUTOINCREMENT tables continue from sqlite_sequence
+                connection.execute(text('DELETE FROM sqlite_sequence WHERE name = :table'), {'table': table})
+                connection.execute(text('INSERT INTO sqlite_sequence (name, seq) VALUES (:table, :base)'),
+                                   {'table': table, 'base': base})
+
+    return sync_shared_tables().get(key, 0)
+
+
+def _participant_rows(connection, state_id):
+    """A participant's rows in every sharded table, read through `connection`"""
+    from app import db
+
+    tables = db.metadata.tables
+    users, attempts, responses = tables['users'], tables['assessment_attempts'], tables['responses']
+
+    rows = {'users': connection.execute(users.select().where(users.c.state_id == state_id)).mappings().all()}
+    rows['assessment_attempts'] = connection.execute(
+        attempts.select().where(attempts.c.state_id == state_id).order_by(attempts.c.attempt_id)
+    ).mappings().all()
+    attempt_ids = [row['attempt_id'] for row in rows['assessment_attempts']]
+    rows['responses'] = connection.execute(
+        responses.select().where(responses.c.attempt_id.in_(attempt_ids)).order_by(responses.c.response_id)
+    ).mappings().all()
+    response_ids = [row['response_id'] for row in rows['responses']]
+    for name in ('response_revisions', 'response_signatures', 'response_bands'):
+        table = tables[name]
+        rows[name] = connection.execute(table.select().where(table.c.response_id.in_(response_ids))).mappings().all()
+    return rows
+
+
+def _delete_participant(connection, state_id):
+    """Delete a participant and everything hanging off them, children first"""
+    from app import db
+    from app.search import remove_search_entries
+
+    tables = db.metadata.tables
+    attempts, responses = tables['assessment_attempts'], tables['responses']
+    attempt_ids = [row.attempt_id for row in connection.execute(
+        attempts.select().with_only_columns(attempts.c.attempt_id).where(attempts.c.state_id == state_id))]
+    response_ids = [row.response_id for row in connection.execute(
+        responses.select().with_only_columns(responses.c.response_id).where(responses.c.attempt_id.in_(attempt_ids)))]
+
+    for name in ('response_bands', 'response_signatures', 'response_revisions'):
+        connection.execute(tables[name].delete().where(tables[name].c.response_id.in_(response_ids)))
+    remove_search_entries(connection, response_ids)
+    connection.execute(responses.delete().where(responses.c.response_id.in_(response_ids)))
+    events = tables['review_queue_events']
+    connection.execute(events.delete().where(events.c.attempt_id.in_(attempt_ids)))
+    connection.execute(attempts.delete().where(attempts.c.attempt_id.in_(attempt_ids)))
+    connection.execute(tables['users'].delete().where(tables['users'].c.state_id == state_id))
+
+
+def move_participant(state_id, source, target):
+    """
+    Move a participant's rows from shard `source` to shard `target`.
+
+    Attempts and responses get new ids from the target's range, so an id
+    still names its shard; returns {old attempt id: new attempt id}. The
+    copy commits before the original is deleted, and any copy left by an
+    earlier failed move is replaced, so a failed move can simply be run
+    again. Review feed rows are not copied (dashboards rebuild their list
+    from the attempts), and question timing events keep the old attempt
+    ids, which are only used to tell visits apart.
+    """
+    from app import db
+    from app.search import copy_search_entries
+
+    tables = db.metadata.tables
+    with db.engines[source].connect() as connection:
+        rows = _participant_rows(connection, state_id)
+    if not rows['users']:
+        return {}
+
+    attempt_ids, response_ids = {}, {}
+    with db.engines[target].begin() as connection:
+        _delete_participant(connection, state_id)
+        connection.execute(tables['users'].insert(), [dict(row) for row in rows['users']])
+
+        for row in rows['assessment_attempts']:
+            values = {key: value for key, value in row.items() if key != 'attempt_id'}
+            result = connection.execute(tables['assessment_attempts'].insert().values(values))
+            attempt_ids[row['attempt_id']] = result.inserted_primary_key[0]
+
+        for row in rows['responses']:
+            values = {key: value for key, value in row.items() if key != 'response_id'}
+            values['attempt_id'] = attempt_ids[row['attempt_id']]
+            result = connection.execute(tables['responses'].insert().values(values))
+            response_ids[row['response_id']] = result.inserted_primary_key[0]
+
+        for name in ('response_revisions', 'response_signatures', 'response_bands'):
+            if rows[name]:
+                connection.execute(tables[name].insert(), [
+                    {**row, 'response_id': response_ids[row['response_id']]} for row in rows[name]
+                ])
+        copy_search_entries(connection, [(response_ids[row['response_id']], row['response_text'])
+                                         for row in rows['responses']])
+
+    with db.engines[source].begin() as connection:
+        _delete_participant(connection, state_id)
+    return attempt_ids
+
+
+def misplaced_participants():
+    """(state_id, stored in, belongs in) for participants whose state maps to a different shard"""
+    from app import db
+
+    users = db.metadata.tables['users']
+    misplaced = []
+    for key in shard_keys():
+        with db.engines[key].connect() as connection:
+            for row in connection.execute(users.select().with_only_columns(users.c.state_id).order_by(users.c.state_id)):
+                target = shard_for_state_id(row.state_id)
+                if target != key:
+                    misplaced.append((row.state_id, key, target))
+    return misplaced
+
+
+def shard_counts():
+    """Participants per shard, counted in parallel: [(bind key, count)]"""
+    from app import db
+    from app.models import User
+
+    counts = gather(lambda: db.session.query(User.state_id).count())
+    return list(zip(shard_keys(), counts))
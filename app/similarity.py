@@ -0,0 +1,287 @@
+"""
+Near-duplicate detection for written responses in the CBT Application
+
+Each written response is reduced to a MinHash signature over its
+three-word shingles. The signature is split into BANDS bands of ROWS
+values, and each band is hashed to a bucket (locality-sensitive hashing).
+Two responses that share any bucket are candidates, and their signatures
+estimate how similar their texts are (Jaccard similarity of the shingles).
+Finding the matches for a response is an indexed lookup on
+response_bands rather than a comparison against every other response.
+
+- index_attempt() runs in the index_attempt job queued when an attempt is
+  submitted (app/tasks.py), not in the request.
+- similar_responses() flags matches for review_attempt, looking in every
+  shard (see app/sharding.py).
+- index_all() (`flask similarity index`) indexes the full history in
+  fixed-size batches.
+"""
+import hashlib
+import random
+import re
+import struct
+from datetime import datetime, timezone
+
+from flask import current_app
+
+NUM_PERM = 64
+BANDS, ROWS = 16, 4  # Pairs above ~50% similarity share a band with high probability
+
+SHINGLE_WORDS = 3
+# Shorter answers ("yes", "I don't know") match each other without any copying
+MIN_WORDS = 10
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Fixed seed: signatures must stay comparable across processes and deploys
+_rng = random.Random(1729)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+                 for _ in range(NUM_PERM)]
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+_PACKING = struct.Struct(f'<{NUM_PERM}I')
+
+
+def _hash(value, size=8):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=size).digest(), 'big')
+
+
+def shingles(response_text):
+    """Set of word shingles of a response, or an empty set if it is too short to compare"""
+    words = _WORD.findall((response_text or '').lower())
+    if len(words) < MIN_WORDS:
+        return set()
+    return {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def signature(response_text):
+    """MinHash signature of a response (a tuple of NUM_PERM ints), or None if too short"""
+    hashes = [_hash(shingle) for shingle in shingles(response_text)]
+    if not hashes:
+        return None
+    return tuple(
+        min((a * h + b) % _MERSENNE_PRIME for h in hashes) & _MAX_HASH
+        for a, b in _PERMUTATIONS
+    )
+
+
+def estimate_similarity(first, second):
+    """Estimated Jaccard similarity of two signatures (fraction of equal minimums)"""
+    return sum(1 for x, y in zip(first, second) if x == y) / NUM_PERM
+
+
+def band_buckets(sig):
+    """(band, bucket) pairs for a signature; buckets are signed 64-bit ints"""
+    buckets = []
+    for band in range(BANDS):
+        values = sig[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(struct.pack(f'<{ROWS}I', *values), digest_size=8).digest()
+        buckets.append((band, int.from_bytes(digest, 'big', signed=True)))
+    return buckets
+
+
+def index_responses(responses):
+    """
+    (Re)index (response_id, response_text) pairs in the current transaction.
+
+    Old signatures and buckets for these responses are replaced; responses
+    too short to compare are simply left out. Returns how many were indexed.
+    """
+    from sqlalchemy import insert
+    from app import db
+    from app.models import ResponseBand, ResponseSignature
+
+    responses = list(responses)
+    if not responses:
+        return 0
+
+    response_ids = [response_id for response_id, _ in responses]
+    ResponseBand.query.filter(ResponseBand.response_id.in_(response_ids)).delete(synchronize_session=False)
+    ResponseSignature.query.filter(ResponseSignature.response_id.in_(response_ids)).delete(synchronize_session=False)
+
+    now = datetime.now(timezone.utc)
+    signatures, bands = [], []
+    for response_id, response_text in responses:
+        sig = signature(response_text)
+        if sig is None:
+            continue
+        signatures.append({'response_id': response_id, 'signature': _PACKING.pack(*sig), 'indexed_at': now})
+        bands.extend({'band': band, 'bucket': bucket, 'response_id': response_id}
+                     for band, bucket in band_buckets(sig))
+
+    if signatures:
+        db.session.execute(insert(ResponseSignature), signatures)
+        db.session.execute(insert(ResponseBand), bands)
+    return len(signatures)
+
+
+def index_attempt(attempt_id):
+    """Index an attempt's written responses; the caller commits (see the index_attempt job)"""
+    from app import db
+    from app.models import Response
+
+    responses = db.session.query(Response.response_id, Response.response_text).filter(
+        Response.attempt_id == attempt_id,
+        Response.response_text.isnot(None)
+    ).all()
+    return index_responses((row.response_id, row.response_text) for row in responses)
+
+
+def index_all(batch_size=500, log=print):
+    """
+    Index every written response, batch_size at a time.
+
+    Walks responses in response_id order and commits after each batch, so
+    time grows linearly with the number of responses and memory stays at
+    one batch. Re-running re-indexes everything.
+    """
+    from app import db
+    from app.models import Response
+
+    last_id, indexed, seen = 0, 0, 0
+    while True:
+        batch = db.session.query(Response.response_id, Response.response_text).filter(
+            Response.response_id > last_id,
+            Response.response_text.isnot(None)
+        ).order_by(Response.response_id).limit(batch_size).all()
+        if not batch:
+            break
+
+        indexed += index_responses((row.response_id, row.response_text) for row in batch)
+        db.session.commit()
+        db.session.expunge_all()
+
+        seen += len(batch)
+        last_id = batch[-1].response_id
+        log(f'Indexed {indexed} of {seen} written responses')
+
+    return indexed
+
+
+def similar_responses(attempt_id, threshold=None):
+    """
+    Near-duplicates of an attempt's written responses, looked up in every shard.
+
+    Returns {response_id: [match, ...]}, best match first. A match is
+    another participant's response, or this participant's answer from an
+    earlier step, whose estimated similarity is at least `threshold`
+    (SIMILARITY_THRESHOLD by default). Matches carry response_id,
+    attempt_id, state_id, first_name, last_name, step_number, status and
+    similarity.
+    """
+    from app import db
+    from app.models import Assessment, AssessmentAttempt, Response, ResponseBand, ResponseSignature, Step
+    from app.sharding import gather_all
+
+    threshold = current_app.config['SIMILARITY_THRESHOLD'] if threshold is None else threshold
+
+    attempt = db.session.query(AssessmentAttempt.state_id, Step.step_number).join(
+        Assessment, Assessment.assessment_id == AssessmentAttempt.assessment_id
+    ).join(
+        Step, Step.step_id == Assessment.step_id
+    ).filter(AssessmentAttempt.attempt_id == attempt_id).first()
+    if attempt is None:
+        return {}
+
+    # The attempt's own signatures and buckets, from its shard
+    own_ids = db.session.query(Response.response_id).filter(Response.attempt_id == attempt_id)
+    own = {
+        row.response_id: row.signature
+        for row in db.session.query(ResponseSignature).filter(ResponseSignature.response_id.in_(own_ids))
+    }
+    buckets = db.session.query(ResponseBand.band, ResponseBand.bucket, ResponseBand.response_id).filter(
+        ResponseBand.response_id.in_(list(own))
+    ).all()
+    if not buckets:
+        return {}
+
+    matches = {}
+    for match in gather_all(_shard_matches, [tuple(row) for row in buckets], own, threshold):
+        # Earlier attempts at the same step are the participant's own drafts
+        if match['state_id'] == attempt.state_id and match['step_number'] >= attempt.step_number:
+            continue
+        matches.setdefault(match.pop('own_id'), []).append(match)
+
+    for found in matches.values():
+        found.sort(key=lambda match: match['similarity'], reverse=True)
+    return matches
+
+
+def _candidate_query(buckets, exclude_ids):
+    """
+    Rows of response_bands in any of `buckets` ((band, bucket) pairs),
+    other than `exclude_ids`'. Each pair is its own equality test, so
+    every one is a lookup on the (band, bucket, response_id) primary key;
+    a filter on bucket alone, or a row-value IN, scans the table.
+    """
+    from sqlalchemy import and_, or_
+    from app import db
+    from app.models import ResponseBand
+
+    return db.session.query(ResponseBand).filter(
+        or_(*(and_(ResponseBand.band == band, ResponseBand.bucket == bucket) for band, bucket in buckets)),
+        ResponseBand.response_id.notin_(list(exclude_ids))
+    )
+
+
+def _shard_matches(buckets, own, threshold):
+    """
+    Responses in the current shard sharing a bucket with one of `own`
+    ({response_id: packed signature}) and at least `threshold` similar to it
+    """
+    from app import db
+    from app.models import Assessment, AssessmentAttempt, Response, ResponseSignature, Step, User
+
+    # Candidate pairs: any shared bucket in any band
+    owners = {}
+    for band, bucket, response_id in buckets:
+        owners.setdefault((band, bucket), set()).add(response_id)
+    pairs = {
+        (own_id, row.response_id)
+        for row in _candidate_query(owners, own)
+        for own_id in owners.get((row.band, row.bucket), ())
+    }
+    if not pairs:
+        return []
+
+    signatures = {
+        row.response_id: _PACKING.unpack(row.signature)
+        for row in db.session.query(ResponseSignature).filter(
+            ResponseSignature.response_id.in_({other_id for _, other_id in pairs})
+        )
+    }
+    scored = [
+        (own_id, other_id, estimate_similarity(_PACKING.unpack(own[own_id]), signatures[other_id]))
+        for own_id, other_id in pairs
+        if other_id in signatures
+    ]
+    scored = [pair for pair in scored if pair[2] >= threshold]
+    if not scored:
+        return []
+
+    context = {
+        row.response_id: row for row in db.session.query(
+            Response.response_id,
+            Response.attempt_id,
+            AssessmentAttempt.state_id,
+            AssessmentAttempt.status,
+            User.first_name,
+            User.last_name,
+            Step.step_number
+        ).join(
+            AssessmentAttempt, AssessmentAttempt.attempt_id == Response.attempt_id
+        ).join(
+            User, User.state_id == AssessmentAttempt.state_id
+        ).join(
+            Assessment, Assessment.assessment_id == AssessmentAttempt.assessment_id
+        ).join(
+            Step, Step.step_id == Assessment.step_id
+        ).filter(Response.response_id.in_({other_id for _, other_id, _ in scored}))
+    }
+
+    return [
+        {**context[other_id]._asdict(), 'own_id': own_id, 'similarity': similarity}
+        for own_id, other_id, similarity in scored
+        if other_id in context
+    ]
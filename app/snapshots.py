@@ -0,0 +1,79 @@
+"""
+On-disk snapshots of finalized assessment attempts
+
+Approved attempts are read-only, so the rendered body of their view page
+is written to SNAPSHOT_DIR once and served from disk afterwards. Files are
+keyed by attempt id and a content version (a hash of the attempt's
+validator row and the snapshot templates), so anything that changes the
+page also changes the key.
+"""
+import os
+import shutil
+import tempfile
+from hashlib import sha1
+
+from flask import current_app
+
+from app.conditional import make_etag
+
+# Templates whose output is stored; editing them invalidates every snapshot
+SNAPSHOT_TEMPLATES = ('view_attempt_body.html', 'view_attempt_print.html')
+
+
+def snapshot_version(validator):
+    """Content version of an attempt page: its validator row plus the template sources"""
+    templates_hash = current_app.extensions.get('snapshot_templates_hash')
+    if templates_hash is None:
+        jinja_env = current_app.jinja_env
+        sources = [jinja_env.loader.get_source(jinja_env, name)[0] for name in SNAPSHOT_TEMPLATES]
+        templates_hash = sha1(''.join(sources).encode('utf-8')).hexdigest()
+        current_app.extensions['snapshot_templates_hash'] = templates_hash
+
+    return make_etag(templates_hash, *validator)
+
+
+def _attempt_dir(attempt_id):
+    return os.path.join(current_app.config['SNAPSHOT_DIR'], str(int(attempt_id)))
+
+
+def _snapshot_path(attempt_id, version, variant):
+    return os.path.join(_attempt_dir(attempt_id), f'{variant}-{version}.html')
+
+
+def load_snapshot(attempt_id, version, variant='view'):
+    """Return the stored HTML for this attempt version, or None"""
+    try:
+        with open(_snapshot_path(attempt_id, version, variant), encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def save_snapshot(attempt_id, version, html, variant='view'):
+    """
+    Write a snapshot atomically and drop older versions of the same variant.
+
+    Failures are logged and ignored - a missing snapshot only means the page
+    is rendered from the database next time.
+    """
+    directory = _attempt_dir(attempt_id)
+    try:
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(html)
+        target = _snapshot_path(attempt_id, version, variant)
+        os.replace(tmp_path, target)
+
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.startswith(f'{variant}-') and path != target:
+                os.remove(path)
+    except OSError as e:
+        current_app.logger.error(f'Snapshot write failed: attempt_id={attempt_id}, error={str(e)}')
+
+
+def invalidate_snapshots(attempt_id):
+    """Remove every stored snapshot of an attempt (e.g. when it is reopened)"""
+    shutil.rmtree(_attempt_dir(attempt_id), ignore_errors=True)
@@ -0,0 +1,276 @@
+"""
+Structured, non-blocking logging for the CBT Application
+
+Records are formatted as JSON lines and handed to a background thread
+through a queue, so file writes and log rotation never happen inside a
+request. Request context (request id, user, endpoint) is captured on the
+request thread before the record is queued.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import g, has_request_context, request
+
+from app.profiling import timings_as_ms
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach request id, user and endpoint to records logged during a request"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = getattr(g, 'request_id', None)
+            record.endpoint = request.endpoint
+            record.method = request.method
+            record.path = request.path
+
+            # Use the user Flask-Login already loaded - never trigger a query here
+            user = getattr(g, '_login_user', None)
+            record.user = user.get_id() if user is not None and user.is_authenticated else None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Sample noisy log levels per call site.
+
+    Only records logged with extra={'sample': True} are sampled (e.g. the
+    404 handler's warning); everything else, such as failed logins and
+    unauthorized access, is always kept. For each level in `rates`, the
+    first `burst` records from a call site in each `window` seconds pass
+    through, then only one in every `rate`. The next record that passes
+    carries a `suppressed` count of what was dropped.
+    """
+
+    def __init__(self, rates, burst=20, window=60):
+        super().__init__()
+        self.rates = {logging.getLevelName(level.upper()): rate for level, rate in rates.items()}
+        self.burst = burst
+        self.window = window
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno)
+        if not getattr(record, 'sample', False) or not rate or rate <= 1:
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+
+        with self._lock:
+            window_start, seen, suppressed = self._sites.get(key, (now, 0, 0))
+            if now - window_start >= self.window:
+                window_start, seen = now, 0
+
+            seen += 1
+            keep = seen <= self.burst or (seen - self.burst) % rate == 0
+            if keep:
+                if suppressed:
+                    record.suppressed = suppressed
+                suppressed = 0
+            else:
+                suppressed += 1
+
+            self._sites[key] = (window_start, seen, suppressed)
+
+        return keep
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON objects"""
+
+    # Optional attributes copied from the record when present
+    context_fields = ('request_id', 'user', 'endpoint', 'method', 'path',
+                      'status', 'duration_ms', 'timing', 'suppressed', 'event')
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'module': record.module,
+            'message': record.getMessage(),
+        }
+
+        for field in self.context_fields:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+
+        return json.dumps(entry, default=str)
+
+
+class StructuredQueueHandler(QueueHandler):
+    """
+    Queue handler that keeps records structured.
+
+    The stock QueueHandler flattens the record into a pre-formatted string;
+    here only the message and traceback are rendered so the JSON formatter
+    on the listener thread still sees the context attributes.
+    """
+
+    listener = None
+
+    def prepare(self, record):
+        message = record.getMessage()
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        return record
+
+
+class LockingRotatingFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler that is safe when several gunicorn workers share a file.
+
+    Writes and rollovers are serialized with an fcntl lock on a sidecar
+    .lock file, and a worker reopens its stream when another worker has
+    already rotated the file out from under it.
+    """
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self._lock_file = open(f'{self.baseFilename}.lock', 'a') if fcntl else None
+
+    def _stream_is_stale(self):
+        try:
+            current = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            return True
+        opened = os.fstat(self.stream.fileno())
+        return (current.st_ino, current.st_dev) != (opened.st_ino, opened.st_dev)
+
+    def emit(self, record):
+        if self._lock_file is None:
+            return super().emit(record)
+
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            if self.stream is not None and self._stream_is_stale():
+                self.stream.close()
+                self.stream = self._open()
+            super().emit(record)
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def close(self):
+        super().close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def reopen(self):
+        """Open fresh file handles in a forked worker (flock locks are shared with the parent's)"""
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = self._open()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = open(f'{self.baseFilename}.lock', 'a')
+
+
+def start_queue_logging(logger, handler, filters=()):
+    """
+    Route `logger` through a queue to `handler` on a background thread.
+
+    Any pipeline previously installed on the logger is stopped first, so
+    calling create_app() more than once in a process doesn't duplicate lines.
+    """
+    for existing in list(logger.handlers):
+        if isinstance(existing, StructuredQueueHandler):
+            logger.removeHandler(existing)
+            existing.listener.stop()
+            for handler_ in existing.listener.handlers:
+                handler_.close()
+
+    queue_handler = StructuredQueueHandler(queue.SimpleQueue())
+    queue_handler.setLevel(handler.level)
+    for log_filter in filters:
+        queue_handler.addFilter(log_filter)
+
+    listener = QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+    queue_handler.listener = listener
+    listener.start()
+
+    logger.addHandler(queue_handler)
+    return listener
+
+
+def restart_queue_logging(logger):
+    """
+    Restart `logger`'s queue pipeline in a forked process.
+
+    The listener thread doesn't survive fork() and the queue may have been
+    mid-operation in the parent, so the child gets a new queue, its own
+    file handles and a new listener thread. Returns how many were restarted.
+    """
+    restarted = 0
+    for existing in logger.handlers:
+        if isinstance(existing, StructuredQueueHandler):
+            listener = existing.listener
+            existing.queue = listener.queue = queue.SimpleQueue()
+            for handler in listener.handlers:
+                if isinstance(handler, LockingRotatingFileHandler):
+                    handler.reopen()
+            listener._thread = None
+            listener.start()
+            restarted += 1
+    return restarted
+
+
+def init_request_logging(app):
+    """Assign each request an id and log one structured line when it finishes"""
+
+    @app.before_request
+    def start_request_log():
+        g.request_id = request.headers.get('X-Request-ID', '')[:64] or os.urandom(8).hex()
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def add_request_id(response):
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
+            g.response_status = response.status_code
+        return response
+
+    # Logged at teardown so the session save is included in the breakdown.
+    # A streamed response (stream_with_context) can tear down twice; popping
+    # the start time keeps it to one line
+    @app.teardown_request
+    def finish_request_log(error=None):
+        start = g.pop('request_start', None)
+        if start is None or not app.config['LOG_REQUESTS']:
+            return
+
+        status = g.get('response_status', 500)
+        app.logger.info(
+            '%s %s %s', request.method, request.path, status,
+            extra={
+                'event': 'request',
+                'status': status,
+                'duration_ms': round((time.perf_counter() - start) * 1000, 2),
+                'timing': timings_as_ms(g.get('server_timing', {}))
+            }
+        )
@@ -0,0 +1,63 @@
+"""
+Background job functions for the CBT Application
+
+Each function is registered under a name with @task and queued with
+app.jobs.enqueue(name, payload). They run in a worker process inside an
+app context; raising marks the attempt as failed and schedules a retry.
+"""
+from flask import current_app
+
+from app.jobs import task
+
+
+@task('snapshot_attempt')
+def snapshot_attempt(attempt_id):
+    """Pre-render the view and print snapshots of an approved attempt"""
+    from app.conditional import attempt_validator
+    from app.routes.admin import render_attempt_body, render_attempt_print
+    from app.sharding import use_shard, shard_for_id
+
+    use_shard(shard_for_id(attempt_id))
+    with current_app.test_request_context():
+        validator = attempt_validator(attempt_id)
+        if validator is None or validator.status != 'approved':
+            return
+        render_attempt_body(attempt_id, validator)
+        render_attempt_print(attempt_id, validator)
+
+
+@task('index_attempt')
+def index_attempt(attempt_id):
+    """Compute the similarity signatures of a submitted attempt's written answers"""
+    from app import db
+    from app.similarity import index_attempt as index
+    from app.sharding import use_shard, shard_for_id
+
+    use_shard(shard_for_id(attempt_id))
+    index(attempt_id)
+    db.session.commit()
+
+
+@task('prune_review_feed')
+def prune_review_feed(days=7):
+    """Trim old review queue events"""
+    from app.review_feed import prune_events
+
+    prune_events(days)
+
+
+@task('sweep_sessions')
+def sweep_sessions():
+    """Delete expired server-side sessions"""
+    store = getattr(current_app.session_interface, 'store', None)
+    if store is not None:
+        store.sweep()
+
+
+@task('rollup_question_times')
+def rollup_question_times(window_days=None, retention_days=None):
+    """Rebuild per-question time statistics and trim old timing events"""
+    from app.dwell import prune_events, rollup_question_times as rollup
+
+    rollup(window_days)
+    prune_events(retention_days)
@@ -0,0 +1,126 @@
+"""
+Participant timeline service for the CBT Application
+
+A participant's attempt history as flat projected rows (step number and
+reviewer name joined in, no ORM objects or lazy loads), one query per
+page, paginated by attempt id. Alongside it a small per-step summary,
+cached per participant and recomputed whenever their attempts change.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import current_app
+
+# Participants whose summary is kept per worker
+SUMMARY_CACHE_SIZE = 256
+
+_summary_lock = threading.Lock()
+
+
+def participant_timeline(state_id, before=None, limit=None):
+    """
+    One page of a participant's attempts, newest first.
+
+    `before` is the cursor: the attempt id the previous page ended at.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    from app import db
+    from app.models import Admin, Assessment, AssessmentAttempt, Step
+    from app.projections import TimelineRow
+
+    limit = limit or current_app.config['TIMELINE_PAGE_SIZE']
+
+    query = db.session.query(
+        AssessmentAttempt.attempt_id,
+        AssessmentAttempt.attempt_number,
+        AssessmentAttempt.status,
+        AssessmentAttempt.started_at,
+        AssessmentAttempt.submitted_at,
+        AssessmentAttempt.reviewed_at,
+        Step.step_number,
+        Admin.first_name.label('reviewer_first_name'),
+        Admin.last_name.label('reviewer_last_name')
+    ).outerjoin(
+        Assessment, Assessment.assessment_id == AssessmentAttempt.assessment_id
+    ).outerjoin(
+        Step, Step.step_id == Assessment.step_id
+    ).outerjoin(
+        Admin, Admin.admin_id == AssessmentAttempt.reviewed_by
+    ).filter(
+        AssessmentAttempt.state_id == state_id
+    )
+    if before is not None:
+        query = query.filter(AssessmentAttempt.attempt_id < before)
+
+    # One extra row tells whether there is another page
+    rows = [TimelineRow._make(row) for row in query.order_by(AssessmentAttempt.attempt_id.desc()).limit(limit + 1)]
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1].attempt_id
+    return rows, None
+
+
+def _compute_summary(state_id):
+    from sqlalchemy import case, func
+    from app import db
+    from app.models import Assessment, AssessmentAttempt, Step
+
+    approved = AssessmentAttempt.status == 'approved'
+    steps = db.session.query(
+        Step.step_number,
+        func.count(AssessmentAttempt.attempt_id).label('attempts'),
+        func.count(case((approved, 1))).label('approved'),
+        func.min(AssessmentAttempt.started_at).label('first_started_at'),
+        func.max(case((approved, AssessmentAttempt.reviewed_at))).label('approved_at')
+    ).join(
+        Assessment, Assessment.assessment_id == AssessmentAttempt.assessment_id
+    ).join(
+        Step, Step.step_id == Assessment.step_id
+    ).filter(
+        AssessmentAttempt.state_id == state_id
+    ).group_by(Step.step_number).order_by(Step.step_number).all()
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    per_step = []
+    for row in steps:
+        started = row.first_started_at.replace(tzinfo=None) if row.first_started_at else None
+        finished = row.approved_at.replace(tzinfo=None) if row.approved_at else now
+        per_step.append({
+            'step_number': row.step_number,
+            'completed': row.approved > 0,
+            'attempts': row.attempts,
+            'revisions': row.attempts - 1,
+            'days': (finished - started).days if started else None
+        })
+
+    return {
+        'steps_completed': sum(1 for step in per_step if step['completed']),
+        'steps': per_step
+    }
+
+
+def timeline_summary(state_id, version):
+    """
+    Steps completed, revisions and days per step for a participant.
+
+    `version` identifies the state of the participant's attempts (e.g. the
+    profile page's ETag); a cached summary is reused only while it matches,
+    so any change to an attempt - from any worker - refreshes it.
+    """
+    cache = current_app.extensions.setdefault('timeline_summaries', OrderedDict())
+
+    with _summary_lock:
+        cached = cache.get(state_id)
+        if cached is not None and cached[0] == version:
+            cache.move_to_end(state_id)
+            return cached[1]
+
+    summary = _compute_summary(state_id)
+
+    with _summary_lock:
+        cache[state_id] = (version, summary)
+        cache.move_to_end(state_id)
+        while len(cache) > SUMMARY_CACHE_SIZE:
+            cache.popitem(last=False)
+
+    return summary
@@ -0,0 +1,132 @@
+"""
+Pre-fork warm-up for the CBT Application
+
+With gunicorn's preload_app (see gunicorn.conf.py) the app is built once
+in the master. warm_app() then does the work each worker would otherwise
+do on its first requests: configuring the mappers, compiling templates
+and compiling the curriculum queries. It freezes the result out of the
+garbage collector's reach, so forked workers share those pages
+copy-on-write instead of each building and dirtying its own copy.
+reset_after_fork() gives each worker its own database connections,
+logging thread and file handles.
+"""
+import gc
+import os
+import time
+
+
+def warm_app(app):
+    """Warm `app` in the gunicorn master before forking; returns [(phase, seconds)]"""
+    from sqlalchemy.orm import configure_mappers
+    from app import db
+    from app.models import Step, Assessment, Question, MultipleChoiceOption
+    from app.templating import precompile_templates
+
+    timings = []
+    started = time.perf_counter()
+
+    def mark(phase):
+        nonlocal started
+        now = time.perf_counter()
+        timings.append((phase, now - started))
+        started = now
+
+    configure_mappers()
+    mark('mappers')
+
+    precompile_templates(app)
+    mark('templates')
+
+    # The first run of each query shape compiles its SQL into the engine's
+    # statement cache, which the workers inherit
+    with app.app_context():
+        Step.query.order_by(Step.step_number).all()
+        Assessment.query.all()
+        Question.query.order_by(Question.assessment_id, Question.question_order).all()
+        MultipleChoiceOption.query.all()
+        db.session.remove()
+
+        # The master must not hand pooled connections to its children
+        for engine in db.engines.values():
+            engine.dispose()
+    mark('curriculum')
+
+    # Keep the collector from touching (and so copying) the master's objects
+    gc.collect()
+    gc.freeze()
+    mark('gc_freeze')
+
+    return timings
+
+
+def reset_after_fork(app):
+    """
+    Give a freshly forked worker its own connections, threads and file
+    handles; returns what was reset, for the worker's boot log line.
+    """
+    from app import db
+    from app.structured_logging import restart_queue_logging
+
+    with app.app_context():
+        # close=False: the sockets belong to the parent; just forget them
+        engines = list(db.engines.values())
+        for engine in engines:
+            engine.dispose(close=False)
+
+    listeners = restart_queue_logging(app.logger)
+
+    # Threads don't survive fork; gather() starts a new pool on demand
+    app.extensions.pop('shard_executor', None)
+
+    # The audit and question timing flush threads didn't survive the fork either
+    buffers = [name for name in ('audit', 'dwell') if name in app.extensions]
+    for name in buffers:
+        app.extensions[name].reset()
+
+    # Query shapes recorded in the master would be counted once per worker
+    recorder = app.extensions.get('query_recorder')
+    if recorder is not None:
+        recorder.shapes.clear()
+        recorder.statements = 0
+
+    return {'engines': len(engines), 'log_listeners': listeners, 'buffers': buffers}
+
+
+def process_memory(pid='self'):
+    """
+    Memory of a process in KiB from /proc: rss, pss and private.
+
+    pss counts shared pages divided among the processes sharing them, so
+    summing it over the workers gives the instance's real footprint;
+    private is what the worker does not share with the master. Returns
+    None where /proc isn't available.
+    """
+    fields = {'Rss': 'rss', 'Pss': 'pss', 'Private_Clean': 'private', 'Private_Dirty': 'private'}
+    memory = {'rss': 0, 'pss': 0, 'private': 0}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in fields:
+                    memory[fields[key]] += int(value.split()[0])
+    except (FileNotFoundError, PermissionError):
+        return None
+    return memory
+
+
+def child_pids(parent_pid):
+    """Pids of a process's children (e.g. the gunicorn master's workers)"""
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+        except (FileNotFoundError, PermissionError):
+            continue
+        # The command name may contain spaces; fields after it are fixed
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        if ppid == parent_pid:
+            children.append(int(entry))
+    return sorted(children)
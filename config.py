@@ -1,4 +1,5 @@
 import os
+from datetime import timedelta
 
 # Get the base directory of the app
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -11,18 +12,115 @@ class Config:
         'DATABASE_URI') or f'sqlite:///{os.path.join(basedir, "instance", "cbt_assessment.db")}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Server-side sessions: the cookie holds only an opaque id. 'sqlite' is a
+    # file local to the instance, 'database' the shared application database;
+    # 'cookie' restores Flask's signed cookie sessions
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND') or 'sqlite'
+    SESSION_DB_PATH = os.environ.get('SESSION_DB_PATH') or os.path.join(basedir, 'instance', 'sessions.db')
+    SESSION_SWEEP_INTERVAL = 3600
+    PERMANENT_SESSION_LIFETIME = timedelta(hours=12)  # idle expiry of server-side sessions
+
+    # Attempts per page on the participant profile timeline
+    TIMELINE_PAGE_SIZE = 25
+
+    # Review queue server-sent events. Sync workers answer and close (the
+    # browser reconnects after SSE_RETRY_MS); hold streams open only on async workers
+    SSE_RETRY_MS = 5000
+    SSE_HOLD_SECONDS = 0
+    SSE_POLL_SECONDS = 2
+    # Longest a feed event's transaction may take to commit after inserting
+    # it; the stream waits this long at a gap in event ids (see events_since())
+    SSE_SETTLE_SECONDS = 10
+
+    # Green (gevent/eventlet) workers - see app/serving.py. Every greenlet
+    # shares a bounded pool; past it, requests wait up to the timeout
+    ASYNC_DB_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE') or 10)
+    ASYNC_DB_MAX_OVERFLOW = int(os.environ.get('ASYNC_DB_MAX_OVERFLOW') or 10)
+    ASYNC_DB_POOL_TIMEOUT = 10
+    ASYNC_SSE_HOLD_SECONDS = 55  # Under typical 60s proxy idle timeouts
+
+    # Background jobs (`flask jobs worker`)
+    JOB_MAX_ATTEMPTS = 5
+    JOB_RETRY_BASE_SECONDS = 30  # Doubles with every failed attempt
+    JOB_LOCK_TIMEOUT = 900  # Running longer than this means the worker died; requeue
+
+    # Participant data split across databases by state code (JSON; see
+    # app/sharding.py). Unset keeps everything in SQLALCHEMY_DATABASE_URI
+    SHARDS = os.environ.get('SHARDS')
+
+    # Flag written responses at least this similar (estimated Jaccard) to another's
+    SIMILARITY_THRESHOLD = 0.7
+
+    # Admin email checks (see app/email_validation.py). Sites without outside
+    # DNS set EMAIL_CHECK_DELIVERABILITY=false to check syntax only
+    EMAIL_CHECK_DELIVERABILITY = os.environ.get('EMAIL_CHECK_DELIVERABILITY', 'true').lower() != 'false'
+    EMAIL_DNS_TIMEOUT = 3  # Seconds per domain lookup
+    EMAIL_DOMAIN_CACHE_SECONDS = 6 * 3600
+
+    # Caseload rebalancing (see app/rebalance.py): a pending submission counts
+    # this many times a participant; clinicians within the tolerance of the
+    # average are left alone
+    REBALANCE_PENDING_WEIGHT = 2
+    REBALANCE_TOLERANCE = 0.15
+    REBALANCE_MAX_MOVES = 20
+
+    # Audit events are buffered and inserted in batches of this size, or
+    # at least this often (see app/audit.py)
+    AUDIT_BUFFER_SIZE = 50
+    AUDIT_FLUSH_SECONDS = 5
+
+    # Question timing beacons are buffered and inserted in batches of this
+    # size, or at least this often; longer visits are ignored as pages left
+    # open. Statistics cover the last QUESTION_TIME_WINDOW_DAYS of events,
+    # and older events are deleted after QUESTION_EVENT_RETENTION_DAYS
+    # (see app/dwell.py)
+    DWELL_BUFFER_SIZE = 500
+    DWELL_FLUSH_SECONDS = 10
+    DWELL_MAX_SECONDS = 2 * 3600
+    QUESTION_TIME_WINDOW_DAYS = 30
+    QUESTION_EVENT_RETENTION_DAYS = 90
+
+    # Record normalized query shapes for `flask indexes advise` (off when unset)
+    QUERY_CAPTURE_DIR = os.environ.get('QUERY_CAPTURE_DIR')
+
     # Logging configuration
-    LOG_DIR = os.path.join(basedir, 'logs')
+    LOG_DIR = os.environ.get('LOG_DIR') or os.path.join(basedir, 'logs')
     LOG_FILE = os.path.join(LOG_DIR, 'cbt_assessment.log')
     LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
     LOG_MAX_BYTES = 10 * 1024 * 1024  # 10MB
     LOG_BACKUP_COUNT = 10
+    LOG_REQUESTS = True
+    LOG_TO_STDERR = True
+
+    # Only ever disabled on a load-test instance (`flask profile load`)
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', 'true').lower() != 'false'
+
+    # Per-phase breakdown (db, render, hash, session) in a Server-Timing
+    # header; outside debug mode only supervisors receive it
+    SERVER_TIMING = True
+
+    # Per-level sampling of records logged with extra={'sample': True}
+    # (repeated 404 warnings): after LOG_SAMPLE_BURST records per call site
+    # per minute, keep only 1 in N. Security warnings are never sampled.
+    LOG_SAMPLING = {'WARNING': 10}
+    LOG_SAMPLE_BURST = 20
+
+    # Template caching - compiled Jinja bytecode shared by all workers
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR') or os.path.join(basedir, 'instance', 'jinja_cache')
+    TEMPLATE_PRELOAD = True
+
+    # Fingerprinted, precompressed static files written by `flask assets build`
+    STATIC_BUILD_DIR = os.environ.get('STATIC_BUILD_DIR') or os.path.join(basedir, 'instance', 'static')
+
+    # Rendered pages of approved attempts, served from disk
+    SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR') or os.path.join(basedir, 'instance', 'snapshots')
 
 
 class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
     LOG_LEVEL = 'DEBUG'
+    TEMPLATE_PRELOAD = False
 
 
 class ProductionConfig(Config):
@@ -36,3 +134,24 @@ class ProductionConfig(Config):
             )
 
     DEBUG = False
+    TEMPLATES_AUTO_RELOAD = False
+    LOG_TO_STDERR = False
+
+    # Shared by every instance behind the load balancer
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND') or 'database'
+
+    # Off unless asked for; the log line keeps the same breakdown
+    SERVER_TIMING = os.environ.get('SERVER_TIMING', 'false').lower() == 'true'
+
+    # Recycle pooled connections before RDS drops idle ones
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_recycle': 1800,
+    }
+
+
+# Selected by create_app() from FLASK_CONFIG / FLASK_ENV
+config = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'default': DevelopmentConfig,
+}
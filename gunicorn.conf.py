@@ -0,0 +1,84 @@
+"""
+Gunicorn configuration for the CBT Application
+
+Loaded automatically by `gunicorn run:app` from the project root (see the
+Procfile). The app is built once in the master and warmed before
+forking, so every worker starts with compiled templates, configured
+mappers and cached curriculum queries, shared copy-on-write. Workers are
+recycled after MAX_REQUESTS (with jitter, so they don't all restart at
+once). A recycled worker is forked from the warm master rather than
+built from scratch.
+
+Environment:
+    PORT                   listen port (8000)
+    WEB_CONCURRENCY        worker processes (3)
+    GUNICORN_THREADS       threads per sync worker (2)
+    GUNICORN_WORKER_CLASS  gthread (default) or gevent, see app/serving.py
+    GUNICORN_MAX_REQUESTS  requests before a worker is recycled (1000; 0 = never)
+"""
+import os
+import threading
+import time
+
+bind = f":{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 3))
+threads = int(os.environ.get('GUNICORN_THREADS', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+worker_connections = 500  # gevent only: concurrent requests per worker
+
+preload_app = True
+
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+graceful_timeout = 30  # A recycled or stopped worker finishes its requests first
+timeout = 30
+
+if worker_class == 'gevent':
+    # The app is imported in the master (preload), so patch before it is
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def when_ready(server):
+    """Warm the preloaded app once, before any worker is forked"""
+    from app.warmup import warm_app, process_memory
+
+    for phase, seconds in warm_app(server.app.wsgi()):
+        server.log.info(f'Warm-up {phase}: {seconds * 1000:.1f} ms')
+    memory = process_memory()
+    if memory:
+        server.log.info(f'Master ready: rss={memory["rss"]} KiB')
+
+
+def post_fork(server, worker):
+    """Reset what must not be shared with the master"""
+    from app.warmup import reset_after_fork
+
+    reset = reset_after_fork(server.app.wsgi())
+    worker.log.info(
+        f'Worker {worker.pid} reset: engines={reset["engines"]}, log_listeners={reset["log_listeners"]}, '
+        f'buffers={",".join(reset["buffers"])}'
+    )
+    worker.first_request_lock = threading.Lock()
+    worker.first_request_done = False
+
+
+def pre_request(worker, req):
+    req.started_at = time.perf_counter()
+
+
+def post_request(worker, req, environ, resp):
+    """Log each worker's first request: its latency and the worker's memory once it has served"""
+    with worker.first_request_lock:
+        if worker.first_request_done:
+            return
+        worker.first_request_done = True
+
+    from app.warmup import process_memory
+
+    elapsed = (time.perf_counter() - req.started_at) * 1000
+    memory = process_memory() or {}
+    worker.log.info(
+        f'Worker {worker.pid} first request: path={req.path}, duration_ms={elapsed:.1f}, '
+        f'rss={memory.get("rss")} KiB, pss={memory.get("pss")} KiB, private={memory.get("private")} KiB'
+    )
@@ -0,0 +1,34 @@
+"""
+Database Migration Script: Add Audit Trail
+
+Creates the append-only audit_events table, with the triggers that
+refuse UPDATE and DELETE on it. New databases get it from
+db.create_all(); existing deployments run this once.
+
+Usage:
+    python migrate_add_audit_events.py
+"""
+
+import sys
+
+from app import create_app, db
+from app.models import AuditEvent
+
+
+def main():
+    """Run the migration"""
+    app = create_app()
+    try:
+        with app.app_context():
+            # checkfirst makes re-running the migration a no-op
+            AuditEvent.__table__.create(db.engine, checkfirst=True)
+        print("\n✅ Migration completed successfully!")
+        print("   Table 'audit_events' is present.")
+        return 0
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
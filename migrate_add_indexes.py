@@ -0,0 +1,80 @@
+"""
+Database Migration Script: Add Recommended Indexes
+
+Generated by `flask indexes advise --write` (839 captured calls
+across 133 query shapes, plus indexes declared on the models).
+
+The capture is a scripted development workload (participant assessment,
+review, manage pages), EXPLAINed against a SQLite copy of the schema
+without these indexes. Only the question page's multiple_choice_options
+scan showed up in it; the other declared indexes cover foreign-key and
+caseload filters that a dataset of a few rows can't show. The advisor's
+other suggestions from that capture (indexes on tables of a few rows)
+were left out; rerun it on a production capture before adding more.
+
+- ix_users_assigned_admin_id: users (assigned_admin_id) - declared on the models
+- idx_state_status: assessment_attempts (state_id, status) - declared on the models
+- ix_assessment_attempts_reviewed_by: assessment_attempts (reviewed_by) - declared on the models
+- ix_multiple_choice_options_question_id: multiple_choice_options (question_id) - declared on the models, 10 calls
+- ix_responses_question_id: responses (question_id) - declared on the models
+
+Usage:
+    python migrate_add_indexes.py
+
+For production (AWS RDS), run these SQL commands via psql. CONCURRENTLY
+builds without blocking writes and cannot run inside a transaction:
+
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_assigned_admin_id ON users (assigned_admin_id);
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_state_status ON assessment_attempts (state_id, status);
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_assessment_attempts_reviewed_by ON assessment_attempts (reviewed_by);
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_multiple_choice_options_question_id ON multiple_choice_options (question_id);
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_responses_question_id ON responses (question_id);
+"""
+
+import os
+import sys
+from sqlalchemy import create_engine, text
+
+# Get database URL from environment or use local SQLite
+DATABASE_URL = os.environ.get('DATABASE_URL') or os.environ.get('DATABASE_URI') or \
+               'sqlite:///instance/cbt_assessment.db'
+
+POSTGRESQL = [
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_assigned_admin_id ON users (assigned_admin_id)',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_state_status ON assessment_attempts (state_id, status)',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_assessment_attempts_reviewed_by ON assessment_attempts (reviewed_by)',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_multiple_choice_options_question_id ON multiple_choice_options (question_id)',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_responses_question_id ON responses (question_id)',
+]
+
+SQLITE = [
+    'CREATE INDEX IF NOT EXISTS ix_users_assigned_admin_id ON users (assigned_admin_id)',
+    'CREATE INDEX IF NOT EXISTS idx_state_status ON assessment_attempts (state_id, status)',
+    'CREATE INDEX IF NOT EXISTS ix_assessment_attempts_reviewed_by ON assessment_attempts (reviewed_by)',
+    'CREATE INDEX IF NOT EXISTS ix_multiple_choice_options_question_id ON multiple_choice_options (question_id)',
+    'CREATE INDEX IF NOT EXISTS ix_responses_question_id ON responses (question_id)',
+]
+
+
+def main():
+    """Run the migration"""
+    try:
+        engine = create_engine(DATABASE_URL)
+        statements = POSTGRESQL if engine.dialect.name == 'postgresql' else SQLITE
+
+        # Autocommit - CREATE INDEX CONCURRENTLY refuses to run in a transaction
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            for statement in statements:
+                print(f"  {statement}")
+                conn.execute(text(statement))
+
+        print("\n✅ Migration completed successfully!")
+        return 0
+
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
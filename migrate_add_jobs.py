@@ -0,0 +1,38 @@
+"""
+Database Migration Script: Add Background Job Queue
+
+Creates the jobs table that request handlers queue work into and
+`flask jobs worker` runs. New databases get it from
+db.create_all(); existing deployments run this once. Re-running it on a
+jobs table created before uq_job_pending_dedup_key adds that index, which
+keeps two pending jobs from sharing a dedup_key.
+
+Usage:
+    python migrate_add_jobs.py
+"""
+
+import sys
+
+from app import create_app, db
+from app.models import Job
+
+
+def main():
+    """Run the migration"""
+    app = create_app()
+    try:
+        with app.app_context():
+            # checkfirst makes re-running the migration a no-op
+            Job.__table__.create(db.engine, checkfirst=True)
+            for index in Job.__table__.indexes:
+                index.create(db.engine, checkfirst=True)
+        print("\n✅ Migration completed successfully!")
+        print("   Table 'jobs' and its indexes are present.")
+        return 0
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,36 @@
+"""
+Database Migration Script: Add Question Timing
+
+Creates the question_events table, which collects how long participants
+spend on each question page, and question_time_stats, the per-question
+statistics `flask dwell rollup` builds from it. New databases get both
+from db.create_all(); existing deployments run this once.
+
+Usage:
+    python migrate_add_question_events.py
+"""
+
+import sys
+
+from app import create_app, db
+from app.models import QuestionEvent, QuestionTimeStat
+
+
+def main():
+    """Run the migration"""
+    app = create_app()
+    try:
+        with app.app_context():
+            # checkfirst makes re-running the migration a no-op
+            QuestionEvent.__table__.create(db.engine, checkfirst=True)
+            QuestionTimeStat.__table__.create(db.engine, checkfirst=True)
+        print("\n✅ Migration completed successfully!")
+        print("   Tables 'question_events' and 'question_time_stats' are present.")
+        return 0
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
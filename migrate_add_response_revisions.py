@@ -0,0 +1,36 @@
+"""
+Database Migration Script: Add Response Revision History
+
+Creates the response_revisions table, which keeps every version of a
+written answer so the review page can show what a participant changed
+after `needs_revision`. New databases get it from db.create_all();
+existing deployments run this once. Answers written before it start
+their history the first time they are revised.
+
+Usage:
+    python migrate_add_response_revisions.py
+"""
+
+import sys
+
+from app import create_app, db
+from app.models import ResponseRevision
+
+
+def main():
+    """Run the migration"""
+    app = create_app()
+    try:
+        with app.app_context():
+            # checkfirst makes re-running the migration a no-op
+            ResponseRevision.__table__.create(db.engine, checkfirst=True)
+        print("\n✅ Migration completed successfully!")
+        print("   Table 'response_revisions' is present.")
+        return 0
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
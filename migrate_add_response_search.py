@@ -0,0 +1,39 @@
+"""
+Database Migration Script: Add Response Full-Text Search
+
+Creates the search index over written responses - an FTS5 table on
+SQLite, a GIN index on to_tsvector(response_text) on PostgreSQL - and
+fills it from the existing responses. New databases get it from
+db.create_all(); existing deployments run this once.
+
+Usage:
+    python migrate_add_response_search.py
+"""
+
+import sys
+
+from app import create_app, db
+from app.search import ensure_search_index, rebuild_search_index
+
+
+def main():
+    """Run the migration"""
+    app = create_app()
+    try:
+        with app.app_context():
+            with db.engine.begin() as connection:
+                created = ensure_search_index(connection)
+                # Refilling is idempotent, so re-running the migration is safe
+                indexed = rebuild_search_index(connection)
+        print("\n✅ Migration completed successfully!")
+        print(f"   Search index {'created' if created else 'already present'}.")
+        if indexed is not None:
+            print(f"   Indexed {indexed} responses.")
+        return 0
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
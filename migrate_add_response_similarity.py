@@ -0,0 +1,37 @@
+"""
+Database Migration Script: Add Response Similarity Index
+
+Creates the response_signatures and response_bands tables used to flag
+near-duplicate written responses on the review page. New databases get
+them from db.create_all(); existing deployments run this once, then
+index the existing responses with `flask similarity index`.
+
+Usage:
+    python migrate_add_response_similarity.py
+"""
+
+import sys
+
+from app import create_app, db
+from app.models import ResponseSignature, ResponseBand
+
+
+def main():
+    """Run the migration"""
+    app = create_app()
+    try:
+        with app.app_context():
+            # checkfirst makes re-running the migration a no-op
+            ResponseSignature.__table__.create(db.engine, checkfirst=True)
+            ResponseBand.__table__.create(db.engine, checkfirst=True)
+        print("\n✅ Migration completed successfully!")
+        print("   Tables 'response_signatures' and 'response_bands' are present.")
+        print("   Next: flask --app run similarity index")
+        return 0
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,34 @@
+"""
+Database Migration Script: Add Review Queue Change Feed
+
+Creates the review_queue_events table that admin dashboards follow over
+server-sent events (/admin/queue/events). New databases get it from
+db.create_all(); existing deployments run this once.
+
+Usage:
+    python migrate_add_review_queue_events.py
+"""
+
+import sys
+
+from app import create_app, db
+from app.models import ReviewQueueEvent
+
+
+def main():
+    """Run the migration"""
+    app = create_app()
+    try:
+        with app.app_context():
+            # checkfirst makes re-running the migration a no-op
+            ReviewQueueEvent.__table__.create(db.engine, checkfirst=True)
+        print("\n✅ Migration completed successfully!")
+        print("   Table 'review_queue_events' is present.")
+        return 0
+    except Exception as e:
+        print(f"\n❌ Migration failed: {e}")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Settings are read from the environment when config.py is imported
+_tmp = tempfile.mkdtemp(prefix='cbt-tests-')
+os.environ.update({
+    'DATABASE_URL': f'sqlite:///{os.path.join(_tmp, "app.db")}',
+    'SESSION_DB_PATH': os.path.join(_tmp, 'sessions.db'),
+    'LOG_DIR': os.path.join(_tmp, 'logs'),
+    'TEMPLATE_CACHE_DIR': os.path.join(_tmp, 'jinja_cache'),
+    'STATIC_BUILD_DIR': os.path.join(_tmp, 'static'),
+    'SNAPSHOT_DIR': os.path.join(_tmp, 'snapshots'),
+    'EMAIL_CHECK_DELIVERABILITY': 'false',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app():
+    from werkzeug.security import generate_password_hash
+    from app import create_app, db
+    from app.models import Admin
+
+    app = create_app('development')
+    app.config.update(WTF_CSRF_ENABLED=False, RATELIMIT_ENABLED=False)
+    with app.app_context():
+        db.create_all()
+        db.session.add(Admin(admin_id='ADMIN001', first_name='Test', last_name='Supervisor',
+                             email='supervisor@example.com', password_hash=generate_password_hash('Admin123!'),
+                             role='supervisor'))
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    response = client.post('/admin/login', data={'admin_id': 'ADMIN001', 'password': 'Admin123!'})
+    assert response.status_code == 302
+    return client
@@ -0,0 +1,18 @@
+import pytest
+from flask import g
+from sqlalchemy.exc import OperationalError
+
+
+def test_failed_query_leaves_no_timing_state(app):
+    from app import db
+
+    with app.test_request_context():
+        with db.engine.connect() as conn:
+            with pytest.raises(OperationalError):
+                conn.exec_driver_sql('SELECT * FROM no_such_table')
+            conn.exec_driver_sql('SELECT 1')
+            assert 'query_start' not in conn.info
+
+        seconds, count = g.server_timing['db']
+        assert count == 1
+        assert 0 <= seconds < 1
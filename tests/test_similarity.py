@@ -0,0 +1,16 @@
+from sqlalchemy.dialects import sqlite
+
+
+def test_candidate_query_searches_the_primary_key(app):
+    from app import db
+    from app.similarity import _candidate_query
+
+    with app.app_context():
+        query = _candidate_query([(0, 12345), (3, -987654321), (15, 42)], [7, 8])
+        sql = str(query.statement.compile(dialect=sqlite.dialect(), compile_kwargs={'literal_binds': True}))
+        plan = [row[-1] for row in db.session.execute(db.text(f'EXPLAIN QUERY PLAN {sql}'))]
+
+    assert not any(step.startswith('SCAN response_bands') for step in plan), plan
+    searches = [step for step in plan if step.startswith('SEARCH response_bands')]
+    assert len(searches) == 3, plan
+    assert all('band=? AND bucket=?' in step for step in searches), plan
@@ -0,0 +1,28 @@
+import logging
+
+
+class _Capture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_event_stream_logs_one_request_line(app, admin_client):
+    capture = _Capture()
+    app.logger.addHandler(capture)
+    try:
+        response = admin_client.get('/admin/queue/events?after=0')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        response.get_data()
+        response.close()
+    finally:
+        app.logger.removeHandler(capture)
+
+    lines = [record for record in capture.records
+             if getattr(record, 'event', None) == 'request' and '/admin/queue/events' in record.getMessage()]
+    assert len(lines) == 1, [record.getMessage() for record in lines]
+    assert lines[0].status == 200